@@ -0,0 +1,85 @@
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+# run from anywhere, the package lives one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hazardous
+from hazardous import nodes
+from parser import DEFAULT_PROGRAMS, load_programs
+
+
+def count_tree(declarations):
+    node_count = 0
+    types = {}
+
+    for declaration in declarations:
+        for node in nodes.walk(declaration):
+            node_count += 1
+
+            for value in (getattr(node, name, None) for name in ('type', 'return_type')):
+                if isinstance(value, nodes.Type):
+                    types[id(value)] = value
+
+    return node_count, len(types)
+
+
+def retained(build):
+    # bytes still allocated once 'build' returned, kept alive by its result
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory used by the AST per node')
+    parser.add_argument('patterns', nargs='*', default=DEFAULT_PROGRAMS, help='Program globs relative to the repository root')
+    parser.add_argument('--copies', type=int, default=10, help='Times every program is parsed and kept alive, to get above the noise')
+    args = parser.parse_args()
+
+    programs = load_programs(args.patterns)
+
+    if not programs:
+        print("[ERROR]: No programs matched")
+        exit(1)
+
+    trees, tree_size = retained(lambda: [hazardous.Parser().parse(tokens) for _ in range(args.copies) for _, tokens in programs])
+    node_count, type_count = 0, 0
+
+    for tree in trees:
+        tree_nodes, tree_types = count_tree(tree)
+        node_count += tree_nodes
+        type_count += tree_types
+
+    print(f"programs:       {len(programs)} x {args.copies}")
+    print(f"nodes:          {node_count}")
+    print(f"distinct types: {type_count} (on declarations)")
+    print(f"tree:           {tree_size / node_count:.1f} bytes/node")
+
+    del trees
+
+    def pack():
+        # every tree is dropped as soon as it's packed, only the arena is left
+        arena = nodes.NodeArena()
+
+        for _ in range(args.copies):
+            for _, tokens in programs:
+                arena.pack(hazardous.Parser().parse(tokens))
+
+        return arena
+
+    arena, arena_size = retained(pack)
+    print(f"arena:          {arena_size / len(arena):.1f} bytes/node")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import time
+
+# run from anywhere, the package lives one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hazardous
+
+
+DEFAULT_PROGRAMS = ['compiler/main.hz', 'examples/*.hz']
+
+
+def load_programs(patterns):
+    # programs are preprocessed once up front so only the parser is measured
+    programs = []
+
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(ROOT, pattern))):
+            with open(path, "r") as f:
+                code = f.read()
+
+            scanner = hazardous.Scanner()
+            scanner.input(code, path)
+            include_dirs = [ROOT + '/', ROOT + '/include/linux/', ROOT + '/include/', os.path.dirname(path) + '/']
+            tokens = hazardous.Preprocessor().preprocess(scanner.tokens(), include_dirs, path=path)
+            programs.append((os.path.relpath(path, ROOT), tokens))
+
+    return programs
+
+
+def parses(tokens) -> bool:
+    try:
+        hazardous.Parser().parse(tokens)
+        return True
+    except hazardous.ParserError:
+        return False
+
+
+def parse_all(programs) -> int:
+    count = 0
+
+    for _, tokens in programs:
+        hazardous.Parser().parse(tokens)
+        count += len(tokens)
+
+    return count
+
+
+def count_calls(programs) -> int:
+    profile = cProfile.Profile()
+    profile.runcall(parse_all, programs)
+    return pstats.Stats(profile).total_calls
+
+
+def max_nesting(limit=100000) -> int:
+    # deepest '((...(1)...))' that parses without hitting the recursion limit
+    low, high = 0, limit
+
+    while low < high:
+        depth = (low + high + 1) // 2
+        scanner = hazardous.Scanner()
+        scanner.input(f"proc main() -> i32 {{ return {'(' * depth}1{')' * depth}; }}", "<nesting>")
+
+        try:
+            hazardous.Parser().parse(list(scanner.tokens()))
+            low = depth
+        except RecursionError:
+            high = depth - 1
+
+    return low
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parser throughput in tokens/sec and function calls per token')
+    parser.add_argument('patterns', nargs='*', default=DEFAULT_PROGRAMS, help='Program globs relative to the repository root')
+    parser.add_argument('--repeat', type=int, default=10, help='Times every program is parsed, the best run is reported')
+    args = parser.parse_args()
+
+    loaded = load_programs(args.patterns)
+    # headers that use types declared in another header don't parse on their own
+    programs = [(path, tokens) for path, tokens in loaded if parses(tokens)]
+
+    if not programs:
+        print("[ERROR]: No programs matched")
+        exit(1)
+
+    best = None
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        tokens = parse_all(programs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    calls = count_calls(programs)
+
+    print(f"programs:    {len(programs)} ({len(loaded) - len(programs)} skipped, they don't parse on their own)")
+    print(f"tokens:      {tokens}")
+    print(f"best run:    {best * 1000:.2f} ms")
+    print(f"throughput:  {tokens / best:,.0f} tokens/sec")
+    print(f"calls/token: {calls / tokens:.2f}")
+    print(f"max nesting: {max_nesting()} parentheses")
+
+
+if __name__ == "__main__":
+    main()
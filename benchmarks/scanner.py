@@ -0,0 +1,70 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+# run from anywhere, the package lives one directory up
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hazardous
+
+
+DEFAULT_CORPUS = ['compiler/*.hz', 'include/*.hz', 'include/*/*.hz']
+
+
+def load_corpus(patterns):
+    sources = []
+
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(ROOT, pattern))):
+            with open(path, "r") as f:
+                sources.append((os.path.relpath(path, ROOT), f.read()))
+
+    return sources
+
+
+def scan_all(sources) -> int:
+    count = 0
+
+    for path, code in sources:
+        scanner = hazardous.Scanner()
+        scanner.input(code, path)
+
+        for _ in scanner.tokens():
+            count += 1
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scanner throughput in tokens/sec')
+    parser.add_argument('patterns', nargs='*', default=DEFAULT_CORPUS, help='Source globs relative to the repository root')
+    parser.add_argument('--repeat', type=int, default=20, help='Times the whole corpus is scanned, the best run is reported')
+    args = parser.parse_args()
+
+    sources = load_corpus(args.patterns)
+
+    if not sources:
+        print("[ERROR]: No sources matched")
+        exit(1)
+
+    characters = sum(len(code) for _, code in sources)
+    best = None
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        tokens = scan_all(sources)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"files:      {len(sources)}")
+    print(f"characters: {characters}")
+    print(f"tokens:     {tokens}")
+    print(f"best run:   {best * 1000:.2f} ms")
+    print(f"throughput: {tokens / best:,.0f} tokens/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
 from .scanner import *
+from .cache import *
 from .preprocessor import *
 from .parser import *
+from .folder import *
+from .callgraph import *
+from .instructions import *
+from .targets import *
 from .generator import *
-
+from .peephole import *
+from .encoder import *
+from .elf import *
+from .timing import *
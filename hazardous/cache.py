@@ -0,0 +1,399 @@
+import hashlib
+import os
+import struct
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from .scanner import Scanner, SourceFile, Token, TokenStore, TokenType, TOKEN_TYPES
+
+
+# bump whenever the scanner can produce different tokens for the same source
+TOKEN_CACHE_VERSION = 1
+
+# magic, version, number of token types, array item sizes (types, offsets), content digest, token count
+TOKEN_CACHE_HEADER = struct.Struct('<4sHHBB16sI')
+TOKEN_CACHE_MAGIC = b'HZTK'
+
+
+def content_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class IncludeResolver:
+    # directory -> (mtime, {file name: path}), every directory is listed once and shared by the whole process
+    listings: Dict[str, tuple] = {}
+
+    def __init__(self, include_dirs: list):
+        self.include_dirs = include_dirs
+        # include name -> real path, None when no include dir has it
+        self.resolved: Dict[str, Optional[str]] = {}
+        # directories whose listing is known to be current for this resolver
+        self.checked = set()
+
+    def resolve(self, file_name: str) -> Optional[str]:
+        # the first include dir that has the file wins, the same name always resolves to the same file
+        if file_name in self.resolved:
+            return self.resolved[file_name]
+
+        found = None
+        sub_dir, base_name = os.path.split(file_name)
+
+        for path in self.include_dirs:
+            # names like "linux/streams.hz" are looked up in the listing of the sub directory
+            directory = os.path.normpath(os.path.join(path, sub_dir))
+            candidate = self.listing(directory).get(os.path.normcase(base_name))
+
+            if candidate is not None:
+                found = os.path.realpath(candidate)
+                break
+
+        self.resolved[file_name] = found
+        return found
+
+    def listing(self, directory: str) -> Dict[str, str]:
+        if directory in self.checked:
+            return self.listings[directory][1]
+
+        # a directory's mtime changes when files are added or removed, that's when it's listed again
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        entry = self.listings.get(directory)
+
+        if entry is None or entry[0] != mtime:
+            files = {}
+
+            if mtime is not None:
+                try:
+                    with os.scandir(directory) as entries:
+                        for dir_entry in entries:
+                            if dir_entry.is_file():
+                                files[os.path.normcase(dir_entry.name)] = dir_entry.path
+                except OSError:
+                    pass
+
+            entry = self.listings[directory] = (mtime, files)
+
+        self.checked.add(directory)
+        return entry[1]
+
+
+class TokenCache:
+    # path -> ((mtime, size), code, types, starts, lengths), shared by every cache in the process
+    memory: Dict[str, tuple] = {}
+
+    def __init__(self, directory: Optional[str] = None):
+        # scanned files are also written here when given, so the next compile can skip scanning them
+        self.directory = directory
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def load(self, path: str, name: str) -> TokenStore:
+        # name is what the locations of the tokens report
+        real_path = os.path.realpath(path)
+        info = os.stat(real_path)
+        stamp = (info.st_mtime_ns, info.st_size)
+
+        entry = self.memory.get(real_path)
+
+        if entry is not None and entry[0] == stamp:
+            self.memory_hits += 1
+            return self._store(name, *entry[1:])
+
+        with open(real_path, "r") as f:
+            code = f.read()
+
+        digest = content_digest(code.encode())
+        arrays = self._read(real_path, digest)
+
+        if arrays is None:
+            self.misses += 1
+
+            scanner = Scanner()
+            scanner.input(code, name)
+            store = scanner.scan()
+            arrays = (store.types, store.starts, store.lengths)
+
+            self._write(real_path, digest, arrays)
+        else:
+            self.disk_hits += 1
+
+        self.memory[real_path] = (stamp, code) + arrays
+        return self._store(name, code, *arrays)
+
+    @staticmethod
+    def _store(name: str, code: str, types: array, starts: array, lengths: array) -> TokenStore:
+        # the arrays are never modified, every load shares them
+        store = TokenStore(SourceFile(name, code))
+        store.types, store.starts, store.lengths = types, starts, lengths
+        return store
+
+    def _entry_path(self, real_path: str) -> str:
+        # one entry per file, a changed file overwrites its old entry
+        return os.path.join(self.directory, hashlib.blake2b(real_path.encode(), digest_size=16).hexdigest() + ".tok")
+
+    def _read(self, real_path: str, digest: bytes) -> Optional[Tuple[array, array, array]]:
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._entry_path(real_path), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        if len(data) < TOKEN_CACHE_HEADER.size:
+            return None
+
+        magic, version, type_count, type_size, offset_size, entry_digest, count = TOKEN_CACHE_HEADER.unpack_from(data)
+        types, starts, lengths = array('B'), array('L'), array('L')
+
+        if (magic, version, type_count, type_size, offset_size, entry_digest) != (TOKEN_CACHE_MAGIC, TOKEN_CACHE_VERSION, len(TokenType), types.itemsize, starts.itemsize, digest):
+            return None
+
+        if len(data) != TOKEN_CACHE_HEADER.size + count * (types.itemsize + 2 * starts.itemsize):
+            return None
+
+        offset = TOKEN_CACHE_HEADER.size
+
+        for values in (types, starts, lengths):
+            end = offset + count * values.itemsize
+            values.frombytes(data[offset:end])
+            offset = end
+
+        return types, starts, lengths
+
+    def _write(self, real_path: str, digest: bytes, arrays: Tuple[array, array, array]):
+        if self.directory is None:
+            return
+
+        types, starts, lengths = arrays
+        header = TOKEN_CACHE_HEADER.pack(TOKEN_CACHE_MAGIC, TOKEN_CACHE_VERSION, len(TokenType), types.itemsize, starts.itemsize, digest, len(types))
+        entry_path = self._entry_path(real_path)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+
+        # the cache is only an optimization, a directory that can't be written just means no disk cache
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            with open(temp_path, "wb") as f:
+                f.write(header + types.tobytes() + starts.tobytes() + lengths.tobytes())
+
+            os.replace(temp_path, entry_path)
+        except OSError:
+            pass
+
+
+# bump whenever the preprocessor can produce different output for the same input files
+PREPROCESS_CACHE_VERSION = 2
+
+# magic, version, number of token types, source count, include name count, token count
+PREPROCESS_CACHE_HEADER = struct.Struct('<4sHHHHI')
+PREPROCESS_CACHE_MAGIC = b'HZPP'
+PREPROCESS_CACHE_EXTENSION = ".hzp"
+
+STRING_LENGTH = struct.Struct('<H')
+# content digest of a source, then the number of files it includes
+SOURCE_ENTRY = struct.Struct('<16sH')
+INCLUDE_TARGET = struct.Struct('<H')
+
+
+class TokenRecorder:
+    # keeps the preprocessor's output as arrays while it streams through
+    def __init__(self, tokens: Iterable[Token]):
+        self.tokens = tokens
+        self.sources: List[SourceFile] = []
+        self.source_indices: Dict[int, int] = {}
+        self.files = array('H')
+        self.types = array('B')
+        self.starts = array('L')
+        self.lengths = array('L')
+
+    def __iter__(self) -> Iterator[Token]:
+        for token in self.tokens:
+            index = self.source_indices.get(id(token.source))
+
+            if index is None:
+                index = self.source_indices[id(token.source)] = len(self.sources)
+                self.sources.append(token.source)
+
+            self.files.append(index)
+            self.types.append(token.type)
+            self.starts.append(token.start)
+            self.lengths.append(token.end - token.start)
+
+            yield token
+
+
+class PreprocessCache:
+    # whole preprocessed translation units, reused as long as none of the files that went into them changed
+    def __init__(self, directory: str, max_size: int = 64 * 1024 * 1024):
+        self.directory = directory
+        # the least recently used entries are removed once the directory holds more than this
+        self.max_size = max_size
+
+    def key(self, path: str, include_dirs: list, *extra: str) -> str:
+        # the contents of the files aren't part of the key, an entry for the same unit is replaced when they change
+        parts = [str(PREPROCESS_CACHE_VERSION), os.path.realpath(path)] + [os.path.realpath(directory) for directory in include_dirs] + list(extra)
+        return hashlib.blake2b('\0'.join(parts).encode(), digest_size=16).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + PREPROCESS_CACHE_EXTENSION)
+
+    def load(self, key: str, include_dirs: list) -> Optional[Tuple[List[Token], Dict[str, List[str]]]]:
+        # the preprocessed tokens (ending with EOF) and the include graph, None if there's no valid entry
+        entry_path = self._entry_path(key)
+
+        try:
+            with open(entry_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        try:
+            result = self._decode(data, include_dirs)
+        except (struct.error, UnicodeDecodeError, ValueError, IndexError):
+            return None
+
+        if result is not None:
+            # hits count as a use for the eviction order
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+
+        return result
+
+    def _decode(self, data: bytes, include_dirs: list):
+        magic, version, type_count, source_count, include_count, token_count = PREPROCESS_CACHE_HEADER.unpack_from(data)
+
+        if (magic, version, type_count) != (PREPROCESS_CACHE_MAGIC, PREPROCESS_CACHE_VERSION, len(TokenType)):
+            return None
+
+        offset = PREPROCESS_CACHE_HEADER.size
+
+        def read_string():
+            nonlocal offset
+            length, = STRING_LENGTH.unpack_from(data, offset)
+            offset += STRING_LENGTH.size + length
+            return data[offset - length:offset].decode()
+
+        paths, sources, graph = [], [], []
+
+        for _ in range(source_count):
+            name, path = read_string(), read_string()
+            digest, included_count = SOURCE_ENTRY.unpack_from(data, offset)
+            offset += SOURCE_ENTRY.size
+
+            includes = array('H')
+            includes.frombytes(data[offset:offset + included_count * includes.itemsize])
+            offset += included_count * includes.itemsize
+
+            try:
+                with open(path, "r") as f:
+                    code = f.read()
+            except OSError:
+                return None
+
+            if content_digest(code.encode()) != digest:
+                return None
+
+            paths.append(path)
+            sources.append(SourceFile(name, code))
+            graph.append(includes)
+
+        # a file added to one of the include dirs could shadow one that was included, every name has to resolve the same way
+        resolver = IncludeResolver(include_dirs)
+
+        for _ in range(include_count):
+            name = read_string()
+            target, = INCLUDE_TARGET.unpack_from(data, offset)
+            offset += INCLUDE_TARGET.size
+
+            if resolver.resolve(name) != paths[target]:
+                return None
+
+        files, types, starts, lengths = array('H'), array('B'), array('L'), array('L')
+
+        for values in (files, types, starts, lengths):
+            end = offset + token_count * values.itemsize
+            values.frombytes(data[offset:end])
+            offset = end
+
+        if len(types) != token_count or offset != len(data):
+            return None
+
+        tokens = [
+            Token(TOKEN_TYPES[token_type], sources[file], start, start + length)
+            for file, token_type, start, length in zip(files, types, starts, lengths)
+        ]
+        dependencies = {path: [paths[i] for i in includes] for path, includes in zip(paths, graph)}
+
+        return tokens, dependencies
+
+    def save(self, key: str, recorded: TokenRecorder, sources: Dict[str, SourceFile], dependencies: Dict[str, List[str]], resolved: Dict[str, str]):
+        # sources and dependencies start with the root file, resolved is every include name with the file it resolved to
+        paths = list(sources)
+        path_indices = {path: i for i, path in enumerate(paths)}
+        source_indices = {id(source): i for i, source in enumerate(sources.values())}
+
+        # the output has to have been read up to the EOF to be complete
+        if not recorded.types or recorded.types[-1] != TokenType.EOF:
+            return
+
+        # tokens that don't point into one of the files (they shouldn't exist) can't be stored
+        if any(id(source) not in source_indices for source in recorded.sources):
+            return
+
+        remap = [source_indices[id(source)] for source in recorded.sources]
+        files = array('H', (remap[file] for file in recorded.files))
+
+        def string(value: str) -> bytes:
+            encoded = value.encode()
+            return STRING_LENGTH.pack(len(encoded)) + encoded
+
+        parts = [PREPROCESS_CACHE_HEADER.pack(PREPROCESS_CACHE_MAGIC, PREPROCESS_CACHE_VERSION, len(TokenType), len(paths), len(resolved), len(recorded.types))]
+
+        for path, source in sources.items():
+            includes = array('H', (path_indices[include] for include in dependencies.get(path, [])))
+            parts += [string(source.name), string(path), SOURCE_ENTRY.pack(content_digest(source.code.encode()), len(includes)), includes.tobytes()]
+
+        for name, path in resolved.items():
+            parts += [string(name), INCLUDE_TARGET.pack(path_indices[path])]
+
+        parts += [files.tobytes(), recorded.types.tobytes(), recorded.starts.tobytes(), recorded.lengths.tobytes()]
+
+        entry_path = self._entry_path(key)
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+
+            with open(temp_path, "wb") as f:
+                f.write(b''.join(parts))
+
+            os.replace(temp_path, entry_path)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        entries = []
+
+        with os.scandir(self.directory) as dir_entries:
+            for dir_entry in dir_entries:
+                if dir_entry.name.endswith(PREPROCESS_CACHE_EXTENSION):
+                    info = dir_entry.stat()
+                    entries.append((info.st_mtime_ns, info.st_size, dir_entry.path))
+
+        total = sum(size for _, size, _ in entries)
+
+        # oldest first
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+
+            os.remove(path)
+            total -= size
@@ -0,0 +1,94 @@
+import re
+from typing import Callable, Dict, List, Set
+from . import nodes
+
+
+# words in inline assembly that could name a procedure
+ASM_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+class CallGraph:
+    def __init__(self, program_tree):
+        # name -> every declaration of it (forward declarations and the definition)
+        self.procedures: Dict[str, List[nodes.ProgramProcedure]] = {}
+        # method name -> name mangled procedures of every class with such a method
+        self.methods: Dict[str, List[str]] = {}
+        self.calls: Dict[str, Set[str]] = {}
+
+        for node in program_tree:
+            if isinstance(node, nodes.ProgramProcedure):
+                self.procedures.setdefault(node.name, []).append(node)
+
+            elif isinstance(node, nodes.ProgramClass):
+                for method_name in node.methods:
+                    self.methods.setdefault(method_name, []).append(f"__{node.name}_proc_{method_name}")
+
+    def roots(self) -> List[str]:
+        # public procedures nobody calls are dropped by the generator, they only matter in units without a main
+        has_main = 'main' in self.procedures
+
+        return [name for name, definitions in self.procedures.items() if name == 'main' or any(procedure.always or (not has_main and not procedure.is_local) for procedure in definitions)]
+
+    def callees(self, name: str) -> Set[str]:
+        # procedures of this unit the procedure can call, method calls go to every class with a method of that name
+        if name not in self.calls:
+            called = set()
+
+            for procedure in self.procedures[name]:
+                if procedure.forward_declared:
+                    continue
+
+                for statement in procedure.body:
+                    for node in nodes.walk(statement):
+                        if isinstance(node, (nodes.CallFunction, nodes.Call)):
+                            called.add(node.name)
+                        elif isinstance(node, nodes.CallFunctionExpression) and isinstance(node.value, nodes.AccessStructMember):
+                            called.update(self.methods.get(node.value.name, ()))
+                        elif isinstance(node, nodes.NewInstance):
+                            called.add(f"__{node.name}_init_")
+                        elif isinstance(node, nodes.InlineAssembly):
+                            called.update(ASM_IDENTIFIER.findall(node.value))
+
+            self.calls[name] = called & self.procedures.keys()
+
+        return self.calls[name]
+
+    def reachable(self, visit: Callable[[nodes.ProgramProcedure], None] = None) -> Set[str]:
+        # visit sees every declaration of a procedure once it's reached, before its calls are looked at
+        pending = self.roots()
+        reached = set(pending)
+
+        while pending:
+            name = pending.pop()
+
+            if visit:
+                for procedure in self.procedures[name]:
+                    visit(procedure)
+
+            for callee in self.callees(name):
+                if callee not in reached:
+                    reached.add(callee)
+                    pending.append(callee)
+
+        return reached
+
+
+class DeadProcedureEliminator:
+    def __init__(self):
+        self.removed = 0
+
+    def eliminate(self, program_tree):
+        # procedures nothing reachable calls are left out before any of them is generated
+        graph = CallGraph(program_tree)
+        reached = graph.reachable()
+        kept = []
+
+        for node in program_tree:
+            if isinstance(node, nodes.ProgramProcedure) and node.name not in reached:
+                if not node.forward_declared:
+                    self.removed += 1
+                continue
+
+            kept.append(node)
+
+        return kept
@@ -0,0 +1,204 @@
+import struct
+from typing import Dict
+from .encoder import Encoder, EncoderError, R_X86_64_64
+from .generator import ASM_TYPE_LETTERS
+
+
+ELF_HEADER = struct.Struct('<16sHHIQQQIHHHHHH')
+SECTION_HEADER = struct.Struct('<IIQQQQIIQQ')
+SYMBOL = struct.Struct('<IBBHQQ')
+RELA = struct.Struct('<QQq')
+
+ET_REL = 1
+EM_X86_64 = 62
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_RELA = 4
+SHT_NOBITS = 8
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHF_INFO_LINK = 0x40
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+
+SHN_UNDEF = 0
+
+# section header indices, in the order they're written
+TEXT, DATA, BSS, RELA_TEXT, RELA_DATA, NOTE_GNU_STACK, SYMTAB, STRTAB, SHSTRTAB = range(1, 10)
+
+LETTER_SIZES = {
+    'b': 1,
+    'w': 2,
+    'd': 4,
+    'q': 8
+}
+
+
+class StringTable:
+    def __init__(self):
+        self.data = bytearray(b'\0')
+        self.offsets = {}
+
+    def add(self, string: str) -> int:
+        if string not in self.offsets:
+            self.offsets[string] = len(self.data)
+            self.data += string.encode() + b'\0'
+
+        return self.offsets[string]
+
+
+class ElfWriter:
+    # writes a relocatable ELF64 object straight from the generator's output, no assembler involved
+    def write(self, generator) -> bytes:
+        text, labels, text_relocations = Encoder().encode(generator.emitted)
+        data, data_labels, data_relocations = self._layout_data(generator.data)
+        bss_size, bss_labels = self._layout_bss(generator.bss)
+
+        public = {extern[len('public '):] for extern in generator.externs if extern.startswith('public ')}
+        external = [extern[len('extrn '):] for extern in generator.externs if extern.startswith('extrn ')]
+
+        # (name, section, value, size, type), local symbols have to come first
+        defined = []
+        function_names = list(generator.emitted)
+
+        for i, func_name in enumerate(function_names):
+            end = labels[function_names[i + 1]] if i + 1 < len(function_names) else len(text)
+            defined.append((func_name, TEXT, labels[func_name], end - labels[func_name], STT_FUNC))
+
+        for name, (offset, size) in data_labels.items():
+            defined.append((name, DATA, offset, size, STT_OBJECT))
+
+        for name, (offset, size) in bss_labels.items():
+            defined.append((name, BSS, offset, size, STT_OBJECT))
+
+        strtab = StringTable()
+        symbols = [SYMBOL.pack(0, 0, 0, SHN_UNDEF, 0, 0)]
+        symbol_indices = {}
+
+        for section in (TEXT, DATA, BSS):
+            symbols.append(SYMBOL.pack(0, (STB_LOCAL << 4) | STT_SECTION, 0, section, 0, 0))
+
+        def add_symbols(binding):
+            for name, section, value, size, symbol_type in defined:
+                if (name in public) == (binding == STB_GLOBAL):
+                    symbol_indices[name] = len(symbols)
+                    symbols.append(SYMBOL.pack(strtab.add(name), (binding << 4) | symbol_type, 0, section, value, size))
+
+        add_symbols(STB_LOCAL)
+        first_global = len(symbols)
+        add_symbols(STB_GLOBAL)
+
+        for name in external:
+            if name not in symbol_indices:
+                symbol_indices[name] = len(symbols)
+                symbols.append(SYMBOL.pack(strtab.add(name), (STB_GLOBAL << 4) | STT_NOTYPE, 0, SHN_UNDEF, 0, 0))
+
+        def relocation_entries(relocations):
+            entries = bytearray()
+
+            for offset, kind, symbol, addend in relocations:
+                if symbol in symbol_indices:
+                    index = symbol_indices[symbol]
+                # local labels don't get a symbol, they're an offset into .text
+                elif symbol in labels:
+                    index, addend = TEXT, addend + labels[symbol]
+                else:
+                    raise EncoderError(f"Undefined symbol '{symbol}'")
+
+                entries += RELA.pack(offset, (index << 32) | kind, addend)
+
+            return bytes(entries)
+
+        rela_text = relocation_entries(text_relocations)
+        rela_data = relocation_entries(data_relocations)
+
+        # name, type, flags, contents (or size for .bss), link, info, alignment, entry size
+        sections = [
+            ('.text', SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR, text, 0, 0, 16, 0),
+            ('.data', SHT_PROGBITS, SHF_ALLOC | SHF_WRITE, data, 0, 0, 8, 0),
+            ('.bss', SHT_NOBITS, SHF_ALLOC | SHF_WRITE, bss_size, 0, 0, 8, 0),
+            ('.rela.text', SHT_RELA, SHF_INFO_LINK, rela_text, SYMTAB, TEXT, 8, RELA.size),
+            ('.rela.data', SHT_RELA, SHF_INFO_LINK, rela_data, SYMTAB, DATA, 8, RELA.size),
+            # the stack doesn't need to be executable
+            ('.note.GNU-stack', SHT_PROGBITS, 0, b'', 0, 0, 1, 0),
+            ('.symtab', SHT_SYMTAB, 0, b''.join(symbols), STRTAB, first_global, 8, SYMBOL.size),
+            ('.strtab', SHT_STRTAB, 0, bytes(strtab.data), 0, 0, 1, 0),
+        ]
+        shstrtab = StringTable()
+
+        # the section names, including its own, have to be in the table before it's written
+        for name in [section[0] for section in sections] + ['.shstrtab']:
+            shstrtab.add(name)
+
+        sections.append(('.shstrtab', SHT_STRTAB, 0, bytes(shstrtab.data), 0, 0, 1, 0))
+
+        output = bytearray(ELF_HEADER.size)
+        headers = [SECTION_HEADER.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)]
+
+        for name, section_type, flags, contents, link, info, alignment, entry_size in sections:
+            output += bytes(-len(output) % alignment)
+
+            if section_type == SHT_NOBITS:
+                offset, size = len(output), contents
+            else:
+                offset, size = len(output), len(contents)
+                output += contents
+
+            headers.append(SECTION_HEADER.pack(shstrtab.add(name), section_type, flags, 0, offset, size, link, info, alignment, entry_size))
+
+        output += bytes(-len(output) % 8)
+        section_headers_offset = len(output)
+        output += b''.join(headers)
+
+        identification = b'\x7fELF' + bytes((2, 1, 1, 0)) + bytes(8)
+        output[:ELF_HEADER.size] = ELF_HEADER.pack(identification, ET_REL, EM_X86_64, 1, 0, 0, section_headers_offset, 0, ELF_HEADER.size, 0, 0, SECTION_HEADER.size, len(headers), SHSTRTAB)
+
+        return bytes(output)
+
+    @staticmethod
+    def _layout_data(data_items: Dict[str, tuple]):
+        data = bytearray()
+        labels = {}
+        relocations = []
+
+        for name, (type_id, values) in data_items.items():
+            size = LETTER_SIZES[ASM_TYPE_LETTERS[type_id]]
+            data += bytes(-len(data) % size)
+            start = len(data)
+
+            for value in filter(None, (value.strip() for value in values.split(','))):
+                try:
+                    data += (int(value, 0) & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+                except ValueError:
+                    # anything that isn't a number is the address of a label
+                    if size != 8:
+                        raise EncoderError(f"The address '{value}' doesn't fit in '{name}'")
+
+                    relocations.append((len(data), R_X86_64_64, value, 0))
+                    data += bytes(8)
+
+            labels[name] = (start, len(data) - start)
+
+        return bytes(data), labels, relocations
+
+    @staticmethod
+    def _layout_bss(bss_items: Dict[str, tuple]):
+        size = 0
+        labels = {}
+
+        for name, (type_id, count) in bss_items.items():
+            item_size = LETTER_SIZES[ASM_TYPE_LETTERS[type_id]]
+            size += -size % item_size
+            labels[name] = (size, item_size * count)
+            size += item_size * count
+
+        return size, labels
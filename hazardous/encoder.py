@@ -0,0 +1,559 @@
+import struct
+from typing import Dict, List, Tuple
+from .instructions import Instruction, Memory, Opcode, REGISTERS, REGISTER_FAMILIES, is_register
+
+
+# relocation types of the x86-64 ELF ABI
+R_X86_64_64 = 1
+R_X86_64_PC32 = 2
+R_X86_64_PLT32 = 4
+R_X86_64_32S = 11
+
+REGISTER_NUMBERS = {family: number for number, family in enumerate(('rax', 'rcx', 'rdx', 'rbx', 'rsp', 'rbp', 'rsi', 'rdi', 'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15'))}
+REGISTER_SIZES = {name: size for names in REGISTER_FAMILIES.values() for name, size in zip(names, (8, 4, 2, 1))}
+# byte registers that can only be encoded with a REX prefix
+REX_BYTE_REGISTERS = ('spl', 'bpl', 'sil', 'dil')
+
+# the /digit used by the 80, 81 and 83 opcodes, the register forms are digit * 8 + 1 and + 3
+ALU_DIGITS = {
+    Opcode.ADD: 0,
+    Opcode.OR: 1,
+    Opcode.AND: 4,
+    Opcode.SUB: 5,
+    Opcode.XOR: 6,
+    Opcode.CMP: 7
+}
+
+CONDITION_CODES = {
+    Opcode.SETE: 0x4,
+    Opcode.SETNE: 0x5,
+    Opcode.SETG: 0xF,
+    Opcode.SETLE: 0xE,
+    Opcode.SETL: 0xC,
+    Opcode.SETGE: 0xD,
+    Opcode.JE: 0x4,
+    Opcode.JNE: 0x5,
+    Opcode.JA: 0x7,
+    Opcode.JG: 0xF
+}
+
+# size of a branch with a rel8 and a rel32 displacement
+SHORT_BRANCH_SIZE = 2
+NEAR_JUMP_SIZE = 5
+NEAR_CONDITIONAL_JUMP_SIZE = 6
+
+# a relocation: offset into its section, type, symbol and addend
+Relocation = Tuple[int, int, str, int]
+
+
+def fits_in(value: int, bits: int) -> bool:
+    return -(1 << (bits - 1)) <= value < (1 << (bits - 1))
+
+
+def pack_immediate(value: int, size: int) -> bytes:
+    # anything wider than 32 bits only exists for mov, the rest get sign extended
+    if size == 4 and not fits_in(value, 32) and not 0 <= value < (1 << 32):
+        raise EncoderError(f"Immediate {value} doesn't fit in 32 bits")
+
+    return (value & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+
+
+class Encoder:
+    # turns the instructions of all procedures into one .text section
+    # local labels (.L1) belong to the procedure they appear in, like in fasm
+    def __init__(self):
+        # most instructions repeat a lot (push rax, pop rbx, ...), the ones without relocations are only encoded once
+        self.cache = {}
+        self.current_function = ''
+
+    def encode(self, functions: Dict[str, List[Instruction]]):
+        # a piece is either encoded bytes with their relocations, a label or a branch to a label
+        pieces = []
+
+        for func_name, body in functions.items():
+            self.current_function = func_name
+            pieces.append(('label', func_name))
+
+            for instruction in body:
+                opcode = instruction.opcode
+
+                if opcode == Opcode.LABEL:
+                    pieces.append(('label', self.qualify(instruction.operands[0])))
+                elif opcode in (Opcode.JMP, Opcode.JE, Opcode.JNE, Opcode.JA, Opcode.JG) and isinstance(instruction.operands[0], str) and not is_register(instruction.operands[0]):
+                    pieces.append(('branch', opcode, self.qualify(instruction.operands[0])))
+                else:
+                    pieces.append(('code',) + self.encode_instruction(instruction))
+
+        labels, long_branches = self._layout(pieces)
+        return self._assemble(pieces, labels, long_branches)
+
+    def qualify(self, label: str) -> str:
+        return self.current_function + label if label.startswith('.') else label
+
+    def _layout(self, pieces):
+        # every branch starts out short, the ones that can't reach their target grow until nothing changes
+        long_branches = set()
+
+        while True:
+            labels = {}
+            branch_ends = {}
+            offset = 0
+
+            for i, piece in enumerate(pieces):
+                if piece[0] == 'label':
+                    labels[piece[1]] = offset
+                elif piece[0] == 'branch':
+                    if i in long_branches:
+                        offset += NEAR_JUMP_SIZE if piece[1] == Opcode.JMP else NEAR_CONDITIONAL_JUMP_SIZE
+                    else:
+                        offset += SHORT_BRANCH_SIZE
+                    branch_ends[i] = offset
+                else:
+                    offset += len(piece[1])
+
+            grown = False
+
+            for i, end in branch_ends.items():
+                target = pieces[i][2]
+
+                if target not in labels:
+                    raise EncoderError(f"Jump to undefined label '{target}'")
+
+                if i not in long_branches and not fits_in(labels[target] - end, 8):
+                    long_branches.add(i)
+                    grown = True
+
+            if not grown:
+                return labels, long_branches
+
+    def _assemble(self, pieces, labels, long_branches):
+        text = bytearray()
+        relocations: List[Relocation] = []
+
+        for i, piece in enumerate(pieces):
+            if piece[0] == 'code':
+                _, code, code_relocations = piece
+
+                for offset, kind, symbol, addend in code_relocations:
+                    # pc relative references into .text are known now, no need to leave them to the linker
+                    if kind in (R_X86_64_PC32, R_X86_64_PLT32) and symbol in labels:
+                        value = labels[symbol] + addend - (len(text) + offset)
+                        code = code[:offset] + struct.pack('<i', value) + code[offset + 4:]
+                    else:
+                        relocations.append((len(text) + offset, kind, symbol, addend))
+
+                text += code
+
+            elif piece[0] == 'branch':
+                _, opcode, target = piece
+
+                if i in long_branches:
+                    if opcode == Opcode.JMP:
+                        text += b'\xE9' + struct.pack('<i', labels[target] - (len(text) + NEAR_JUMP_SIZE))
+                    else:
+                        text += bytes((0x0F, 0x80 | CONDITION_CODES[opcode])) + struct.pack('<i', labels[target] - (len(text) + NEAR_CONDITIONAL_JUMP_SIZE))
+                else:
+                    opcode_byte = 0xEB if opcode == Opcode.JMP else 0x70 | CONDITION_CODES[opcode]
+                    text += bytes((opcode_byte,)) + struct.pack('<b', labels[target] - (len(text) + SHORT_BRANCH_SIZE))
+
+        return bytes(text), labels, relocations
+
+    # instructions
+
+    def encode_instruction(self, instruction: Instruction) -> Tuple[bytes, List[Relocation]]:
+        key = (instruction.opcode, instruction.operands)
+
+        if key in self.cache:
+            return self.cache[key]
+
+        method = getattr(self, f"_encode_{instruction.opcode.name}", None)
+
+        if not method:
+            raise EncoderError(f"Can't encode '{instruction}'")
+
+        self.code = bytearray()
+        self.relocations = []
+        method(instruction.operands)
+
+        encoded = bytes(self.code), self.relocations
+        if not self.relocations:
+            self.cache[key] = encoded
+
+        return encoded
+
+    def _encode_MOV(self, operands):
+        dest, source = operands
+
+        if is_register(dest) and is_register(source):
+            size = self._same_size(dest, source)
+            self._emit_modrm(0x88 if size == 1 else 0x89, source, dest, size)
+
+        elif isinstance(dest, Memory) and is_register(source):
+            size = self._register_memory_size(source, dest)
+            self._emit_modrm(0x88 if size == 1 else 0x89, source, dest, size)
+
+        elif is_register(dest) and isinstance(source, Memory):
+            size = self._register_memory_size(dest, source)
+            self._emit_modrm(0x8A if size == 1 else 0x8B, dest, source, size)
+
+        elif is_register(dest) and isinstance(source, int):
+            size = REGISTER_SIZES[dest]
+
+            if size == 8 and fits_in(source, 32):
+                # sign extended imm32
+                self._emit_modrm(0xC7, 0, dest, size, immediate_size=4)
+                self.code += pack_immediate(source, 4)
+            elif size == 8:
+                self._emit_register_in_opcode(0xB8, dest, size)
+                self.code += pack_immediate(source, 8)
+            else:
+                self._emit_register_in_opcode(0xB0 if size == 1 else 0xB8, dest, size)
+                self.code += pack_immediate(source, size)
+
+        elif is_register(dest) and isinstance(source, str):
+            # the full address, the code isn't position independent
+            if REGISTER_SIZES[dest] != 8:
+                raise EncoderError(f"Can't load the address '{source}' into '{dest}'")
+
+            self._emit_register_in_opcode(0xB8, dest, 8)
+            self._emit_relocation(R_X86_64_64, source, 0, 8)
+
+        elif isinstance(dest, Memory) and isinstance(source, (int, str)):
+            size = self._memory_size(dest)
+            immediate_size = min(size, 4)
+
+            if isinstance(source, int):
+                self._check_sign_extended(source, size)
+            self._emit_modrm(0xC6 if size == 1 else 0xC7, 0, dest, size, immediate_size=immediate_size)
+
+            if isinstance(source, str):
+                self._emit_relocation(R_X86_64_32S, source, 0, 4)
+            else:
+                self.code += pack_immediate(source, immediate_size)
+
+        else:
+            raise EncoderError(f"Invalid operands for mov: {dest}, {source}")
+
+    def _encode_MOVZX(self, operands):
+        dest, source = operands
+        source_size = self._operand_size(source)
+
+        if source_size not in (1, 2):
+            raise EncoderError(f"Invalid source size for movzx: {source}")
+
+        self._emit_modrm((0x0F, 0xB6 if source_size == 1 else 0xB7), dest, source, REGISTER_SIZES[dest], byte_operand=source)
+
+    def _encode_MOVSX(self, operands):
+        dest, source = operands
+        source_size = self._operand_size(source)
+
+        if source_size == 4:
+            # movsxd
+            self._emit_modrm(0x63, dest, source, REGISTER_SIZES[dest])
+        elif source_size in (1, 2):
+            self._emit_modrm((0x0F, 0xBE if source_size == 1 else 0xBF), dest, source, REGISTER_SIZES[dest], byte_operand=source)
+        else:
+            raise EncoderError(f"Invalid source size for movsx: {source}")
+
+    def _encode_LEA(self, operands):
+        dest, source = operands
+        self._emit_modrm(0x8D, dest, source, REGISTER_SIZES[dest])
+
+    def _encode_PUSH(self, operands):
+        (value,) = operands
+
+        if is_register(value):
+            self._emit_register_in_opcode(0x50, value, 0)
+        elif isinstance(value, int):
+            if fits_in(value, 8):
+                self.code += bytes((0x6A,)) + pack_immediate(value, 1)
+            else:
+                self.code += b'\x68' + pack_immediate(value, 4)
+        elif isinstance(value, Memory):
+            self._emit_modrm(0xFF, 6, value, 0)
+        else:
+            self.code += b'\x68'
+            self._emit_relocation(R_X86_64_32S, value, 0, 4)
+
+    def _encode_POP(self, operands):
+        (value,) = operands
+
+        if is_register(value):
+            self._emit_register_in_opcode(0x58, value, 0)
+        else:
+            self._emit_modrm(0x8F, 0, value, 0)
+
+    def _encode_alu(self, opcode: Opcode, operands):
+        dest, source = operands
+        digit = ALU_DIGITS[opcode]
+
+        if is_register(source):
+            size = self._same_size(dest, source) if is_register(dest) else self._register_memory_size(source, dest)
+            self._emit_modrm(digit * 8 + (0 if size == 1 else 1), source, dest, size)
+
+        elif isinstance(source, Memory):
+            size = self._register_memory_size(dest, source)
+            self._emit_modrm(digit * 8 + (2 if size == 1 else 3), dest, source, size)
+
+        elif isinstance(source, int):
+            size = self._operand_size(dest)
+            self._check_sign_extended(source, size)
+
+            if size == 1:
+                self._emit_modrm(0x80, digit, dest, size, immediate_size=1)
+                self.code += pack_immediate(source, 1)
+            elif fits_in(source, 8):
+                self._emit_modrm(0x83, digit, dest, size, immediate_size=1)
+                self.code += pack_immediate(source, 1)
+            else:
+                immediate_size = min(size, 4)
+                self._emit_modrm(0x81, digit, dest, size, immediate_size=immediate_size)
+                self.code += pack_immediate(source, immediate_size)
+
+        else:
+            raise EncoderError(f"Invalid operands for {opcode.name.lower()}: {dest}, {source}")
+
+    def _encode_ADD(self, operands):
+        self._encode_alu(Opcode.ADD, operands)
+
+    def _encode_SUB(self, operands):
+        self._encode_alu(Opcode.SUB, operands)
+
+    def _encode_XOR(self, operands):
+        self._encode_alu(Opcode.XOR, operands)
+
+    def _encode_OR(self, operands):
+        self._encode_alu(Opcode.OR, operands)
+
+    def _encode_AND(self, operands):
+        self._encode_alu(Opcode.AND, operands)
+
+    def _encode_CMP(self, operands):
+        self._encode_alu(Opcode.CMP, operands)
+
+    def _encode_MUL(self, operands):
+        (value,) = operands
+        size = self._operand_size(value)
+        self._emit_modrm(0xF6 if size == 1 else 0xF7, 4, value, size)
+
+    def _encode_IMUL(self, operands):
+        # only the two and three operand forms, the low half of the product is the same as for mul
+        if len(operands) == 2:
+            dest, source = operands
+            size = self._same_size(dest, source) if is_register(source) else self._register_memory_size(dest, source)
+            self._emit_modrm((0x0F, 0xAF), dest, source, size)
+            return
+
+        dest, source, value = operands
+        size = self._same_size(dest, source) if is_register(source) else self._register_memory_size(dest, source)
+        self._check_sign_extended(value, size)
+
+        if fits_in(value, 8):
+            self._emit_modrm(0x6B, dest, source, size, immediate_size=1)
+            self.code += pack_immediate(value, 1)
+        else:
+            immediate_size = min(size, 4)
+            self._emit_modrm(0x69, dest, source, size, immediate_size=immediate_size)
+            self.code += pack_immediate(value, immediate_size)
+
+    def _encode_DIV(self, operands):
+        (value,) = operands
+        size = self._operand_size(value)
+        self._emit_modrm(0xF6 if size == 1 else 0xF7, 6, value, size)
+
+    def _encode_setcc(self, opcode: Opcode, operands):
+        (value,) = operands
+
+        if self._operand_size(value) != 1:
+            raise EncoderError(f"{opcode.name.lower()} needs a byte operand: {value}")
+
+        self._emit_modrm((0x0F, 0x90 | CONDITION_CODES[opcode]), 0, value, 1)
+
+    def _encode_SETE(self, operands):
+        self._encode_setcc(Opcode.SETE, operands)
+
+    def _encode_SETNE(self, operands):
+        self._encode_setcc(Opcode.SETNE, operands)
+
+    def _encode_SETG(self, operands):
+        self._encode_setcc(Opcode.SETG, operands)
+
+    def _encode_SETLE(self, operands):
+        self._encode_setcc(Opcode.SETLE, operands)
+
+    def _encode_SETL(self, operands):
+        self._encode_setcc(Opcode.SETL, operands)
+
+    def _encode_SETGE(self, operands):
+        self._encode_setcc(Opcode.SETGE, operands)
+
+    def _encode_JMP(self, operands):
+        # jumps to labels are branches, only indirect ones get here
+        (target,) = operands
+        self._emit_modrm(0xFF, 4, target, 0)
+
+    def _encode_CALL(self, operands):
+        (target,) = operands
+
+        if is_register(target) or isinstance(target, Memory):
+            self._emit_modrm(0xFF, 2, target, 0)
+        else:
+            self.code += b'\xE8'
+            self._emit_relocation(R_X86_64_PLT32, target, -4, 4)
+
+    def _encode_RET(self, operands):
+        self.code += b'\xC3'
+
+    def _encode_RAW(self, operands):
+        # main.py assembles programs with inline assembly with fasm, this only happens when the encoder is used on its own
+        raise EncoderError(f"Inline assembly can't be encoded directly, assemble the text output instead: '{operands[0]}'")
+
+    # encoding helpers
+
+    def _same_size(self, first: str, second: str) -> int:
+        size = REGISTER_SIZES[first]
+
+        if REGISTER_SIZES[second] != size:
+            raise EncoderError(f"Operand sizes don't match: {first}, {second}")
+
+        return size
+
+    @staticmethod
+    def _register_memory_size(reg: str, memory: Memory) -> int:
+        # memory operands without a size take it from the register
+        size = REGISTER_SIZES[reg]
+
+        if memory.size and memory.size != size:
+            raise EncoderError(f"Operand sizes don't match: {reg}, {memory}")
+
+        return size
+
+    @staticmethod
+    def _check_sign_extended(value: int, size: int):
+        if size == 8 and not fits_in(value, 32):
+            raise EncoderError(f"Immediate {value} doesn't fit in a sign extended 32 bit value")
+
+    def _operand_size(self, operand) -> int:
+        if is_register(operand):
+            return REGISTER_SIZES[operand]
+
+        return self._memory_size(operand)
+
+    @staticmethod
+    def _memory_size(memory: Memory) -> int:
+        if not isinstance(memory, Memory) or not memory.size:
+            raise EncoderError(f"Operand size not specified: {memory}")
+
+        return memory.size
+
+    def _emit_relocation(self, kind: int, symbol: str, addend: int, size: int):
+        self.relocations.append((len(self.code), kind, self.qualify(symbol), addend))
+        self.code += bytes(size)
+
+    def _emit_prefixes(self, size: int, rex: int, byte_registers):
+        # size 0 is used for instructions that default to 64 bits and don't need REX.W
+        if size == 2:
+            self.code.append(0x66)
+
+        if size == 8:
+            rex |= 0x08
+
+        if rex or any(reg in REX_BYTE_REGISTERS for reg in byte_registers):
+            self.code.append(0x40 | rex)
+
+    def _emit_register_in_opcode(self, opcode: int, reg: str, size: int):
+        number = REGISTER_NUMBERS[REGISTERS[reg]]
+        self._emit_prefixes(size, 0x01 if number >= 8 else 0, (reg,) if size == 1 else ())
+        self.code.append(opcode | (number & 7))
+
+    def _emit_modrm(self, opcode, reg, rm, size: int, immediate_size: int = 0, byte_operand=None):
+        # reg is a register or the /digit extension of the opcode, rm a register or memory operand
+        reg_number = REGISTER_NUMBERS[REGISTERS[reg]] if isinstance(reg, str) else reg
+        rex = 0x04 if reg_number >= 8 else 0
+
+        byte_registers = []
+        if size == 1:
+            byte_registers = [operand for operand in (reg, rm) if isinstance(operand, str)]
+        elif byte_operand is not None and is_register(byte_operand):
+            byte_registers = [byte_operand]
+
+        if is_register(rm):
+            rm_number = REGISTER_NUMBERS[REGISTERS[rm]]
+            rex |= 0x01 if rm_number >= 8 else 0
+
+            self._emit_prefixes(size, rex, byte_registers)
+            self._emit_opcode(opcode)
+            self.code.append(0xC0 | ((reg_number & 7) << 3) | (rm_number & 7))
+            return
+
+        if not isinstance(rm, Memory):
+            raise EncoderError(f"Expected a register or memory operand: {rm}")
+
+        base = REGISTER_NUMBERS[REGISTERS[rm.base]] if rm.base is not None else None
+        index = REGISTER_NUMBERS[REGISTERS[rm.index]] if rm.index is not None else None
+
+        if index is not None and index >= 8:
+            rex |= 0x02
+        if base is not None and base >= 8:
+            rex |= 0x01
+
+        self._emit_prefixes(size, rex, byte_registers)
+        self._emit_opcode(opcode)
+
+        reg_bits = (reg_number & 7) << 3
+        scale_bits = {1: 0, 2: 1, 4: 2, 8: 3}[rm.scale] << 6
+
+        if base is None and index is None:
+            if rm.symbol is not None:
+                # [symbol + disp] is rip relative, the displacement is measured from the end of the instruction
+                self.code.append(0x05 | reg_bits)
+                self._emit_relocation(R_X86_64_PC32, rm.symbol, rm.disp - 4 - immediate_size, 4)
+            else:
+                self.code += bytes((0x04 | reg_bits, 0x25)) + struct.pack('<i', rm.disp)
+            return
+
+        if base is None:
+            self.code += bytes((0x04 | reg_bits, scale_bits | ((index & 7) << 3) | 0x05))
+            self._emit_displacement(rm, 4)
+            return
+
+        if rm.symbol is not None:
+            mod, displacement_size = 0x80, 4
+        elif rm.disp == 0 and (base & 7) != 5:
+            mod, displacement_size = 0x00, 0
+        elif fits_in(rm.disp, 8):
+            mod, displacement_size = 0x40, 1
+        else:
+            mod, displacement_size = 0x80, 4
+
+        if index is not None or (base & 7) == 4:
+            # rsp and r12 as base need a SIB byte, index 100 means no index
+            index_bits = ((index & 7) << 3) if index is not None else 0x20
+            self.code += bytes((mod | reg_bits | 0x04, scale_bits | index_bits | (base & 7)))
+        else:
+            self.code.append(mod | reg_bits | (base & 7))
+
+        self._emit_displacement(rm, displacement_size)
+
+    def _emit_displacement(self, memory: Memory, size: int):
+        if memory.symbol is not None:
+            self._emit_relocation(R_X86_64_32S, memory.symbol, memory.disp, 4)
+        elif size:
+            self.code += pack_immediate(memory.disp, size)
+
+    def _emit_opcode(self, opcode):
+        if isinstance(opcode, tuple):
+            self.code += bytes(opcode)
+        else:
+            self.code.append(opcode)
+
+
+class EncoderError(Exception):
+    def __init__(self, msg) -> None:
+        self.msg = msg
+
+    def __repr__(self) -> str:
+        return "[ERROR]: %s" % self.msg
+
+    def __str__(self) -> str:
+        return "[ERROR]: %s" % self.msg
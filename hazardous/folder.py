@@ -0,0 +1,283 @@
+from dataclasses import fields
+from . import nodes
+from .nodes import TypeEnum, is_node, walk
+from .scanner import TokenType
+from .generator import TYPE_SIZES
+
+
+MASK = (1 << 64) - 1
+
+
+def to_signed(value: int) -> int:
+    value &= MASK
+    return value - (1 << 64) if value >> 63 else value
+
+
+# has to agree with the generator, which works on full 64 bit registers:
+# division is unsigned, lower and greater equals compare against right - 1
+FOLDABLE_OPERATIONS = {
+    TokenType.PLUS: lambda a, b: a + b,
+    TokenType.MINUS: lambda a, b: a - b,
+    TokenType.STAR: lambda a, b: a * b,
+    TokenType.SLASH: lambda a, b: (a & MASK) // (b & MASK),
+    TokenType.PRECENT: lambda a, b: (a & MASK) % (b & MASK),
+    TokenType.DEQUALS: lambda a, b: int(to_signed(a) == to_signed(b)),
+    TokenType.NEQUALS: lambda a, b: int(to_signed(a) != to_signed(b)),
+    TokenType.GREATER: lambda a, b: int(to_signed(a) > to_signed(b)),
+    TokenType.LOWER: lambda a, b: int(to_signed(a) <= to_signed(b - 1)),
+    TokenType.LEQUALS: lambda a, b: int(to_signed(a) <= to_signed(b)),
+    TokenType.GEQUALS: lambda a, b: int(to_signed(a) > to_signed(b - 1)),
+    TokenType.ARROW_UP: lambda a, b: a ^ b,
+    TokenType.PIPE: lambda a, b: a | b,
+    TokenType.AMPERSAND: lambda a, b: a & b,
+    TokenType.AND: lambda a, b: int(a & MASK != 0 and b & MASK != 0),
+    TokenType.OR: lambda a, b: int(a & MASK != 0 or b & MASK != 0)
+}
+
+NUMERIC_TYPES = (TypeEnum.U8, TypeEnum.U16, TypeEnum.U32, TypeEnum.U64, TypeEnum.I8, TypeEnum.I16, TypeEnum.I32, TypeEnum.I64)
+
+# locals of these types read back exactly what was stored (after masking), smaller signed ones don't
+PROPAGATED_TYPE_MASKS = {
+    TypeEnum.U8: 0xFF,
+    TypeEnum.U16: 0xFFFF,
+    TypeEnum.U32: 0xFFFFFFFF,
+    TypeEnum.U64: MASK,
+    TypeEnum.I64: MASK
+}
+
+# types whose size doesn't depend on a struct layout
+SIZED_TYPES = [type_id for type_id in TYPE_SIZES if type_id not in (TypeEnum.STRUCT, TypeEnum.SUB_STRUCT, TypeEnum.CLASS)]
+
+
+class ConstantFolder:
+    def __init__(self):
+        self.folded = 0
+        self.propagated = 0
+        self.pruned = 0
+
+    def fold(self, program_tree):
+        self.enum_data = {}
+
+        for node in program_tree:
+            if isinstance(node, nodes.Enumeration):
+                self.enum_data[node.name] = node.values
+
+        for node in program_tree:
+            if isinstance(node, nodes.ProgramProcedure) and not node.forward_declared:
+                self._fold_procedure(node)
+
+        return program_tree
+
+    def _fold_procedure(self, node: nodes.ProgramProcedure):
+        declared = {}
+        written = set()
+        has_assembly = False
+
+        for _, arg_name in node.args:
+            declared[arg_name] = declared.get(arg_name, 0) + 1
+
+        for statement in node.body:
+            for child in walk(statement):
+                if isinstance(child, (nodes.LocalVariable, nodes.LocalArray, nodes.LocalStruct)):
+                    declared[child.name] = declared.get(child.name, 0) + 1
+                elif isinstance(child, (nodes.AssignVariable, nodes.AddressOf, nodes.Pop)):
+                    written.add(child.name)
+                elif isinstance(child, nodes.InlineAssembly):
+                    has_assembly = True
+
+        # a local can only be replaced by its value if nothing else could ever change or shadow it
+        self.candidates = set() if has_assembly else {name for name, count in declared.items() if count == 1 and name not in written}
+        self.scopes = [{}]
+
+        node.body = self._fold_statements(node.body, bind=True)
+
+    def _fold_statements(self, statements, bind: bool = False):
+        # bind is set for blocks that always run from top to bottom, only their locals are propagated
+        folded = []
+
+        for statement in statements:
+            statement = self._fold_node(statement)
+
+            if bind and isinstance(statement, nodes.LocalVariable):
+                self._bind(statement)
+
+            # pruned statements leave an empty Multiple behind
+            if not (isinstance(statement, nodes.Multiple) and not statement.nodes):
+                folded.append(statement)
+
+        return folded
+
+    def _fold_node(self, node):
+        method = getattr(self, f"_fold_{type(node).__name__}", None)
+
+        if method:
+            return method(node)
+
+        self._fold_children(node)
+        return node
+
+    def _fold_children(self, node):
+        for field in fields(node):
+            value = getattr(node, field.name)
+
+            if isinstance(value, list) and all(is_node(item) for item in value):
+                setattr(node, field.name, self._fold_statements(value))
+
+            elif is_node(value):
+                setattr(node, field.name, self._fold_node(value))
+
+    def constant(self, node):
+        # the value of node if it's known at compile time, None otherwise
+        if isinstance(node, nodes.Number):
+            return node.value
+
+        # casts don't truncate anything, they only change how the value is checked
+        if isinstance(node, nodes.Cast) and node.type.id in NUMERIC_TYPES:
+            return self.constant(node.value)
+
+        return None
+
+    def _number(self, value: int) -> nodes.Number:
+        self.folded += 1
+        return nodes.Number(value=to_signed(value))
+
+    def _fold_BinaryOperation(self, node: nodes.BinaryOperation):
+        node.left = self._fold_node(node.left)
+        node.right = self._fold_node(node.right)
+
+        left = self.constant(node.left)
+        right = self.constant(node.right)
+
+        # the right side of a short circuit is never evaluated
+        if left is not None and node.operation == TokenType.AND and left & MASK == 0:
+            return self._number(0)
+
+        if left is not None and node.operation == TokenType.OR and left & MASK != 0:
+            return self._number(1)
+
+        if left is None or right is None or node.operation not in FOLDABLE_OPERATIONS:
+            return node
+
+        # leave division by zero to the program
+        if node.operation in (TokenType.SLASH, TokenType.PRECENT) and right & MASK == 0:
+            return node
+
+        return self._number(FOLDABLE_OPERATIONS[node.operation](left, right))
+
+    def _fold_Negate(self, node: nodes.Negate):
+        node.value = self._fold_node(node.value)
+        value = self.constant(node.value)
+
+        if value is None:
+            return node
+
+        return self._number(int(value & MASK == 0))
+
+    def _fold_SizeofType(self, node: nodes.SizeofType):
+        if node.type.id in SIZED_TYPES:
+            return self._number(TYPE_SIZES[node.type.id])
+
+        return node
+
+    def _fold_Sizeof(self, node: nodes.Sizeof):
+        # the value is never evaluated, only its type matters, so it's left alone
+        if isinstance(node.value, (nodes.Number, nodes.String)):
+            return self._number(8)
+
+        if isinstance(node.value, nodes.Cast) and node.value.type.id in TYPE_SIZES:
+            return self._number(TYPE_SIZES[node.value.type.id])
+
+        return node
+
+    def _fold_AccessStructMember(self, node: nodes.AccessStructMember):
+        # enums take precedence over variables of the same name in the generator as well
+        if isinstance(node.struct_pointer, nodes.Variable) and node.struct_pointer.name in self.enum_data:
+            enum_data = self.enum_data[node.struct_pointer.name]
+
+            if node.name in enum_data:
+                return self._number(enum_data[node.name])
+
+            return node
+
+        self._fold_children(node)
+        return node
+
+    def _fold_Variable(self, node: nodes.Variable):
+        for scope in reversed(self.scopes):
+            if node.name in scope:
+                self.propagated += 1
+                return nodes.Number(value=scope[node.name])
+
+        return node
+
+    def _fold_LocalVariable(self, node: nodes.LocalVariable):
+        if node.value is not None:
+            node.value = self._fold_node(node.value)
+
+        return node
+
+    def _bind(self, node: nodes.LocalVariable):
+        value = self.constant(node.value) if node.value is not None else None
+
+        if value is None or node.name not in self.candidates:
+            return
+
+        # auto typed locals take the type of their (constant) value
+        if node.type:
+            type_id = node.type.id
+        else:
+            type_id = node.value.type.id if isinstance(node.value, nodes.Cast) else TypeEnum.I64
+
+        if type_id in PROPAGATED_TYPE_MASKS:
+            self.scopes[-1][node.name] = to_signed(value & PROPAGATED_TYPE_MASKS[type_id])
+
+    def _fold_CompoundStatement(self, node: nodes.CompoundStatement):
+        self.scopes.append({})
+        node.body = self._fold_statements(node.body, bind=True)
+        self.scopes.pop()
+
+        return node
+
+    def _fold_IfStatement(self, node: nodes.IfStatement):
+        node.value = self._fold_node(node.value)
+        node.body = self._fold_node(node.body)
+
+        if node.else_body:
+            node.else_body = self._fold_node(node.else_body)
+
+        value = self.constant(node.value)
+
+        if value is None:
+            return node
+
+        self.pruned += 1
+
+        if value & MASK != 0:
+            return node.body
+
+        return node.else_body or nodes.Multiple(nodes=[])
+
+    def _fold_WhileStatement(self, node: nodes.WhileStatement):
+        node.value = self._fold_node(node.value)
+        node.body = self._fold_node(node.body)
+
+        value = self.constant(node.value)
+
+        if value is not None and value & MASK == 0:
+            self.pruned += 1
+            return nodes.Multiple(nodes=[])
+
+        return node
+
+    def _fold_SwitchStatement(self, node: nodes.SwitchStatement):
+        node.value = self._fold_node(node.value)
+        node.cases = [(case_const, self._fold_statements(case_body)) for case_const, case_body in node.cases]
+
+        if node.default_case:
+            node.default_case = self._fold_statements(node.default_case)
+
+        return node
+
+    def total(self) -> int:
+        return self.folded + self.propagated + self.pruned
+
@@ -1,30 +1,31 @@
 from dataclasses import field
 from . import nodes
 from .scanner import TokenType, TokenLocation
-from .nodes import Cast, TypeEnum
+from .nodes import Cast, TypeEnum, walk
 from .localdict import LocalDict
+from .instructions import Instruction, Opcode, Memory, reads_register, render
+from .peephole import PeepholeOptimizer
+from .targets import Target, WINDOWS_X64
 import pprint
 
 
 
 ASM_TEMPLATE = """
-format MS64 COFF
+format {format}
 ; bits 64
 ; default rel
 
-section '.text' readable executable
+{text_section}
 {externs}
 
 {functions}
 
-section '.data' readable writeable
+{data_section}
 {data}
 
 ; segment .bss
 {bss}
-"""
-
-ARGUMENT_REGISTERS = ('rcx', 'rdx', 'r8', 'r9')
+{footer}"""
 
 TYPE_SIZES = {
     TypeEnum.U8: 1,
@@ -138,112 +139,122 @@ for i in range(8, 16):
         8: f"r{i}"
 }
 
+# operations on rax (left) and rbx (right), followed by the register holding the result
 BINARY_OPERATIONS = {
-    TokenType.PLUS: [
-        'pop rax',
-        'pop rbx',
-        'add rax, rbx',
-        'push rax'
-    ],
-    TokenType.MINUS: [
-        'pop rax',
-        'pop rbx',
-        'sub rax, rbx',
-        'push rax'
-    ],
-    TokenType.STAR: [
-        'pop rax',
-        'pop rbx',
-        'mul rbx',
-        'push rax'
-    ],
-    TokenType.SLASH: [
-        'xor rdx, rdx',
-        'pop rax',
-        'pop rbx',
-        'div rbx',
-        'push rax'
-    ],
-    TokenType.DEQUALS: [
-        'pop rax',
-        'pop rbx',
-        'cmp rax, rbx',
-        'sete al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.NEQUALS: [
-        'pop rax',
-        'pop rbx',
-        'cmp rax, rbx',
-        'setne al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.GREATER: [
-        'pop rax',
-        'pop rbx',
-        'cmp rax, rbx',
-        'setg al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.LOWER: [
-        'pop rax',
-        'pop rbx',
-        'sub rbx, 1',
-        'cmp rax, rbx',
-        'setle al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.LEQUALS: [
-        'pop rax',
-        'pop rbx',
-        'cmp rax, rbx',
-        'setle al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.GEQUALS: [
-        'pop rax',
-        'pop rbx',
-        'sub rbx, 1',
-        'cmp rax, rbx',
-        'setg al',
-        'movzx rax, al',
-        'push rax'
-    ],
-    TokenType.PRECENT: [
-        'xor rdx, rdx',
-        'pop rax',
-        'pop rbx',
-        'div rbx',
-        'push rdx'
-    ],
-    TokenType.ARROW_UP: [
-        'pop rax',
-        'pop rbx',
-        'xor rax, rbx',
-        'push rax'
-    ],
-    TokenType.PIPE: [
-        'pop rax',
-        'pop rbx',
-        'or rax, rbx',
-        'push rax'
-    ],
-    TokenType.AMPERSAND: [
-        'pop rax',
-        'pop rbx',
-        'and rax, rbx',
-        'push rax'
-    ]
+    TokenType.PLUS: ([Instruction(Opcode.ADD, ('rax', 'rbx'))], 'rax'),
+    TokenType.MINUS: ([Instruction(Opcode.SUB, ('rax', 'rbx'))], 'rax'),
+    TokenType.STAR: ([Instruction(Opcode.MUL, ('rbx',))], 'rax'),
+    TokenType.SLASH: ([
+        Instruction(Opcode.XOR, ('rdx', 'rdx')),
+        Instruction(Opcode.DIV, ('rbx',))
+    ], 'rax'),
+    TokenType.DEQUALS: ([
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETE, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.NEQUALS: ([
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETNE, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.GREATER: ([
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETG, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.LOWER: ([
+        Instruction(Opcode.SUB, ('rbx', 1)),
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETLE, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.LEQUALS: ([
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETLE, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.GEQUALS: ([
+        Instruction(Opcode.SUB, ('rbx', 1)),
+        Instruction(Opcode.CMP, ('rax', 'rbx')),
+        Instruction(Opcode.SETG, ('al',)),
+        Instruction(Opcode.MOVZX, ('rax', 'al'))
+    ], 'rax'),
+    TokenType.PRECENT: ([
+        Instruction(Opcode.XOR, ('rdx', 'rdx')),
+        Instruction(Opcode.DIV, ('rbx',))
+    ], 'rdx'),
+    TokenType.ARROW_UP: ([Instruction(Opcode.XOR, ('rax', 'rbx'))], 'rax'),
+    TokenType.PIPE: ([Instruction(Opcode.OR, ('rax', 'rbx'))], 'rax'),
+    TokenType.AMPERSAND: ([Instruction(Opcode.AND, ('rax', 'rbx'))], 'rax')
+}
+
+# registers used to hold expression temporaries when register allocation is enabled
+# rax and rbx are the working registers of the operations that aren't done in place, mul, div
+# and % also write rdx, and the argument registers of both targets can be read with %rcx etc.
+TEMP_REGISTERS = ('r10', 'r11', 'r12', 'r13', 'r14', 'r15')
+
+# with register allocation these work on the left operand's register directly, the right
+# operand can be a register, a memory operand or an immediate
+REGISTER_OPERATIONS = {
+    TokenType.PLUS: Opcode.ADD,
+    TokenType.MINUS: Opcode.SUB,
+    TokenType.STAR: Opcode.IMUL,
+    TokenType.ARROW_UP: Opcode.XOR,
+    TokenType.PIPE: Opcode.OR,
+    TokenType.AMPERSAND: Opcode.AND
 }
 
+# comparisons done in place, followed by the set instruction of their result
+REGISTER_COMPARISONS = {
+    TokenType.DEQUALS: Opcode.SETE,
+    TokenType.NEQUALS: Opcode.SETNE,
+    TokenType.GREATER: Opcode.SETG,
+    TokenType.LOWER: Opcode.SETL,
+    TokenType.LEQUALS: Opcode.SETLE,
+    TokenType.GEQUALS: Opcode.SETGE
+}
+
+# expressions that can't change a variable, the right operand can be read from memory after them
+PURE_NODES = (nodes.Number, nodes.String, nodes.Variable, nodes.BinaryOperation, nodes.Cast)
+
+# switch statements with at least this many cases, covering at least this fraction
+# of their value range, dispatch through a jump table instead of a search tree
+JUMP_TABLE_MIN_CASES = 4
+JUMP_TABLE_MIN_DENSITY = 0.4
+# search tree nodes with this many cases or less just compare against each one
+LINEAR_SEARCH_MAX_CASES = 3
+
+# procedures with at most this many nodes are inlined at every call site
+INLINE_BUDGET = 40
+# local procedures with a single call site are inlined up to this size, and then left out
+INLINE_SINGLE_CALL_BUDGET = 400
+# how many inlined bodies can be nested inside each other
+INLINE_MAX_DEPTH = 3
+# inlined bodies can add this percentage of the caller's own nodes to it, but at least INLINE_GROWTH_MIN nodes
+INLINE_GROWTH_PERCENT = 50
+INLINE_GROWTH_MIN = 2 * INLINE_BUDGET
+# these depend on the procedure's own frame or argument registers
+INLINE_BLOCKERS = (nodes.Push, nodes.Pop, nodes.Call, nodes.InlineAssembly, nodes.Register, nodes.AssignRegister)
+
 
 class Generator:
-    def generate(self, program_tree):
+    def __init__(self, allocate_registers: bool = False, peephole: PeepholeOptimizer = None, inline: bool = False, target: Target = WINDOWS_X64):
+        # calling convention and object format of the output
+        self.target = target
+        # keep expression temporaries in TEMP_REGISTERS instead of the machine stack
+        self.allocate_registers = allocate_registers
+        # ran over every emitted procedure body
+        self.peephole = peephole
+        # substitute small procedures at their call sites
+        self.inline = inline
+        self.inlined = 0
+
+    def generate(self, program_tree) -> str:
+        self.build(program_tree)
+        return self.assembly()
+
+    def build(self, program_tree):
         self.current_id = 0
         self.current_label = 0
         self.bss = {}
@@ -253,15 +264,26 @@ class Generator:
         self.current_function = None
         self.current_body = None
         self.current_locals = LocalDict()
+        self.old_locals = None
         self.globals = {}
         self.struct_data = {}
+        self.sub_struct_layouts = {}
         self.class_data = {}
         self.enum_data = {}
         self.break_stack = []
+        self.value_stack = []
+        self.unknown_stack_depth = False
+        self.stack_base = 0
+        self.jump_tables = {}
+        self.procedures = {}
+        self.call_sites = {}
+        self.inline_sizes = {}
+        self.inline_stack = []
+        self.inline_allowance = 0
 
         self.functions['malloc'] = {
-            "return_type": nodes.Type(id=TypeEnum.PTR),
-            "arguments": [(nodes.Type(id=TypeEnum.U64), 'size')],
+            "return_type": nodes.primitive_type(TypeEnum.PTR),
+            "arguments": [(nodes.primitive_type(TypeEnum.U64), 'size')],
             "extern": True,
             "varargs": False,
             "stdcall": False,
@@ -270,8 +292,8 @@ class Generator:
         }
 
         self.functions['free'] = {
-            "return_type": nodes.Type(id=TypeEnum.NONE),
-            "arguments": [(nodes.Type(id=TypeEnum.PTR), 'ptr')],
+            "return_type": nodes.primitive_type(TypeEnum.NONE),
+            "arguments": [(nodes.primitive_type(TypeEnum.PTR), 'ptr')],
             "extern": True,
             "varargs": False,
             "stdcall": False,
@@ -299,29 +321,55 @@ class Generator:
                     "is_local": node.is_local
                 }
 
+                if not node.forward_declared:
+                    self.procedures[node.name] = node
+
+        if self.inline:
+            self.count_call_sites()
+
         for node in program_tree:
             if not isinstance(node, (nodes.ProgramClass, nodes.ProgramStruct)):
                 self._generate_node(node)
 
 
-        funcs = ""
+        # procedure name -> final body, in output order
+        self.emitted = {}
 
         for func_name, func_data in self.functions.items():
             if not func_data['extern'] and func_data['body']:
                 if func_data['called']:
-                    body = '\n'.join(f'    {line}' for line in func_data['body'])
-                    funcs += f"{func_name}:\n{body}\n\n"
+                    body = func_data['body']
+                    if self.peephole:
+                        body = self.peephole.optimize(body)
+
+                    self.emitted[func_name] = body
                 elif not func_data['is_local']:
                     self.externs.remove(f"public {func_name}")
 
             elif func_data['extern'] and not func_data['called']:
                 self.externs.remove(f"extrn {func_name}")
 
+        # tables of procedures that were left out would point at missing labels
+        for table_name, (func_name, entries) in self.jump_tables.items():
+            if func_name in self.emitted:
+                self.data[table_name] = (TypeEnum.U64, entries)
+
+    def assembly(self) -> str:
+        funcs = ''.join(f"{func_name}:\n{render(body)}\n\n" for func_name, body in self.emitted.items())
         data_txt = '\n'.join(f"    {data_name}: d{ASM_TYPE_LETTERS[data_values[0]]} {data_values[1]}" for data_name, data_values in self.data.items())
         bss_txt =  '\n'.join(f"    {bss_name}: r{ASM_TYPE_LETTERS[bss_values[0]]} {bss_values[1]}" for bss_name, bss_values in self.bss.items())
         extern_txt =  '\n'.join(f"    {extern_name}" for extern_name in self.externs)
 
-        return ASM_TEMPLATE.format(bss=bss_txt, data=data_txt, functions=funcs, externs=extern_txt)
+        return ASM_TEMPLATE.format(
+            format=self.target.format,
+            text_section=self.target.text_section,
+            data_section=self.target.data_section,
+            footer=self.target.footer,
+            bss=bss_txt,
+            data=data_txt,
+            functions=funcs,
+            externs=extern_txt
+        )
 
     def _generate_node(self, node):
         name = type(node).__name__
@@ -332,6 +380,160 @@ class Generator:
 
         method(node)
 
+    def _emit(self, opcode: Opcode, *operands):
+        self.current_body.append(Instruction(opcode, operands))
+
+    # value stack
+    # every expression leaves its value on the value stack, which is either the machine stack
+    # or, with register allocation enabled, one of TEMP_REGISTERS (None marks a machine stack slot)
+
+    def _push(self, value):
+        if not self.allocate_registers:
+            self._emit(Opcode.PUSH, value)
+            self.value_stack.append(None)
+            return
+
+        # the value was built in a free register already
+        if value in TEMP_REGISTERS and value not in self.value_stack:
+            self.value_stack.append(value)
+            return
+
+        reg = self._allocate()
+        self._emit(Opcode.MOV, reg, value)
+        self.value_stack.append(reg)
+
+    def _allocate(self) -> str:
+        # register the next value can be built in before it's pushed, rax without register allocation
+        if not self.allocate_registers:
+            return 'rax'
+
+        free = [reg for reg in TEMP_REGISTERS if reg not in self.value_stack]
+
+        # out of registers, spill everything
+        if not free:
+            self._spill()
+            return TEMP_REGISTERS[0]
+
+        return free[0]
+
+    def _pop(self, reg: str):
+        source = self.value_stack.pop()
+
+        if source is None:
+            self._emit(Opcode.POP, reg)
+        elif source != reg:
+            self._emit(Opcode.MOV, reg, source)
+
+    def _pop_any(self) -> str:
+        # leaves the value in the register it's already in, values on the machine stack go to rax
+        source = self.value_stack.pop()
+
+        if source is None:
+            self._emit(Opcode.POP, 'rax')
+            return 'rax'
+
+        return source
+
+    def _drop(self):
+        source = self.value_stack.pop()
+
+        last = self.current_body[-1]
+
+        if source is None:
+            if last.opcode == Opcode.PUSH:
+                self.current_body.pop()
+            else:
+                self._emit(Opcode.ADD, 'rsp', 8)
+
+        elif last.opcode == Opcode.MOV and last.operands[0] == source:
+            self.current_body.pop()
+
+    def _spill(self, keep: int = 0):
+        # moves all register values (except the top 'keep' ones) onto the machine stack
+        # register values always sit above the spilled ones, so pushing them in order is safe
+        for i in range(len(self.value_stack) - keep):
+            if self.value_stack[i] is not None:
+                self._emit(Opcode.PUSH, self.value_stack[i])
+                self.value_stack[i] = None
+
+    # calls
+
+    def _align_call(self, stack_args: int) -> int:
+        # has to run before the arguments are generated, the stack needs to be 16 byte aligned at the call
+        # everything pending goes to the machine stack first, so its depth is known
+        # returns the number of slots the call owns below its stack arguments
+        self._spill()
+        slots = 0
+
+        if self.stack_base is None:
+            # _emit_call realigns these at runtime instead
+            if stack_args == 0:
+                return 0
+
+            # stack arguments are pushed before the call, so the stack is realigned here
+            # the old stack pointer is kept right above the aligned base, calls nested in the arguments align against it
+            self._emit(Opcode.MOV, 'rax', 'rsp')
+            self._emit(Opcode.AND, 'rsp', -16)
+            self._emit(Opcode.PUSH, 'rax')
+            self.stack_base = len(self.value_stack)
+            self.value_stack.append(None)
+            slots = 1
+
+        if (len(self.value_stack) - self.stack_base + stack_args) % 2 == 0:
+            return slots
+
+        # the padding is tracked like a value, nested calls have to count it too
+        self._emit(Opcode.SUB, 'rsp', 8)
+        self.value_stack.append(None)
+        return slots + 1
+
+    def _emit_call(self, func_name: str, stack_args: int, padding: int, cleanup: bool = True, varargs: bool = False):
+        realign = self.stack_base is None and stack_args == 0
+        # this call realigned the stack in _align_call, its lowest slot holds the old stack pointer
+        restore = self.unknown_stack_depth and self.stack_base == len(self.value_stack) - stack_args - padding
+
+        if realign:
+            self._emit_realign()
+
+        if self.target.shadow_space:
+            self._emit(Opcode.SUB, 'rsp', self.target.shadow_space)
+
+        if varargs and self.target.varargs_vector_count:
+            # no arguments are passed in vector registers
+            self._emit(Opcode.XOR, 'eax', 'eax')
+
+        self._emit(Opcode.CALL, func_name)
+
+        size = self.target.shadow_space + (stack_args + padding) * 8
+        if realign:
+            self._emit_restore()
+        elif restore:
+            # stdcall procedures already removed their stack arguments
+            size = self.target.shadow_space + ((stack_args if cleanup else 0) + padding - 1) * 8
+            if size:
+                self._emit(Opcode.ADD, 'rsp', size)
+            self._emit(Opcode.POP, 'rsp')
+            self.stack_base = None
+        elif cleanup and size:
+            self._emit(Opcode.ADD, 'rsp', size)
+
+        del self.value_stack[len(self.value_stack) - stack_args - padding:]
+
+    def _emit_realign(self):
+        # the old stack pointer goes right above the aligned base, so it doesn't depend on the callee
+        # leaving any register alone (procedures of this unit use rbx without saving it)
+        self._emit(Opcode.MOV, 'rax', 'rsp')
+        self._emit(Opcode.AND, 'rsp', -16)
+        self._emit(Opcode.SUB, 'rsp', 8)
+        self._emit(Opcode.PUSH, 'rax')
+
+    def _emit_restore(self):
+        # undoes _emit_realign after the call
+        if self.target.shadow_space:
+            self._emit(Opcode.ADD, 'rsp', self.target.shadow_space)
+
+        self._emit(Opcode.POP, 'rsp')
+
 
     def _generate_ProgramVariable(self, node: nodes.ProgramVariable):
         self.globals[node.name] = {
@@ -365,9 +567,9 @@ class Generator:
             return
 
         func_data['body'] = [
-            'push rbp',
-            'mov rbp, rsp',
-            'sub rsp, SIZE'
+            Instruction(Opcode.PUSH, ('rbp',)),
+            Instruction(Opcode.MOV, ('rbp', 'rsp')),
+            Instruction(Opcode.SUB, ('rsp', 0))
         ]
 
         if node.name == "main":
@@ -379,59 +581,95 @@ class Generator:
         self.local_offset = 0
         self.max_align = 1
         self.current_label = 0
+        self.value_stack = []
+        # the program moves the stack pointer itself, its depth at a call can't be known
+        self.unknown_stack_depth = any(isinstance(child, (nodes.Push, nodes.Pop, nodes.Call, nodes.InlineAssembly)) for statement in node.body for child in walk(statement))
+        # value stack index the stack is 16 byte aligned at, None while that isn't known
+        self.stack_base = None if self.unknown_stack_depth else 0
+
+        if self.inline:
+            # nested inlining multiplies, every inlined body at any depth takes from the same allowance
+            self.inline_allowance = max(INLINE_GROWTH_MIN, sum(1 for statement in node.body for _ in walk(statement)) * INLINE_GROWTH_PERCENT // 100)
 
         if not node.is_local:
             # global {node.name}
             if f'public {node.name}' not in self.externs:
                 self.externs.append(f'public {node.name}')
 
-        arg_registers = len(ARGUMENT_REGISTERS)
+        arg_registers = self.target.argument_registers
+        # return address and rbp, then the shadow space of the caller
+        stack_args_offset = 16 + self.target.shadow_space
 
         for i, (arg_type, arg_name) in enumerate(node.args):
-            arg_type_size, arg_type_name = TYPE_SIZES[arg_type.id], ASM_TYPE_NAMES[arg_type.id]
+            arg_type_size = TYPE_SIZES[arg_type.id]
             self._generate_LocalVariable(nodes.LocalVariable(name=arg_name, location=node.location, type=arg_type, value=None))
             # move parameter into the local variable
-            if i < arg_registers:
-                self.current_body.append(f'mov {arg_type_name.lower()} [rbp - {self.local_offset}], {REGISTER_VARIATIONS[ARGUMENT_REGISTERS[i]][arg_type_size]}')
+            if i < len(arg_registers):
+                self._emit(Opcode.MOV, Memory(arg_type_size, 'rbp', -self.local_offset), REGISTER_VARIATIONS[arg_registers[i]][arg_type_size])
             # read parameter from the stack
             else:
-                # rbp + 48 = first parameter
-                self.current_body.append(f'mov {REGISTER_VARIATIONS["rax"][arg_type_size]}, {arg_type_name.lower()} [rbp + {48 + ((i - 4) * 8)}]')
-                self.current_body.append(f'mov {arg_type_name.lower()} [rbp - {self.local_offset}], {REGISTER_VARIATIONS["rax"][arg_type_size]}')
+                self._emit(Opcode.MOV, REGISTER_VARIATIONS["rax"][arg_type_size], Memory(arg_type_size, 'rbp', stack_args_offset + ((i - len(arg_registers)) * 8)))
+                self._emit(Opcode.MOV, Memory(arg_type_size, 'rbp', -self.local_offset), REGISTER_VARIATIONS["rax"][arg_type_size])
                 
 
         for statement in node.body:
             self._generate_node(statement)
 
+        if node.return_type.id == TypeEnum.NONE and self.current_body[-1].opcode != Opcode.RET:
+            self._emit(Opcode.MOV, 'rsp', 'rbp')
+            self._emit(Opcode.POP, 'rbp')
+            self._emit(Opcode.RET)
+
+        else:
+            if self.current_body[-1].opcode != Opcode.RET:
+                raise GeneratorError(f"Missing return statement in procedure '{node.name}'", node.location)
+
+        # callee saved registers handed out as temporaries get a slot below the locals
+        # rbx is only ever a working register, like in procedures without register allocation
+        saved_registers = [reg for reg in TEMP_REGISTERS if reg in self.target.callee_saved_registers and self.uses_register(reg)]
+
+        if saved_registers:
+            if 8 > self.max_align:
+                self.max_align = 8
+
+            remainder = self.local_offset % 8
+            if remainder != 0:
+                self.local_offset += 8 - remainder
+
+            saves, restores = [], []
+
+            for reg in saved_registers:
+                self.local_offset += 8
+                saves.append(Instruction(Opcode.MOV, (Memory(8, 'rbp', -self.local_offset), reg)))
+                restores.append(Instruction(Opcode.MOV, (reg, Memory(8, 'rbp', -self.local_offset))))
+
+            body = self.current_body[:3] + saves
+
+            for instruction in self.current_body[3:]:
+                if instruction.opcode == Opcode.MOV and instruction.operands == ('rsp', 'rbp'):
+                    body.extend(restores)
+                body.append(instruction)
+
+            self.current_body[:] = body
+
         rem = self.local_offset % self.max_align
         if rem != 0:
             self.local_offset += self.max_align - rem
 
-        if self.current_locals:
+        if self.current_locals or saved_registers:
             aligned_locals, remainder = (self.local_offset // 16), (self.local_offset % 16 > 0)
-            self.current_body[2] = f'sub rsp, {aligned_locals * 16 + (16 * remainder)}'
+            self.current_body[2] = Instruction(Opcode.SUB, ('rsp', aligned_locals * 16 + (16 * remainder)))
         else:
             self.current_body.pop(2)
 
-
-        if node.return_type.id == TypeEnum.NONE and self.current_body[-1] != 'ret':
-            self.current_body.append('mov rsp, rbp')
-            self.current_body.append('pop rbp')
-            self.current_body.append('ret')
-
-        else:
-            if self.current_body[-1] != 'ret':
-                raise GeneratorError(f"Missing return statement in procedure '{node.name}'", node.location)
-
     def _generate_LocalVariable(self, node: nodes.LocalVariable):
         if node.type:
             type_size, type_name = TYPE_SIZES[node.type.id], ASM_TYPE_NAMES[node.type.id]
             padding = 0
             
             if node.type.id == TypeEnum.SUB_STRUCT:
-                struct_data = self.calculate_struct(node.type.data['fields'])
+                struct_data = self.sub_struct_layout(node.type)
                 array_size = struct_data['size']
-                node.type.data = struct_data
 
                 self.local_offset += array_size + (array_size % 8)
                 array_offset = self.local_offset
@@ -456,8 +694,8 @@ class Generator:
 
                 if not node.value:
                     ptr_offset = self.local_offset
-                    self.current_body.append(f'lea rax, [rbp - {array_offset}]')
-                    self.current_body.append(f'mov qword [rbp - {ptr_offset}], rax')
+                    self._emit(Opcode.LEA, 'rax', Memory(0, 'rbp', -array_offset))
+                    self._emit(Opcode.MOV, Memory(8, 'rbp', -ptr_offset), 'rax')
 
             else:
                 if type_size > self.max_align:
@@ -505,8 +743,8 @@ class Generator:
             }
 
             self._generate_node(node.value)
-            self.current_body.append('pop rax')
-            self.current_body.append(f'mov {type_name.lower()} [rbp - {var_offset}], {REGISTER_VARIATIONS["rax"][type_size]}')
+            source = self._pop_any()
+            self._emit(Opcode.MOV, Memory(type_size, 'rbp', -var_offset), REGISTER_VARIATIONS[source][type_size])
             return
 
 
@@ -516,14 +754,14 @@ class Generator:
 
         resolved_type = self.resolve_type(node.value)
 
-        assert resolved_type is not None, "FAILED AT LOC %s:%d:%d" % node.location
+        assert resolved_type is not None, "FAILED AT LOC %s:%d:%d" % tuple(node.location)
 
         self.validate_type(node.type, resolved_type, node.location, "Tried assinging non matching types for variable '{}', expected '{}', but got '{}'", node.name, self.get_type_name(node.type), self.get_type_name(resolved_type))
 
         var_offset = self.local_offset
         self._generate_node(node.value)
-        self.current_body.append('pop rax')
-        self.current_body.append(f'mov {type_name.lower()} [rbp - {var_offset}], {REGISTER_VARIATIONS["rax"][type_size]}')
+        source = self._pop_any()
+        self._emit(Opcode.MOV, Memory(type_size, 'rbp', -var_offset), REGISTER_VARIATIONS[source][type_size])
 
     def _generate_LocalArray(self, node: nodes.LocalArray):
         type_size = TYPE_SIZES[node.type.id]
@@ -546,14 +784,14 @@ class Generator:
 
         self.current_locals[node.name] = {
             "size": 8,
-            "type": nodes.Type(id=TypeEnum.PTR, is_base_type=False,base_type=node.type),
+            "type": nodes.pointer_type(node.type),
             "offset": self.local_offset
         }
 
         ptr_offset = self.local_offset
 
-        self.current_body.append(f'lea rax, [rbp - {array_offset}]')
-        self.current_body.append(f'mov qword [rbp - {ptr_offset}], rax')
+        self._emit(Opcode.LEA, 'rax', Memory(0, 'rbp', -array_offset))
+        self._emit(Opcode.MOV, Memory(8, 'rbp', -ptr_offset), 'rax')
 
     def _generate_LocalStruct(self, node: nodes.LocalStruct):
         name = node.type.data['struct_name'] if node.type.id == TypeEnum.STRUCT else node.type.data['class_name']
@@ -584,8 +822,8 @@ class Generator:
 
         ptr_offset = self.local_offset
 
-        self.current_body.append(f'lea rax, [rbp - {array_offset}]')
-        self.current_body.append(f'mov qword [rbp - {ptr_offset}], rax')
+        self._emit(Opcode.LEA, 'rax', Memory(0, 'rbp', -array_offset))
+        self._emit(Opcode.MOV, Memory(8, 'rbp', -ptr_offset), 'rax')
 
     def _generate_AssignVariable(self, node: nodes.AssignVariable):
         resolved_type = self.resolve_type(node.value)
@@ -602,9 +840,9 @@ class Generator:
             self.validate_type(var_type, resolved_type, node.location, "Tried assinging non matching types for variable '{}', expected '{}', but got '{}'", node.name, self.get_type_name(var_type), self.get_type_name(resolved_type))
 
             self._generate_node(node.value)
-            self.current_body.append('pop rax')
-            self.current_body.append(f'mov {type_name.lower()} [rbp - {offset}], {REGISTER_VARIATIONS["rax"][type_size]}')
-            self.current_body.append('push rax')
+            source = self._pop_any()
+            self._emit(Opcode.MOV, Memory(type_size, 'rbp', -offset), REGISTER_VARIATIONS[source][type_size])
+            self._push(source)
 
         elif node.name in self.globals:
             var_type = self.globals[node.name]['type']
@@ -616,20 +854,21 @@ class Generator:
             self.validate_type(var_type, resolved_type, node.location, "Tried assinging non matching types for variable '{}', expected '{}', but got '{}'", node.name, self.get_type_name(var_type), self.get_type_name(resolved_type))
 
             self._generate_node(node.value)
-            self.current_body.append('pop rax')
-            self.current_body.append(f'mov {type_name.lower()} [{node.name}], {REGISTER_VARIATIONS["rax"][type_size]}')
-            self.current_body.append('push rax')
+            source = self._pop_any()
+            self._emit(Opcode.MOV, Memory(type_size, symbol=node.name), REGISTER_VARIATIONS[source][type_size])
+            self._push(source)
 
         else:
             raise GeneratorError(f"Attempted assinging to an undefined variable '{node.name}'", node.location)
 
     def _generate_Number(self, node: nodes.Number):
-        if node.value == 0:
-            self.current_body.append("xor rax, rax")
-        else:
-            self.current_body.append(f'mov rax, {node.value}')
-        
-        self.current_body.append('push rax')
+        # push only takes sign extended 32 bit immediates
+        if -0x80000000 <= node.value <= 0x7FFFFFFF:
+            self._push(node.value)
+            return
+
+        self._emit(Opcode.MOV, 'rax', node.value)
+        self._push('rax')
 
     def _generate_String(self, node: nodes.String):
         string_parsed: str = node.value[1:-1]
@@ -642,11 +881,14 @@ class Generator:
         string_hex = ','.join(map(hex, list(string_parsed.encode('utf-8'))))
         self.data[f"__str_{self.current_id}"] = (TypeEnum.U8, string_hex)
         if self.current_body is not None:
-            self.current_body.append(f'mov rax, __str_{self.current_id}')
-            self.current_body.append('push rax')
+            self._emit(Opcode.MOV, 'rax', f'__str_{self.current_id}')
+            self._push('rax')
         self.current_id += 1
 
     def _generate_Variable(self, node: nodes.Variable):
+        reg = self._allocate()
+        variations = REGISTER_VARIATIONS[reg]
+
         if node.name in self.current_locals:
             type_id = self.current_locals[node.name]['type'].id
 
@@ -657,16 +899,16 @@ class Generator:
             if type_size != 8:
                 if type_id in [TypeEnum.I8, TypeEnum.I16, TypeEnum.I32]:
                     # self.current_body.append(f'movsx rax, {type_name.lower()} [rbp - {offset}]')
-                    self.current_body.append(f'mov eax, dword [rbp - {offset}]')
+                    self._emit(Opcode.MOV, variations[4], Memory(4, 'rbp', -offset))
                 else:
                     #self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][type_size]}')
                     if type_size != 4:
-                        self.current_body.append(f'mov rax, [rbp - {offset}]')
-                        self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][type_size]}')
+                        self._emit(Opcode.MOV, reg, Memory(0, 'rbp', -offset))
+                        self._emit(Opcode.MOVZX, reg, variations[type_size])
                     else:
-                        self.current_body.append(f"mov eax, dword [rbp - {offset}]")
+                        self._emit(Opcode.MOV, variations[4], Memory(4, 'rbp', -offset))
             else:
-                self.current_body.append(f'mov rax, {type_name.lower()} [rbp - {offset}]')
+                self._emit(Opcode.MOV, reg, Memory(type_size, 'rbp', -offset))
             
         elif node.name in self.globals:
             type_id = self.globals[node.name]['type'].id
@@ -676,20 +918,20 @@ class Generator:
             if type_size != 8:
                 if type_id in [TypeEnum.I8, TypeEnum.I16, TypeEnum.I32]:
                     # self.current_body.append(f'movsx rax, {type_name.lower()} [{node.name}]')
-                    self.current_body.append(f'mov eax, {type_name.lower()} [{node.name}]')
+                    self._emit(Opcode.MOV, variations[4], Memory(type_size, symbol=node.name))
                 else:
                     #self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][type_size]}')
                     if type_size != 4:
-                        self.current_body.append(f'mov rax, [{node.name}]')
-                        self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][type_size]}')
+                        self._emit(Opcode.MOV, reg, Memory(symbol=node.name))
+                        self._emit(Opcode.MOVZX, reg, variations[type_size])
                     else:
-                        self.current_body.append(f"mov eax, dword [{node.name}]")
+                        self._emit(Opcode.MOV, variations[4], Memory(4, symbol=node.name))
             else:
-                self.current_body.append(f'mov rax, [{node.name}]')
+                self._emit(Opcode.MOV, reg, Memory(symbol=node.name))
         else:
             raise GeneratorError(f"Unknown variable '{node.name}'", node.location)
 
-        self.current_body.append('push rax')
+        self._push(reg)
 
     def _generate_BinaryOperation(self, node: nodes.BinaryOperation):
         if node.operation == TokenType.AND:
@@ -698,26 +940,27 @@ class Generator:
             not_true_jmp = self.current_label
             self.current_label += 1
            
+            self._pop('rax')
+            # both branches have to agree on where the pending values are
+            self._spill()
             self.current_body.extend([
-                'pop rax',
-                'cmp rax, 0',
-                f'je .L{not_true_jmp}'
+                Instruction(Opcode.CMP, ('rax', 0)),
+                Instruction(Opcode.JE, (f'.L{not_true_jmp}',))
             ])
 
             self._generate_node(node.right)
 
+            self._pop('rax')
             self.current_body.extend([
-                'pop rax',
-                'cmp rax, 0',
-                'setne al',
-                'movzx rax, al',
-                'push rax',
-                f'jmp .L{self.current_label}',
-                f'.L{not_true_jmp}:',
-                'mov rax, 0',
-                'push rax',
-                f'.L{self.current_label}:'
+                Instruction(Opcode.CMP, ('rax', 0)),
+                Instruction(Opcode.SETNE, ('al',)),
+                Instruction(Opcode.MOVZX, ('rax', 'al')),
+                Instruction(Opcode.JMP, (f'.L{self.current_label}',)),
+                Instruction(Opcode.LABEL, (f'.L{not_true_jmp}',)),
+                Instruction(Opcode.MOV, ('rax', 0)),
+                Instruction(Opcode.LABEL, (f'.L{self.current_label}',))
             ])
+            self._push('rax')
 
             self.current_label += 1
             return
@@ -728,41 +971,103 @@ class Generator:
             not_true_jmp = self.current_label
             self.current_label += 1
            
+            self._pop('rax')
+            # both branches have to agree on where the pending values are
+            self._spill()
             self.current_body.extend([
-                'pop rax',
-                'cmp rax, 0',
-                f'jne .L{not_true_jmp}'
+                Instruction(Opcode.CMP, ('rax', 0)),
+                Instruction(Opcode.JNE, (f'.L{not_true_jmp}',))
             ])
 
             self._generate_node(node.right)
 
+            self._pop('rax')
             self.current_body.extend([
-                'pop rax',
-                'cmp rax, 0',
-                'setne al',
-                'movzx rax, al',
-                'push rax',
-                f'jmp .L{self.current_label}',
-                f'.L{not_true_jmp}:',
-                'mov rax, 1',
-                'push rax',
-                f'.L{self.current_label}:'
+                Instruction(Opcode.CMP, ('rax', 0)),
+                Instruction(Opcode.SETNE, ('al',)),
+                Instruction(Opcode.MOVZX, ('rax', 'al')),
+                Instruction(Opcode.JMP, (f'.L{self.current_label}',)),
+                Instruction(Opcode.LABEL, (f'.L{not_true_jmp}',)),
+                Instruction(Opcode.MOV, ('rax', 1)),
+                Instruction(Opcode.LABEL, (f'.L{self.current_label}',))
             ])
+            self._push('rax')
 
             self.current_label += 1
             return
 
+        if self.allocate_registers and (node.operation in REGISTER_OPERATIONS or node.operation in REGISTER_COMPARISONS):
+            self._generate_register_operation(node)
+            return
+
         self._generate_node(node.right)
         self._generate_node(node.left)
-        self.current_body.extend(BINARY_OPERATIONS[node.operation])
+
+        operation, result = BINARY_OPERATIONS[node.operation]
+        self._pop('rax')
+        self._pop('rbx')
+        self.current_body.extend(operation)
+        self._push(result)
+
+    def _generate_register_operation(self, node: nodes.BinaryOperation):
+        operand = self._operand(node.right, node.left)
+
+        if operand is not None:
+            self._generate_node(node.left)
+            reg = self._pop_any()
+
+        else:
+            self._generate_node(node.right)
+            self._generate_node(node.left)
+
+            # spilled operands go through the working registers
+            if None in self.value_stack[-2:]:
+                self._pop('rax')
+                self._pop('rbx')
+                reg, operand = 'rax', 'rbx'
+            else:
+                reg = self.value_stack.pop()
+                operand = self.value_stack.pop()
+
+        if node.operation in REGISTER_COMPARISONS:
+            low = REGISTER_VARIATIONS[reg][1]
+            self._emit(Opcode.CMP, reg, operand)
+            self._emit(REGISTER_COMPARISONS[node.operation], low)
+            self._emit(Opcode.MOVZX, reg, low)
+        elif node.operation == TokenType.STAR and isinstance(operand, int):
+            self._emit(Opcode.IMUL, reg, reg, operand)
+        else:
+            self._emit(REGISTER_OPERATIONS[node.operation], reg, operand)
+
+        self._push(reg)
+
+    def _operand(self, node, before):
+        # constants and 8 byte variables can be the right operand of an instruction without being loaded first
+        # the variable is only read after the left side then, which mustn't be able to change it
+        if isinstance(node, nodes.Number):
+            return node.value if -0x80000000 <= node.value <= 0x7FFFFFFF else None
+
+        if not isinstance(node, nodes.Variable) or not all(isinstance(child, PURE_NODES) for child in walk(before)):
+            return None
+
+        if node.name in self.current_locals:
+            variable = self.current_locals[node.name]
+            memory = Memory(8, 'rbp', -variable['offset'])
+        elif node.name in self.globals:
+            variable = self.globals[node.name]
+            memory = Memory(8, symbol=node.name)
+        else:
+            return None
+
+        return memory if TYPE_SIZES[variable['type'].id] == 8 else None
 
     def _generate_Cast(self, node: nodes.Cast):
         self._generate_node(node.value)
 
     def _generate_ExpressionStatement(self, node: nodes.ExpressionStatement):
         self._generate_node(node.value)
-        self.current_body.pop()
-    
+        self._drop()
+
     def _generate_CallFunction(self, node: nodes.CallFunction):
         func_name = node.name
 
@@ -770,7 +1075,6 @@ class Generator:
             raise GeneratorError(f"Tried calling an undefined procedure '{func_name}'", node.location)
 
         callee_args = self.functions[func_name]['arguments']
-        self.functions[func_name]['called'] = True
         caller_args_len = len(node.args)
         callee_args_len = len(callee_args)
 
@@ -786,17 +1090,30 @@ class Generator:
             assert resolved_type is not None, f"fail {node.name} {i}"
             self.validate_argument(callee_type, resolved_type, node.name, i+1, node.location)
 
+        if self.can_inline(func_name, self.call_sites.get(func_name, 0)):
+            self._generate_inline_call(func_name, node.args)
+            return
+
+        func_data = self.functions[func_name]
+        func_data['called'] = True
+
+        argument_registers = self.target.argument_registers
+        register_args = min(caller_args_len, len(argument_registers))
+        # stdcall procedures clean up after themselves, so they're called the way they always were
+        # unless the stack depth isn't known, then they're realigned like any other call
+        padding = self._align_call(caller_args_len - register_args) if not func_data['stdcall'] or self.stack_base is None else 0
+
         for i, arg in reversed(list(enumerate(node.args))):
             self._generate_node(arg)
 
-        for i in range(min(caller_args_len, len(ARGUMENT_REGISTERS))):
-            self.current_body.append(f'pop {ARGUMENT_REGISTERS[i]}')
+        # temporaries don't survive the call, stack arguments go where the callee expects them
+        self._spill(register_args)
 
-        self.current_body.append(f'sub rsp, 32')
-        self.current_body.append(f'call {func_name}')
-        if not self.functions[func_name]['stdcall']:
-            self.current_body.append(f'add rsp, {32 + max(caller_args_len - 4, 0) * 8}')
-        self.current_body.append('push rax')
+        for i in range(register_args):
+            self._pop(argument_registers[i])
+
+        self._emit_call(func_name, caller_args_len - register_args, padding, cleanup=not func_data['stdcall'], varargs=func_data['varargs'])
+        self._push('rax')
 
     def _generate_CallFunctionExpression(self, node: nodes.CallFunctionExpression):
 
@@ -818,7 +1135,6 @@ class Generator:
 
             method_data = class_data.methods[method_name]
             name_mangled_name = f"__{class_name}_proc_{method_name}"
-            self.functions[name_mangled_name]['called'] = True
 
             callee_args = method_data['arguments']
             caller_args = [method_holder] + node.args
@@ -837,20 +1153,136 @@ class Generator:
                 assert resolved_type is not None, f"fail method {method_name} {i}"
                 self.validate_argument(callee_type, resolved_type, method_name, i+1, node.location)
 
+            # method calls are counted by name, the class isn't known before generating
+            if self.can_inline(name_mangled_name, self.call_sites.get(('method', method_name), 0)):
+                self._generate_inline_call(name_mangled_name, caller_args)
+                return
+
+            self.functions[name_mangled_name]['called'] = True
+
+            argument_registers = self.target.argument_registers
+            register_args = min(caller_args_len, len(argument_registers))
+            padding = self._align_call(caller_args_len - register_args)
+
             for i, arg in reversed(list(enumerate(caller_args))):
                 self._generate_node(arg)
 
-            for i in range(min(caller_args_len, len(ARGUMENT_REGISTERS))):
-                self.current_body.append(f'pop {ARGUMENT_REGISTERS[i]}')
+            self._spill(register_args)
+
+            for i in range(register_args):
+                self._pop(argument_registers[i])
 
-            self.current_body.append(f'sub rsp, 32')
-            self.current_body.append(f'call {name_mangled_name}')
-            self.current_body.append(f'add rsp, {32 + max(caller_args_len - 4, 0) * 8}')
-            self.current_body.append('push rax')
+            self._emit_call(name_mangled_name, caller_args_len - register_args, padding, varargs=method_data['varargs'])
+            self._push('rax')
 
         else:
             raise GeneratorError(f"Invalid call target, must be a variable, procedure or class method", node.location)
 
+    def count_call_sites(self):
+        for procedure in self.procedures.values():
+            for statement in procedure.body:
+                for node in nodes.walk(statement):
+                    if isinstance(node, nodes.CallFunction):
+                        key = node.name
+                    elif isinstance(node, nodes.CallFunctionExpression) and isinstance(node.value, nodes.AccessStructMember):
+                        key = ('method', node.value.name)
+                    else:
+                        continue
+
+                    self.call_sites[key] = self.call_sites.get(key, 0) + 1
+
+    def uses_register(self, reg: str) -> bool:
+        # reg is a 64 bit register, inline assembly isn't looked at
+        for instruction in self.current_body:
+            if instruction.opcode != Opcode.RAW and any(reads_register(operand, reg) for operand in instruction.operands):
+                return True
+
+        return False
+
+    def can_inline(self, func_name: str, call_sites: int) -> bool:
+        if not self.inline or func_name not in self.procedures or len(self.inline_stack) >= INLINE_MAX_DEPTH:
+            return False
+
+        procedure = self.procedures[func_name]
+
+        if procedure.varargs or procedure.stdcall or procedure.always or func_name == "main":
+            return False
+
+        # no recursion
+        if func_name == self.current_function or any(name == func_name for name, _ in self.inline_stack):
+            return False
+
+        if func_name not in self.inline_sizes:
+            self.inline_sizes[func_name] = self.inline_size(procedure)
+
+        size = self.inline_sizes[func_name]
+
+        if size is None:
+            return False
+
+        single_call = procedure.is_local and call_sites == 1
+
+        if size > INLINE_BUDGET and not (single_call and size <= INLINE_SINGLE_CALL_BUDGET):
+            return False
+
+        # a single call site outside other inlined bodies moves the procedure instead of copying it
+        if single_call and not self.inline_stack:
+            return True
+
+        if size > self.inline_allowance:
+            return False
+
+        # callers inline right away, so the allowance is taken here
+        self.inline_allowance -= size
+        return True
+
+    def inline_size(self, procedure: nodes.ProgramProcedure):
+        # number of nodes in the body, None if it can't be inlined at all
+        size = 0
+
+        for statement in procedure.body:
+            for node in nodes.walk(statement):
+                if isinstance(node, INLINE_BLOCKERS):
+                    return None
+
+                size += 1
+
+        return size
+
+    def _generate_inline_call(self, func_name: str, args: list):
+        procedure = self.procedures[func_name]
+        end_label = f".L{self.current_label}"
+        self.current_label += 1
+        self.inlined += 1
+
+        # arguments are evaluated in the caller's scope, like for a real call
+        for arg in reversed(args):
+            self._generate_node(arg)
+
+        # the body can return from several places, they all have to agree on where the pending values are
+        self._spill(len(args))
+
+        saved = (self.current_locals, self.old_locals, self.break_stack)
+        self.current_locals = LocalDict()
+        self.break_stack = []
+        self.inline_stack.append((func_name, end_label))
+
+        # parameters become locals of the caller's frame
+        for arg_type, arg_name in procedure.args:
+            arg_type_size = TYPE_SIZES[arg_type.id]
+            self._generate_LocalVariable(nodes.LocalVariable(name=arg_name, location=procedure.location, type=arg_type, value=None))
+            self._pop('rax')
+            self._emit(Opcode.MOV, Memory(arg_type_size, 'rbp', -self.local_offset), REGISTER_VARIATIONS["rax"][arg_type_size])
+
+        for statement in procedure.body:
+            self._generate_node(statement)
+
+        self.inline_stack.pop()
+        self.current_locals, self.old_locals, self.break_stack = saved
+
+        self._emit(Opcode.LABEL, end_label)
+        self._push('rax')
+
     def _generate_ProgramExternProcedure(self, node: nodes.ProgramExternProcedure):
         self.functions[node.name] = {
             "return_type": node.return_type,
@@ -873,24 +1305,31 @@ class Generator:
             self.externs.append(f'extrn {node.name}')
 
     def _generate_Return(self, node: nodes.Return):
-        if self.functions[self.current_function]['return_type'].id == TypeEnum.NONE and node.value is not None:
+        func_name = self.inline_stack[-1][0] if self.inline_stack else self.current_function
+
+        if self.functions[func_name]['return_type'].id == TypeEnum.NONE and node.value is not None:
             raise GeneratorError(f"Cannot return a value in a function that doesn't specify a return value", node.location)
 
         if node.value is not None:
             self._generate_node(node.value)
-            self.current_body.append('pop rax')
+            self._pop('rax')
+
+        # returning from an inlined body just leaves it
+        if self.inline_stack:
+            self._emit(Opcode.JMP, self.inline_stack[-1][1])
+            return
 
         self.current_body.extend([
-            'mov rsp, rbp',
-            'pop rbp',
-            'ret'
+            Instruction(Opcode.MOV, ('rsp', 'rbp')),
+            Instruction(Opcode.POP, ('rbp',)),
+            Instruction(Opcode.RET)
         ])
 
     def _generate_ReserveUninitialized(self, node: nodes.ReserveUninitialized):
         self.bss[f"__array_{self.current_id}"] = (node.type.id, node.size)
         if self.current_body is not None:
-            self.current_body.append(f'mov rax, __array_{self.current_id}')
-            self.current_body.append('push rax')
+            self._emit(Opcode.MOV, 'rax', f'__array_{self.current_id}')
+            self._push('rax')
         self.current_id += 1
 
     def _generate_ReserveInitialized(self, node: nodes.ReserveInitialized):
@@ -903,46 +1342,56 @@ class Generator:
                 if node.type.id not in [TypeEnum.PTR, TypeEnum.U64]:
                     raise GeneratorError("Reserved array type is not big enough to hold a string (u8*, u64, ptr)", value.location)
 
-                self._generate_node(value)
+                self._generate_nested_constant(value)
                 data.append(f'__str_{self.current_id-1}')
             elif isinstance(value, nodes.ReserveUninitialized):
                 if node.type.id not in [TypeEnum.PTR, TypeEnum.U64]:
                     raise GeneratorError("Reserved array type is not big enough to hold a reserved array (u64, ptr)", value.location)
 
-                self._generate_node(value)
+                self._generate_nested_constant(value)
                 data.append(f'__array_{self.current_id-1}')
             elif isinstance(value, nodes.ReserveInitialized):
                 if node.type.id not in [TypeEnum.PTR, TypeEnum.U64]:
                     raise GeneratorError("Reserved array type is not big enough to hold a reserved array (u64, ptr)", value.location)
 
-                self._generate_node(value)
+                self._generate_nested_constant(value)
                 data.append(f'__array_{self.current_id-1}')
             else:
                 raise GeneratorError("Reserved array value must be a constant value", node.location)
 
         self.data[f"__array_{self.current_id}"] = (node.type.id, ','.join(data))
         if self.current_body is not None:
-            self.current_body.append(f'mov rax, __array_{self.current_id}')
-            self.current_body.append('push rax')
+            self._emit(Opcode.MOV, 'rax', f'__array_{self.current_id}')
+            self._push('rax')
         self.current_id += 1
 
+    def _generate_nested_constant(self, node):
+        # only the data is needed, the address itself is not a value of the expression
+        self._generate_node(node)
+
+        if self.current_body is not None:
+            self._drop()
+
     def _generate_AddressOf(self, node: nodes.AddressOf):
         if node.name in self.current_locals:
             offset = self.current_locals[node.name]['offset']
 
-            self.current_body.append(f'lea rax, [rbp - {offset}]')
-            self.current_body.append('push rax')
+            self._emit(Opcode.LEA, 'rax', Memory(0, 'rbp', -offset))
+            self._push('rax')
 
         elif node.name in self.globals:
-            self.current_body.append(f'mov rax, {node.name}')
-            self.current_body.append('push rax')
+            self._emit(Opcode.MOV, 'rax', node.name)
+            self._push('rax')
 
         else:
             raise GeneratorError(f"undefined variable '{node.name}'", node.location)
 
     def _generate_DereferencePointer(self, node: nodes.DereferencePointer):
         self._generate_node(node.pointer)
-        self._generate_node(node.offset)
+
+        # constant offsets become a displacement, no need to compute them at runtime
+        if not isinstance(node.offset, nodes.Number):
+            self._generate_node(node.offset)
 
         ptr_type = self.resolve_type(node.pointer)
 
@@ -957,33 +1406,28 @@ class Generator:
         base_type_size = TYPE_SIZES[base_type.id]
         base_type_name = ASM_TYPE_NAMES[base_type.id]
 
-        self.current_body.extend([
-            'pop rbx',
-            f'mov rax, {base_type_size}',
-            'mul rbx',
-            'mov rbx, rax',
-            'pop rax',
-            'add rax, rbx'
-        ])
+        address = self._pointer_address(node.offset, base_type_size, 'rbx')
 
         if self.is_signed_16(base_type):
-            self.current_body.append(f'movsx rax, {ASM_TYPE_NAMES[base_type.id]} [rax]')
+            self._emit(Opcode.MOVSX, 'rax', address.resized(base_type_size))
             #self.current_body.append(f'movsx rax, {ASM_TYPE_NAMES[base_type.id]} [rax]')
         elif self.is_unsigned_32(base_type):
             if base_type_size != 4:
-                self.current_body.append(f'mov rax, [rax]')
-                self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][base_type_size]}')
+                self._emit(Opcode.MOV, 'rax', address)
+                self._emit(Opcode.MOVZX, 'rax', REGISTER_VARIATIONS["rax"][base_type_size])
             else:
-                self.current_body.append("mov eax, dword [rax]")
+                self._emit(Opcode.MOV, 'eax', address.resized(4))
         else:
-            self.current_body.append(f'mov rax, [rax]')
+            self._emit(Opcode.MOV, 'rax', address)
 
-        self.current_body.append(f'push rax')
+        self._push('rax')
 
     def _generate_SetAtPointer(self, node: nodes.SetAtPointer):
         self._generate_node(node.value)
         self._generate_node(node.pointer)
-        self._generate_node(node.offset)
+
+        if not isinstance(node.offset, nodes.Number):
+            self._generate_node(node.offset)
 
         ptr_type = self.resolve_type(node.pointer)
 
@@ -997,17 +1441,26 @@ class Generator:
 
         base_type_size = TYPE_SIZES[base_type.id]
 
-        self.current_body.extend([
-            'pop rbx',
-            f'mov rax, {base_type_size}',
-            'mul rbx',
-            'mov rbx, rax',
-            'pop rax',
-            'add rax, rbx',
-            'pop rbx',
-            f'mov {ASM_TYPE_NAMES[base_type.id]} [rax], {REGISTER_VARIATIONS["rbx"][TYPE_SIZES[base_type.id]]}',
-            'push rbx'
-        ])
+        # the value goes through rbx, so the index can't
+        address = self._pointer_address(node.offset, base_type_size, 'rcx')
+        self._pop('rbx')
+        self._emit(Opcode.MOV, address.resized(base_type_size), REGISTER_VARIATIONS["rbx"][base_type_size])
+        self._push('rbx')
+
+    def _pointer_address(self, offset, size: int, index_reg: str) -> Memory:
+        # pops the pointer into rax (and the offset, unless it's a constant) and addresses element 'offset'
+        if isinstance(offset, nodes.Number):
+            self._pop('rax')
+            return Memory(0, 'rax', offset.value * size)
+
+        # a temporary register can be used as the index directly
+        if self.value_stack[-1] is not None:
+            index_reg = self.value_stack.pop()
+        else:
+            self._pop(index_reg)
+
+        self._pop('rax')
+        return Memory(0, 'rax', index=index_reg, scale=size)
 
     def _generate_ProgramStruct(self, node: nodes.ProgramStruct):
         self.struct_data[node.name] = self.calculate_struct(node.members)
@@ -1019,6 +1472,16 @@ class Generator:
     def _generate_Enumeration(self, node: nodes.Enumeration):
         self.enum_data[node.name] = node.values
 
+    def sub_struct_layout(self, struct_type: nodes.Type):
+        # anonymous structs keep their field list, bodies can be generated more than once (inlining)
+        # the type is kept next to its layout, so its id can't be reused while the entry exists
+        entry = self.sub_struct_layouts.get(id(struct_type))
+
+        if entry is None:
+            entry = self.sub_struct_layouts[id(struct_type)] = (struct_type, self.calculate_struct(struct_type.data['fields']))
+
+        return entry[1]
+
     def calculate_struct(self, substruct_fields):
         # calculate padded size of the struct
         # calculate offsets of each memeber
@@ -1032,14 +1495,12 @@ class Generator:
             padding = 0
 
             if field_type.id == TypeEnum.SUB_STRUCT:
-                sub_data = self.calculate_struct(field_type.data['fields'])
+                sub_data = self.sub_struct_layout(field_type)
                 type_size = sub_data['size']
 
                 if sub_data['largest_size'] > max_align:
                     max_align = sub_data['largest_size']
 
-                field_type.data = sub_data
-
             elif field_type.id == TypeEnum.ARRAY:
                 element_type_size = TYPE_SIZES[field_type.data['element_type'].id]
                 array_size = element_type_size * field_type.data['size']
@@ -1092,10 +1553,8 @@ class Generator:
                 if node.name not in enum_data:
                     raise GeneratorError(f"Unknown enum value '{node.name}' in enum '{node.struct_pointer.name}'", node.location)
 
-                self.current_body.extend([
-                    f'mov rax, {enum_data[node.name]}',
-                    'push rax'
-                ])
+                self._emit(Opcode.MOV, 'rax', enum_data[node.name])
+                self._push('rax')
 
                 return
 
@@ -1113,7 +1572,7 @@ class Generator:
             members = self.struct_data[struct_name]['fields']
 
         elif struct_type.id == TypeEnum.SUB_STRUCT:
-            members = struct_type.data['fields']
+            members = self.sub_struct_layout(struct_type)['fields']
 
         else:
             raise GeneratorError("Attempted field access on a non struct type", node.location)
@@ -1127,35 +1586,30 @@ class Generator:
         field_offset, field_type = members[node.name]['offset'], members[node.name]['type']
 
         if field_type.id in [TypeEnum.SUB_STRUCT, TypeEnum.ARRAY]:
-            self.current_body.extend([
-                'pop rax',
-                f'add rax, {field_offset}',
-                'push rax'
-            ])
+            self._pop('rax')
+            self._emit(Opcode.ADD, 'rax', field_offset)
+            self._push('rax')
 
             return
 
         field_size = TYPE_SIZES[field_type.id]
 
-        self.current_body.extend([
-            'pop rax',
-            f'add rax, {field_offset}',
-            #f'{("movsx" if self.is_signed_32(field_type) else "movzx") if field_size != 8 else "mov"} rax, {ASM_TYPE_NAMES[field_type.id]} [rax]',
-            #'push rax'
-        ])
+        self._pop('rax')
+        self._emit(Opcode.ADD, 'rax', field_offset)
+        #f'{("movsx" if self.is_signed_32(field_type) else "movzx") if field_size != 8 else "mov"} rax, {ASM_TYPE_NAMES[field_type.id]} [rax]',
 
         if self.is_signed_16(field_type):
-            self.current_body.append(f'movsx rax, {ASM_TYPE_NAMES[field_type.id]} [rax]')
+            self._emit(Opcode.MOVSX, 'rax', Memory(field_size, 'rax'))
         elif self.is_unsigned_32(field_type):
             if TYPE_SIZES[field_type.id] != 4:
-                self.current_body.append(f'mov rax, [rax]')
-                self.current_body.append(f'movzx rax, {REGISTER_VARIATIONS["rax"][TYPE_SIZES[field_type.id]]}')
+                self._emit(Opcode.MOV, 'rax', Memory(0, 'rax'))
+                self._emit(Opcode.MOVZX, 'rax', REGISTER_VARIATIONS["rax"][field_size])
             else:
-                self.current_body.append("mov eax, dword [rax]")
+                self._emit(Opcode.MOV, 'eax', Memory(4, 'rax'))
         else:
-            self.current_body.append(f'mov rax, [rax]')
+            self._emit(Opcode.MOV, 'rax', Memory(0, 'rax'))
 
-        self.current_body.append(f'push rax')
+        self._push('rax')
 
     def _generate_WriteStructMember(self, node: nodes.WriteStructMember):
         self._generate_node(node.struct_pointer)
@@ -1172,7 +1626,7 @@ class Generator:
             members = self.struct_data[struct_name]['fields']
 
         elif struct_type.id == TypeEnum.SUB_STRUCT:
-            members = struct_type.data['fields']
+            members = self.sub_struct_layout(struct_type)['fields']
 
         else:
             raise GeneratorError("Attempted field access on a non struct type", node.location)
@@ -1191,43 +1645,43 @@ class Generator:
         if field_type.id == TypeEnum.SUB_STRUCT:
             raise GeneratorError("Attempted assigning to a sub struct", node.location)
 
+        self._pop('rbx')
+        self._pop('rax')
         self.current_body.extend([
-            'pop rbx',
-            'pop rax',
-            f'add rax, {field_offset}',
-            f'mov {ASM_TYPE_NAMES[field_type.id]} [rax], {REGISTER_VARIATIONS["rbx"][field_size]}',
-            'push rax'
+            Instruction(Opcode.ADD, ('rax', field_offset)),
+            Instruction(Opcode.MOV, (Memory(field_size, 'rax'), REGISTER_VARIATIONS["rbx"][field_size]))
         ])
+        self._push('rax')
 
     def _generate_Sizeof(self, node: nodes.Sizeof):
         value_type = self.resolve_type(node.value)
-        self.current_body.append(f"push {TYPE_SIZES[value_type.id]}")
+        self._push(TYPE_SIZES[value_type.id])
 
     def _generate_SizeofType(self, node: nodes.SizeofType):
         if node.type.id == TypeEnum.STRUCT:
-            self.current_body.append(f"push {self.struct_data[node.type.data['struct_name']]['size']}")
+            self._push(self.struct_data[node.type.data['struct_name']]['size'])
             return
 
         if node.type.id == TypeEnum.CLASS:
-            self.current_body.append(f"push {self.struct_data[node.type.data['class_name']]['size']}")
+            self._push(self.struct_data[node.type.data['class_name']]['size'])
             return
 
         if node.type.id == TypeEnum.SUB_STRUCT:
-            struct_data = self.calculate_struct(node.type.data['fields'])
-            self.current_body.append(f"push {struct_data['size']}")
+            self._push(self.sub_struct_layout(node.type)['size'])
             return
 
-        self.current_body.append(f"push {TYPE_SIZES[node.type.id]}")
+        self._push(TYPE_SIZES[node.type.id])
 
     def _generate_Negate(self, node: nodes.Negate):
         self._generate_node(node.value)
+        reg = self._pop_any()
+        low = REGISTER_VARIATIONS[reg][1]
         self.current_body.extend([
-            'pop rax',
-            'cmp rax, 0',
-            'sete al',
-            'movzx rax, al',
-            'push rax'
+            Instruction(Opcode.CMP, (reg, 0)),
+            Instruction(Opcode.SETE, (low,)),
+            Instruction(Opcode.MOVZX, (reg, low))
         ])
+        self._push(reg)
 
     def _generate_CompoundStatement(self, node: nodes.CompoundStatement):
         self.old_locals = self.current_locals
@@ -1240,54 +1694,52 @@ class Generator:
 
     def _generate_IfStatement(self, node: nodes.IfStatement):
         self._generate_node(node.value)
-        self.current_body.append('pop rax')
-        self.current_body.append('cmp rax, 0')
+        self._emit(Opcode.CMP, self._pop_any(), 0)
         jmp_idx = len(self.current_body)
         else_idx = 0
-        self.current_body.append('je SOME_ADDRESS')
+        self._emit(Opcode.JE, None)
 
         self._generate_node(node.body)
         
         if node.else_body:
             else_idx = len(self.current_body)
-            self.current_body.append('je SOME_ADDRESS')
+            self._emit(Opcode.JMP, None)
 
-        self.current_body.append(f'.L{self.current_label}:')
+        self._emit(Opcode.LABEL, f'.L{self.current_label}')
 
-        self.current_body[jmp_idx] = f"je .L{self.current_label}"
+        self.current_body[jmp_idx] = Instruction(Opcode.JE, (f'.L{self.current_label}',))
         self.current_label += 1
 
         if node.else_body:
             self._generate_node(node.else_body)
-            self.current_body.append(f'.L{self.current_label}:')
-            self.current_body[else_idx] = f"jmp .L{self.current_label}"
+            self._emit(Opcode.LABEL, f'.L{self.current_label}')
+            self.current_body[else_idx] = Instruction(Opcode.JMP, (f'.L{self.current_label}',))
             self.current_label += 1
 
 
     def _generate_WhileStatement(self, node: nodes.WhileStatement):
         while_label = self.current_label
-        self.current_body.append(f'.L{while_label}:')
+        self._emit(Opcode.LABEL, f'.L{while_label}')
         self.current_label += 1
 
         self._generate_node(node.value)
-        self.current_body.append('pop rax')
-        self.current_body.append('cmp rax, 0')
+        self._emit(Opcode.CMP, self._pop_any(), 0)
         next_label = self.current_label
-        self.current_body.append(f'je .L{next_label}')
+        self._emit(Opcode.JE, f'.L{next_label}')
         self.current_label += 1
         self.break_stack.append(f".L{next_label}")
 
         self._generate_node(node.body)
-        self.current_body.append(f'jmp .L{while_label}')
+        self._emit(Opcode.JMP, f'.L{while_label}')
 
-        self.current_body.append(f'.L{next_label}:')
+        self._emit(Opcode.LABEL, f'.L{next_label}')
         self.break_stack.pop()
 
     def _generate_BreakLoop(self, node: nodes.BreakLoop):
         if not self.break_stack:
             raise GeneratorError("Cannot use break outside of loops", node.location)
 
-        self.current_body.append(f"jmp {self.break_stack[-1]}")
+        self._emit(Opcode.JMP, self.break_stack[-1])
 
     def _generate_NewInstance(self, node: nodes.NewInstance):
         if node.name not in self.class_data:
@@ -1314,15 +1766,12 @@ class Generator:
         self.local_offset += padded_size
         temp_offset = self.local_offset
 
-        self.current_body.extend([
-            f"mov rcx, {self.struct_data[class_name]['size']}",
-            #"push rcx",
-            "sub rsp, 32",
-            "call malloc",
-            "add rsp, 32",
-            #"pop rax",
-            f"mov qword [rbp - {temp_offset}], rax"
-        ])
+        argument_registers = self.target.argument_registers
+
+        padding = self._align_call(0)
+        self._emit(Opcode.MOV, argument_registers[0], self.struct_data[class_name]['size'])
+        self._emit_call('malloc', 0, padding)
+        self._emit(Opcode.MOV, Memory(8, 'rbp', -temp_offset), 'rax')
 
         callee_args = method_data['arguments'][1:]
         caller_args = node.args
@@ -1341,27 +1790,33 @@ class Generator:
             assert resolved_type is not None, f"fail initializer {i}"
             self.validate_argument(callee_type, resolved_type, "initializer", i+1, node.location)
 
+        # 'this' takes the first register, so one less argument fits in registers
+        register_args = min(caller_args_len, len(argument_registers)-1)
+        padding = self._align_call(caller_args_len - register_args)
+
         for i, arg in reversed(list(enumerate(caller_args))):
             self._generate_node(arg)
 
-        self.current_body.append(f"mov rcx, qword [rbp - {temp_offset}]")
+        self._spill(register_args)
+
+        self._emit(Opcode.MOV, argument_registers[0], Memory(8, 'rbp', -temp_offset))
 
-        for i in range(min(caller_args_len, len(ARGUMENT_REGISTERS)-1)):
-            self.current_body.append(f'pop {ARGUMENT_REGISTERS[i+1]}')
+        for i in range(register_args):
+            self._pop(argument_registers[i+1])
 
-        self.current_body.append('sub rsp, 32')
-        self.current_body.append(f'call {name_mangled_name}')
-        self.current_body.append(f'add rsp, {32 + max(caller_args_len - 4, 0) * 8}')
+        self._emit_call(name_mangled_name, caller_args_len - register_args, padding, varargs=method_data['varargs'])
 
-        self.current_body.append(f"mov rax, qword [rbp - {temp_offset}]")
-        self.current_body.append(f"push rax")
+        self._emit(Opcode.MOV, 'rax', Memory(8, 'rbp', -temp_offset))
+        self._push('rax')
 
     def _generate_Register(self, node: nodes.Register):
-        self.current_body.append(f'push {node.name}')
+        self._push(node.name)
 
     def _generate_AssignRegister(self, node: nodes.AssignRegister):
         self._generate_node(node.value)
-        self.current_body.append(f'pop {node.name}')
+        self._spill(1)
+        self._pop(node.name)
+        self._push(node.name)
 
     def _generate_Multiple(self, node: nodes.Multiple):
         for n in node.nodes:
@@ -1378,38 +1833,80 @@ class Generator:
             self.current_label += 1
 
         self._generate_node(node.value)
-        self.current_body.append('pop rax')
+        self._pop('rax')
 
         case_labels = []
-        # generate checks
+        # case constant -> label, the first case wins for duplicate constants
+        targets = {}
         for (case_const, _) in node.cases:
             case_labels.append(self.current_label)
-            self.current_body.extend([
-                f'cmp rax, {case_const}',
-                f'je .L{self.current_label}'
-            ])
+            targets.setdefault(case_const, f'.L{self.current_label}')
             self.current_label += 1
 
-        if node.default_case:
-            self.current_body.append(f"jmp {default_label}")
+        # generate checks
+        fallback = default_label if node.default_case else end_label
+        constants = sorted(targets)
+
+        if len(constants) >= JUMP_TABLE_MIN_CASES and len(constants) / (constants[-1] - constants[0] + 1) >= JUMP_TABLE_MIN_DENSITY:
+            self._generate_jump_table(targets, constants, fallback)
         else:
-            self.current_body.append(f"jmp {end_label}")
+            self._generate_search_tree(targets, constants, fallback)
 
         # generate cases
 
         for i, (_, case_body) in enumerate(node.cases):
-            self.current_body.append(f".L{case_labels[i]}:")
+            self._emit(Opcode.LABEL, f'.L{case_labels[i]}')
             for case_node in case_body:
                 self._generate_node(case_node)
 
         if node.default_case:
-            self.current_body.append(f"{default_label}:")
+            self._emit(Opcode.LABEL, default_label)
             for def_node in node.default_case:
                 self._generate_node(def_node)
 
-        self.current_body.append(f"{end_label}:")
+        self._emit(Opcode.LABEL, end_label)
         self.break_stack.pop()
 
+    def _generate_jump_table(self, targets, constants, fallback):
+        low, high = constants[0], constants[-1]
+        table_name = f"__switch_{self.current_id}"
+        self.current_id += 1
+
+        # the table lives outside of the procedure, so local labels need the procedure name in front
+        entries = [f"{self.current_function}{targets.get(value, fallback)}" for value in range(low, high + 1)]
+        self.jump_tables[table_name] = (self.current_function, ','.join(entries))
+
+        if low != 0:
+            self._emit(Opcode.SUB, 'rax', low)
+
+        # unsigned compare, so values below the lowest case wrap around and fail as well
+        self._emit(Opcode.CMP, 'rax', high - low)
+        self._emit(Opcode.JA, fallback)
+        self._emit(Opcode.MOV, 'rbx', table_name)
+        self._emit(Opcode.JMP, Memory(8, 'rbx', index='rax', scale=8))
+
+    def _generate_search_tree(self, targets, constants, fallback):
+        if len(constants) <= LINEAR_SEARCH_MAX_CASES:
+            for value in constants:
+                self._emit(Opcode.CMP, 'rax', value)
+                self._emit(Opcode.JE, targets[value])
+
+            self._emit(Opcode.JMP, fallback)
+            return
+
+        middle = len(constants) // 2
+        value = constants[middle]
+        upper_label = f".L{self.current_label}"
+        self.current_label += 1
+
+        self._emit(Opcode.CMP, 'rax', value)
+        self._emit(Opcode.JE, targets[value])
+        self._emit(Opcode.JG, upper_label)
+        self._generate_search_tree(targets, constants[:middle], fallback)
+
+        self._emit(Opcode.LABEL, upper_label)
+        self._generate_search_tree(targets, constants[middle + 1:], fallback)
+
     def _generate_Call(self, node: nodes.Call):
         func_name = node.name
 
@@ -1420,16 +1917,52 @@ class Generator:
         callee_args_len = len(callee_args) if node.args_passed == 0 else node.args_passed
         self.functions[func_name]['called'] = True
  
-        for i in range(min(callee_args_len, len(ARGUMENT_REGISTERS))):
-            self.current_body.append(f'pop {ARGUMENT_REGISTERS[i]}')
+        argument_registers = self.target.argument_registers
+
+        # the arguments were pushed by the program, the stack can only be realigned when they all go in registers
+        for i in range(min(callee_args_len, len(argument_registers))):
+            self._emit(Opcode.POP, argument_registers[i])
+
+        stack_args = max(callee_args_len - len(argument_registers), 0)
+
+        if not stack_args:
+            self._emit_realign()
+        else:
+            # the program pushed the stack arguments wherever the stack was, copies of them go above an aligned base
+            # with the old stack pointer below them, and the program's own ones are dropped after the call
+            self._emit(Opcode.MOV, 'rax', 'rsp')
+            self._emit(Opcode.AND, 'rsp', -16)
+
+            if stack_args % 2 == 0:
+                self._emit(Opcode.SUB, 'rsp', 8)
+
+            self._emit(Opcode.PUSH, 'rax')
+
+            for i in reversed(range(stack_args)):
+                self._emit(Opcode.PUSH, Memory(8, 'rax', i * 8))
+
+        if self.target.shadow_space:
+            self._emit(Opcode.SUB, 'rsp', self.target.shadow_space)
+
+        if self.functions[func_name]['varargs'] and self.target.varargs_vector_count:
+            self._emit(Opcode.XOR, 'eax', 'eax')
+
+        self._emit(Opcode.CALL, func_name)
+
+        if not stack_args:
+            self._emit_restore()
+        else:
+            self._emit(Opcode.ADD, 'rsp', self.target.shadow_space + stack_args * 8)
+            self._emit(Opcode.POP, 'rsp')
+            self._emit(Opcode.ADD, 'rsp', stack_args * 8)
 
-        self.current_body.append(f'sub rsp, 32')
-        self.current_body.append(f'call {func_name}')
-        self.current_body.append(f'add rsp, {32 + max(callee_args_len - 4, 0) * 8}')
-        self.current_body.append('push rax')
+        self._emit(Opcode.PUSH, 'rax')
 
     def _generate_Push(self, node: nodes.Push):
         self._generate_node(node.value)
+        # the value now belongs to the program, not the value stack
+        self._spill()
+        self.value_stack.pop()
 
     def _generate_Pop(self, node: nodes.Pop):
         if node.name is not None:
@@ -1438,28 +1971,28 @@ class Generator:
                 offset = self.current_locals[node.name]['offset']
                 type_size, type_name = TYPE_SIZES[var_type.id], ASM_TYPE_NAMES[var_type.id]
 
-                self.current_body.append('pop rax')
-                self.current_body.append(f'mov {type_name.lower()} [rbp - {offset}], {REGISTER_VARIATIONS["rax"][type_size]}')
+                self._emit(Opcode.POP, 'rax')
+                self._emit(Opcode.MOV, Memory(type_size, 'rbp', -offset), REGISTER_VARIATIONS["rax"][type_size])
 
             elif node.name in self.globals:
                 var_type = self.globals[node.name]['type']
                 type_size, type_name = TYPE_SIZES[var_type.id], ASM_TYPE_NAMES[var_type.id]
 
-                self.current_body.append('pop rax')
-                self.current_body.append(f'mov {type_name.lower()} [{node.name}], {REGISTER_VARIATIONS["rax"][type_size]}')
+                self._emit(Opcode.POP, 'rax')
+                self._emit(Opcode.MOV, Memory(type_size, symbol=node.name), REGISTER_VARIATIONS["rax"][type_size])
 
         else:
-            self.current_body.append('add rsp, 8')
+            self._emit(Opcode.ADD, 'rsp', 8)
 
     def _generate_InlineAssembly(self, node: nodes.InlineAssembly):
-        self.current_body.append(node.value)
+        self._emit(Opcode.RAW, node.value)
 
     def resolve_type(self, expr) -> nodes.Type:
         if isinstance(expr, nodes.Number):
-            return nodes.Type(TypeEnum.I64)
+            return nodes.primitive_type(TypeEnum.I64)
 
         elif isinstance(expr, nodes.String):
-            return nodes.Type(TypeEnum.PTR)
+            return nodes.primitive_type(TypeEnum.PTR)
 
         elif isinstance(expr, nodes.Variable):
             if expr.name in self.current_locals:
@@ -1490,7 +2023,7 @@ class Generator:
                 return left_type if left_size > right_size else right_type
 
             elif expr.operation in [TokenType.PRECENT, TokenType.NEQUALS, TokenType.LEQUALS, TokenType.GEQUALS, TokenType.GREATER, TokenType.LOWER, TokenType.DEQUALS, TokenType.AND, TokenType.OR]:
-                return nodes.Type(id=TypeEnum.U8)
+                return nodes.primitive_type(TypeEnum.U8)
 
         elif isinstance(expr, nodes.CallFunction):
             if expr.name not in self.functions:
@@ -1536,9 +2069,9 @@ class Generator:
             base_type = self.get_pointer_base(ptr_type)
 
             if not base_type:
-                return nodes.Type(id=TypeEnum.PTR)
+                return nodes.primitive_type(TypeEnum.PTR)
 
-            return nodes.Type(id=TypeEnum.PTR, is_base_type=False, base_type=base_type)
+            return nodes.pointer_type(base_type)
 
         elif isinstance(expr, nodes.Cast):
             return expr.type
@@ -1555,10 +2088,10 @@ class Generator:
             if not base_type:
                 raise Exception("Unreacahble")
 
-            return nodes.Type(id=TypeEnum.PTR, is_base_type=False, base_type=base_type)
+            return nodes.pointer_type(base_type)
 
         elif isinstance(expr, (nodes.ReserveUninitialized, nodes.ReserveInitialized)):
-            return nodes.Type(id=TypeEnum.PTR, is_base_type=False, base_type=expr.type)
+            return nodes.pointer_type(expr.type)
 
         elif isinstance(expr, nodes.AccessStructMember):
             if isinstance(expr.struct_pointer, nodes.Variable):
@@ -1567,7 +2100,7 @@ class Generator:
                     if expr.name not in enum_data:
                         raise GeneratorError(f"Unknown enum value '{expr.name}' in enum '{expr.struct_pointer.name}'", expr.location)
 
-                    return nodes.Type(id=TypeEnum.U64)
+                    return nodes.primitive_type(TypeEnum.U64)
 
             struct_type = self.resolve_type(expr.struct_pointer)
             members = None
@@ -1581,7 +2114,7 @@ class Generator:
                 members = self.struct_data[struct_name]['fields']
 
             elif struct_type.id == TypeEnum.SUB_STRUCT:
-                members = struct_type.data['fields']
+                members = self.sub_struct_layout(struct_type)['fields']
 
             else:
                 raise GeneratorError("Attempted field access on a non struct type", expr.location)
@@ -1590,7 +2123,7 @@ class Generator:
                 field_type = members[expr.name]['type']
 
                 if field_type.id == TypeEnum.ARRAY:
-                    return nodes.Type(id=TypeEnum.PTR, is_base_type=False, base_type=field_type.data['element_type'])
+                    return nodes.pointer_type(field_type.data['element_type'])
 
                 return field_type
             
@@ -1609,7 +2142,7 @@ class Generator:
                 members = self.struct_data[struct_name]['fields']
 
             elif struct_type.id == TypeEnum.SUB_STRUCT:
-                members = struct_type.data['fields']
+                members = self.sub_struct_layout(struct_type)['fields']
 
             else:
                 raise GeneratorError("Attempted struct field access on a non struct type", expr.location)
@@ -1620,10 +2153,10 @@ class Generator:
             raise GeneratorError(f"Unknown struct field '{expr.name}'", expr.location)
 
         elif isinstance(expr, nodes.Sizeof):
-            return nodes.Type(id=TypeEnum.U64)
+            return nodes.primitive_type(TypeEnum.U64)
 
         elif isinstance(expr, nodes.SizeofType):
-            return nodes.Type(id=TypeEnum.U64)
+            return nodes.primitive_type(TypeEnum.U64)
 
         elif isinstance(expr, nodes.NewInstance):
             if expr.name not in self.class_data:
@@ -1632,10 +2165,10 @@ class Generator:
             return nodes.Type(id=TypeEnum.CLASS, data={'class_name': expr.name})
 
         elif isinstance(expr, nodes.Register):
-            return nodes.Type(id=TypeEnum.U64)
+            return nodes.primitive_type(TypeEnum.U64)
 
         elif isinstance(expr, nodes.AssignRegister):
-            return nodes.Type(id=TypeEnum.U64)
+            return nodes.primitive_type(TypeEnum.U64)
 
     def get_pointer_base(self, ptr_type: nodes.Type):
         if ptr_type.id == TypeEnum.PTR and not ptr_type.is_base_type:
@@ -0,0 +1,159 @@
+from enum import IntEnum, auto
+from typing import Tuple, Union
+
+
+class Opcode(IntEnum):
+    MOV = auto()
+    MOVZX = auto()
+    MOVSX = auto()
+    LEA = auto()
+    PUSH = auto()
+    POP = auto()
+    ADD = auto()
+    SUB = auto()
+    MUL = auto()
+    IMUL = auto()
+    DIV = auto()
+    XOR = auto()
+    OR = auto()
+    AND = auto()
+    CMP = auto()
+    SETE = auto()
+    SETNE = auto()
+    SETG = auto()
+    SETLE = auto()
+    SETL = auto()
+    SETGE = auto()
+    JMP = auto()
+    JE = auto()
+    JNE = auto()
+    JA = auto()
+    JG = auto()
+    CALL = auto()
+    RET = auto()
+
+    LABEL = auto()
+    RAW = auto()
+
+
+MEMORY_SIZE_NAMES = {
+    1: "byte",
+    2: "word",
+    4: "dword",
+    8: "qword"
+}
+
+REGISTER_FAMILIES = {
+    "rax": ("rax", "eax", "ax", "al"),
+    "rbx": ("rbx", "ebx", "bx", "bl"),
+    "rcx": ("rcx", "ecx", "cx", "cl"),
+    "rdx": ("rdx", "edx", "dx", "dl"),
+    "rdi": ("rdi", "edi", "di", "dil"),
+    "rsi": ("rsi", "esi", "si", "sil"),
+    "rbp": ("rbp", "ebp", "bp", "bpl"),
+    "rsp": ("rsp", "esp", "sp", "spl")
+}
+
+for i in range(8, 16):
+    REGISTER_FAMILIES[f"r{i}"] = (f"r{i}", f"r{i}d", f"r{i}w", f"r{i}b")
+
+# any register name -> its 64 bit register
+REGISTERS = {name: family for family, names in REGISTER_FAMILIES.items() for name in names}
+
+
+class Memory:
+    # [base + index*scale + symbol + disp], size is 0 when the operand has no size prefix
+    __slots__ = ('size', 'base', 'index', 'scale', 'disp', 'symbol')
+
+    def __init__(self, size: int = 0, base: str = None, disp: int = 0, index: str = None, scale: int = 1, symbol: str = None):
+        self.size = size
+        self.base = base
+        self.index = index
+        self.scale = scale
+        self.disp = disp
+        self.symbol = symbol
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Memory) and (self.size, self.base, self.index, self.scale, self.disp, self.symbol) == (other.size, other.base, other.index, other.scale, other.disp, other.symbol)
+
+    def __hash__(self) -> int:
+        return hash((self.size, self.base, self.index, self.scale, self.disp, self.symbol))
+
+    def resized(self, size: int) -> 'Memory':
+        return Memory(size, self.base, self.disp, self.index, self.scale, self.symbol)
+
+    def uses(self, reg: str) -> bool:
+        return (self.base is not None and REGISTERS[self.base] == reg) or (self.index is not None and REGISTERS[self.index] == reg)
+
+    def __str__(self) -> str:
+        address = self.base or ''
+
+        if self.index is not None:
+            index = self.index if self.scale == 1 else f"{self.index}*{self.scale}"
+            address = f"{address} + {index}" if address else index
+
+        if self.symbol is not None:
+            address = f"{address} + {self.symbol}" if address else self.symbol
+
+        if self.disp or not address:
+            if not address:
+                address = str(self.disp)
+            elif self.disp < 0:
+                address = f"{address} - {-self.disp}"
+            else:
+                address = f"{address} + {self.disp}"
+
+        if self.size:
+            return f"{MEMORY_SIZE_NAMES[self.size]} [{address}]"
+
+        return f"[{address}]"
+
+    __repr__ = __str__
+
+
+# registers and symbols are strings, immediates are ints
+Operand = Union[str, int, Memory]
+
+
+class Instruction:
+    __slots__ = ('opcode', 'operands')
+
+    def __init__(self, opcode: Opcode, operands: Tuple[Operand, ...] = ()):
+        self.opcode = opcode
+        self.operands = operands
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Instruction) and self.opcode == other.opcode and self.operands == other.operands
+
+    def __str__(self) -> str:
+        if self.opcode == Opcode.LABEL:
+            return f"{self.operands[0]}:"
+
+        if self.opcode == Opcode.RAW:
+            return self.operands[0]
+
+        if not self.operands:
+            return OPCODE_NAMES[self.opcode]
+
+        return f"{OPCODE_NAMES[self.opcode]} {', '.join(map(str, self.operands))}"
+
+    __repr__ = __str__
+
+
+OPCODE_NAMES = {opcode: opcode.name.lower() for opcode in Opcode}
+
+
+def is_register(operand: Operand) -> bool:
+    return isinstance(operand, str) and operand in REGISTERS
+
+
+def reads_register(operand: Operand, reg: str) -> bool:
+    # reg is a 64 bit register name, operand reads any part of it
+    if isinstance(operand, Memory):
+        return operand.uses(reg)
+
+    return is_register(operand) and REGISTERS[operand] == reg
+
+
+def render(body) -> str:
+    return '\n'.join(f'    {instruction}' for instruction in body)
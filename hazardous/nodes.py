@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field, fields, is_dataclass
 from typing import List, Tuple
 from .scanner import Token, TokenLocation, TokenType
 from enum import IntEnum, auto
@@ -23,15 +24,38 @@ class TypeEnum(IntEnum):
     NONE = auto()
 
 
-@dataclass
+@dataclass(slots=True)
 class Type:
     id: TypeEnum
     is_base_type: bool = True
     base_type: any = None
     data: dict = None
+    # the shared pointer to this type, see pointer_type
+    _pointer: any = field(default=None, init=False, repr=False, compare=False)
 
 
-@dataclass
+# types are never changed once built
+# so every use of a primitive type, or a pointer to the same type, can share one instance
+PRIMITIVE_TYPES = {type_id: Type(id=type_id) for type_id in (
+    TypeEnum.U8, TypeEnum.U16, TypeEnum.U32, TypeEnum.U64,
+    TypeEnum.I8, TypeEnum.I16, TypeEnum.I32, TypeEnum.I64,
+    TypeEnum.PTR, TypeEnum.NONE
+)}
+
+
+def primitive_type(type_id: TypeEnum) -> Type:
+    return PRIMITIVE_TYPES[type_id]
+
+
+def pointer_type(base_type: Type) -> Type:
+    # cached on the base type, so it goes away with it instead of living as long as the compiler
+    if base_type._pointer is None:
+        base_type._pointer = Type(id=TypeEnum.PTR, is_base_type=False, base_type=base_type)
+
+    return base_type._pointer
+
+
+@dataclass(slots=True)
 class ProgramVariable:
     name: str
     type: Type
@@ -39,7 +63,7 @@ class ProgramVariable:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class ProgramProcedure:
     name: str
     return_type: Type
@@ -51,9 +75,11 @@ class ProgramProcedure:
     stdcall: bool
     is_local: bool
     always: bool = False
+    # tokens of a body that hasn't been parsed yet (Parser.lazy_bodies)
+    body_tokens: list = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ProgramExternProcedure:
     name: str
     return_type: Type
@@ -63,14 +89,14 @@ class ProgramExternProcedure:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class ProgramExternVariable:
     name: str
     type: Type
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class LocalVariable:
     name: str
     type: Type
@@ -78,14 +104,14 @@ class LocalVariable:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class LocalStruct:
     name: str
     type: Type
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class LocalArray:
     name: str
     type: Type
@@ -93,76 +119,76 @@ class LocalArray:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Variable:
     name: str
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class AssignVariable:
     name: str
     value: any
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Number:
     value: int
 
 
-@dataclass
+@dataclass(slots=True)
 class String:
     value: str
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOperation:
     left: any
     right: any
     operation: TokenType
 
 
-@dataclass
+@dataclass(slots=True)
 class CallFunction:
     name: str
     args: list
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class CallFunctionExpression:
     value: any
     args: list
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Cast:
     type: Type
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class ExpressionStatement:
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class Return:
     value: any
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class DereferencePointer:
     pointer: any
     offset: any
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class SetAtPointer:
     pointer: any
     offset: any
@@ -170,33 +196,33 @@ class SetAtPointer:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class ReserveUninitialized:
     type: Type
     size: int
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class ReserveInitialized:
     type: Type
     data: list
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class AddressOf:
     name: str
     location: TokenLocation
 
-@dataclass
+@dataclass(slots=True)
 class ProgramStruct:
     name: str
     members: List[Tuple[Type, str]]
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class ProgramClass:
     name: str
     members: list
@@ -205,14 +231,14 @@ class ProgramClass:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class AccessStructMember:
     struct_pointer: any
     name: str
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class WriteStructMember:
     struct_pointer: any
     name: str
@@ -220,98 +246,257 @@ class WriteStructMember:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Sizeof:
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class SizeofType:
     type: Type
 
 
-@dataclass
+@dataclass(slots=True)
 class Negate:
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class IfStatement:
     value: any
     body: any
     else_body: any
 
 
-@dataclass
+@dataclass(slots=True)
 class WhileStatement:
     value: any
     body: any
     
     
-@dataclass
+@dataclass(slots=True)
 class CompoundStatement:
     body: list
 
 
-@dataclass
+@dataclass(slots=True)
 class BreakLoop:
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class NewInstance:
     name: str
     args: list
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Register:
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class AssignRegister:
     name: str
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class Multiple:
     nodes: list
 
 
-@dataclass
+@dataclass(slots=True)
 class SwitchStatement:
     value: any
     cases: List[Tuple[int, list]]
     default_case: list
 
 
-@dataclass
+@dataclass(slots=True)
 class Enumeration:
     name: str
     values: dict
 
 
-@dataclass
+@dataclass(slots=True)
 class Push:
     value: any
 
 
-@dataclass
+@dataclass(slots=True)
 class Pop:
     name: str
     location: TokenLocation
 
 
-@dataclass
+@dataclass(slots=True)
 class Call:
     name: str
     location: TokenLocation
     args_passed: int = 0
 
 
-@dataclass
+@dataclass(slots=True)
 class InlineAssembly:
-    value: str
\ No newline at end of file
+    value: str
+
+
+def is_node(value) -> bool:
+    return is_dataclass(value) and type(value).__module__ == __name__ and not isinstance(value, Type)
+
+
+def child_nodes(node):
+    # every node directly below 'node', including the ones in lists (statement lists, arguments, switch cases)
+    for field in fields(node):
+        yield from _collect_nodes(getattr(node, field.name))
+
+
+def _collect_nodes(value):
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _collect_nodes(item)
+
+    elif is_node(value):
+        yield value
+
+
+def walk(node):
+    # node and everything below it
+    pending = [node]
+
+    while pending:
+        node = pending.pop()
+        pending.extend(child_nodes(node))
+        yield node
+
+
+NODE_CLASSES = [value for value in list(globals().values()) if isinstance(value, type) and is_dataclass(value) and value is not Type]
+NODE_KINDS = {node_class: kind for kind, node_class in enumerate(NODE_CLASSES)}
+NODE_FIELDS = [tuple(field.name for field in fields(node_class)) for node_class in NODE_CLASSES]
+
+
+# what a packed field value is, the payload goes in NodeArena.links
+FIELD_VALUE = 0  # stored as is in 'values' (strings are interned)
+FIELD_NODE = 1  # index of the node
+FIELD_NODE_LIST = 2  # offset in 'lists'
+FIELD_LOCATION = 3  # index in 'location_sources' and 'location_offsets'
+
+
+@dataclass(slots=True)
+class PackedNode:
+    # stands in for a node nested deeper than a field or a list of nodes (switch cases)
+    index: int
+
+
+class NodeArena:
+    # trees packed into flat columns, a node is just an index into them
+    # the fields of a node are stored one after the other, starting at starts[index]
+    def __init__(self):
+        self.kinds = array('B')
+        self.starts = array('L')
+        # one entry per field
+        self.tags = array('B')
+        self.links = array('L')
+        self.values = []
+        # lists of nodes, their length followed by the node indices
+        self.lists = array('L')
+        # locations without a TokenLocation object each
+        self.sources = []
+        self.source_indices = {}
+        self.location_sources = array('H')
+        self.location_offsets = array('L')
+        self.strings = {}
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def pack(self, declarations: list) -> List[int]:
+        return [self.add(node) for node in declarations]
+
+    def add(self, node) -> int:
+        index = len(self.kinds)
+        kind = NODE_KINDS[type(node)]
+        start = len(self.values)
+        names = NODE_FIELDS[kind]
+
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.tags.extend(bytes(len(names)))
+        self.links.extend([0] * len(names))
+        self.values.extend([None] * len(names))
+
+        for offset, name in enumerate(names):
+            value = getattr(node, name)
+            position = start + offset
+
+            if is_node(value):
+                self.tags[position] = FIELD_NODE
+                self.links[position] = self.add(value)
+
+            elif isinstance(value, list) and all(is_node(item) for item in value):
+                children = [self.add(item) for item in value]
+                self.tags[position] = FIELD_NODE_LIST
+                self.links[position] = len(self.lists)
+                self.lists.append(len(children))
+                self.lists.extend(children)
+
+            elif isinstance(value, TokenLocation):
+                source_index = self.source_indices.get(id(value.source))
+
+                if source_index is None:
+                    source_index = self.source_indices[id(value.source)] = len(self.sources)
+                    self.sources.append(value.source)
+
+                self.tags[position] = FIELD_LOCATION
+                self.links[position] = len(self.location_offsets)
+                self.location_sources.append(source_index)
+                self.location_offsets.append(value.offset)
+
+            else:
+                self.values[position] = self._pack_value(value)
+
+        return index
+
+    def node(self, index: int):
+        # builds the node back, with everything below it
+        kind = self.kinds[index]
+        start = self.starts[index]
+        values = {}
+
+        for offset, name in enumerate(NODE_FIELDS[kind]):
+            position = start + offset
+            tag, link = self.tags[position], self.links[position]
+
+            if tag == FIELD_NODE:
+                values[name] = self.node(link)
+            elif tag == FIELD_NODE_LIST:
+                values[name] = [self.node(child) for child in self.lists[link + 1:link + 1 + self.lists[link]]]
+            elif tag == FIELD_LOCATION:
+                values[name] = TokenLocation(self.sources[self.location_sources[link]], self.location_offsets[link])
+            else:
+                values[name] = self._unpack_value(self.values[position])
+
+        return NODE_CLASSES[kind](**values)
+
+    def _pack_value(self, value):
+        if isinstance(value, str):
+            return self.strings.setdefault(value, value)
+
+        if is_node(value):
+            return PackedNode(self.add(value))
+
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._pack_value(item) for item in value)
+
+        return value
+
+    def _unpack_value(self, value):
+        if isinstance(value, PackedNode):
+            return self.node(value.index)
+
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._unpack_value(item) for item in value)
+
+        return value
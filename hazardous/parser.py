@@ -1,5 +1,6 @@
-from typing import List
+from typing import Iterable, List
 from .scanner import Token, TokenLocation, TokenType
+from .callgraph import CallGraph
 from . import nodes
 
 
@@ -15,11 +16,44 @@ TOKEN_VAR_TYPE = {
     TokenType.PTR: nodes.TypeEnum.PTR
 }
 
+# binding power of the binary operators, higher binds tighter, all left associative
+BINARY_PRECEDENCE = {
+    TokenType.ARROW_UP: 1, TokenType.PIPE: 1, TokenType.AMPERSAND: 1,
+    TokenType.AND: 2, TokenType.OR: 2, TokenType.PRECENT: 2,
+    TokenType.DEQUALS: 3, TokenType.NEQUALS: 3,
+    TokenType.GREATER: 4, TokenType.LOWER: 4,
+    TokenType.GEQUALS: 5, TokenType.LEQUALS: 5,
+    TokenType.PLUS: 6, TokenType.MINUS: 6,
+    TokenType.STAR: 7, TokenType.SLASH: 7
+}
+
+# operators folded at parse time when both operands are number literals
+CONSTANT_FOLDS = {
+    TokenType.DEQUALS: lambda a, b: int(a == b),
+    TokenType.NEQUALS: lambda a, b: int(a != b),
+    TokenType.GREATER: lambda a, b: int(a > b),
+    TokenType.LOWER: lambda a, b: int(a < b),
+    TokenType.GEQUALS: lambda a, b: int(a >= b),
+    TokenType.LEQUALS: lambda a, b: int(a <= b),
+    TokenType.PLUS: lambda a, b: a + b,
+    TokenType.MINUS: lambda a, b: a - b,
+    TokenType.STAR: lambda a, b: a * b,
+    TokenType.SLASH: lambda a, b: a // b
+}
+
 
 class Parser:
-    def parse(self, tokens: List[Token]):
-        self.tokens = tokens
-        self.pos = 0
+    def __init__(self, lazy_bodies: bool = False):
+        # procedure bodies are only skipped over at first, and parsed once something reachable calls them
+        self.lazy_bodies = lazy_bodies
+        self.parsed_bodies = 0
+        self.skipped_bodies = 0
+
+    def parse(self, tokens: Iterable[Token]):
+        # tokens can be a list or a stream (Preprocessor.stream), only one token of lookahead is needed
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens)
+        self.last = None
         self.typedefs = {}
         self.enum_data = {}
 
@@ -38,20 +72,94 @@ class Parser:
                 if not type_data.data['declared']:
                     self.error(type_data.data['location'], f"Body of '{type_name}' was never defined, only forward declared")
 
+        if self.lazy_bodies:
+            self.parse_reachable_bodies(declarations)
+
         return declarations
 
+    def parse_reachable_bodies(self, declarations):
+        # every type is known by now, a body is parsed once it can be reached from what's always kept
+        reached = CallGraph(declarations).reachable(visit=self.parse_body)
+
+        # nothing reachable calls the rest, they're left as forward declarations
+        for node in declarations:
+            if isinstance(node, nodes.ProgramProcedure) and node.body_tokens is not None and node.name not in reached:
+                node.body_tokens = None
+                node.forward_declared = True
+
+    def parse_body(self, procedure: nodes.ProgramProcedure):
+        # the rest of the input is put aside while the skipped tokens are parsed
+        if procedure.body_tokens is None:
+            return
+
+        saved = self.tokens, self.current, self.last
+        self.tokens = iter(procedure.body_tokens)
+        self.current = next(self.tokens)
+
+        procedure.body = self.parse_block()
+        procedure.body_tokens = None
+        self.parsed_bodies += 1
+
+        self.tokens, self.current, self.last = saved
+
     def parse_declarations(self):
         is_local = self.match(TokenType.LOCAL)
+        return self.parse_declaration(is_local)
 
-        if self.match(TokenType.VAR):
-            var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
-            self.consume(TokenType.COLON, "Expected variable type")
-            var_type = self.consume_type("Expected variable type")
-            # var_value = self.parse_constant() if self.match(TokenType.EQUALS) else None
-            self.consume(TokenType.SEMICOLON, "Expected ';' after global variable declaration")
+    def parse_declaration(self, is_local):
+        parse = self.declaration_parsers.get(self.current.type)
+
+        if parse is None:
+            if not self.match(TokenType.EOF):
+                self.error(self.peek().location, "Expected declaration")
+            return
+
+        token = self.last = self.current
+        self.current = next(self.tokens, token)
+        return parse(self, is_local)
+
+    def parse_variable_declaration(self, is_local):
+        var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
+        self.consume(TokenType.COLON, "Expected variable type")
+        var_type = self.consume_type("Expected variable type")
+        # var_value = self.parse_constant() if self.match(TokenType.EQUALS) else None
+        self.consume(TokenType.SEMICOLON, "Expected ';' after global variable declaration")
+
+        return nodes.ProgramVariable(name=var_name.value, type=var_type, is_local=is_local, location=var_name.location)
+
+    def parse_procedure_declaration(self, is_local):
+        stdcall = self.match(TokenType.STDCALL)
+        name = self.consume(TokenType.IDENTIFIER, "Expected procedure name")
+        args = []
+        varargs = False
+
+        if self.match(TokenType.OPEN_PAREN):
+            if not self.check(TokenType.CLOSE_PAREN):
+                while True:
+                    if self.match(TokenType.VARARGS):
+                        varargs = True
+                        break
 
-            return nodes.ProgramVariable(name=var_name.value, type=var_type, is_local=is_local, location=var_name.location)
+                    arg_name = self.consume(TokenType.IDENTIFIER, "Expected procedure parameter name")
+                    self.consume(TokenType.COLON, "Expected procedure parameter type")
+                    arg_type = self.consume_type("Expected procedure parameter type")
+                    args.append((arg_type, arg_name.value))
 
+                    if not self.match(TokenType.COMMA): break
+
+            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after procedure parameters")
+
+        return_type = self.consume_type("Expected procedure return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.primitive_type(nodes.TypeEnum.NONE)
+
+        if self.match(TokenType.SEMICOLON):
+            return nodes.ProgramProcedure(name=name.value, location=name.location, is_local=is_local, stdcall=stdcall, args=args, return_type=return_type, body=None, varargs=varargs, forward_declared=True)
+
+        self.consume(TokenType.OPEN_BRACE, "Expected '{' for procedure body")
+        body, body_tokens = self.parse_procedure_body()
+
+        return nodes.ProgramProcedure(name=name.value, location=name.location, is_local=is_local, stdcall=stdcall, args=args, return_type=return_type, body=body, varargs=varargs, forward_declared=False, body_tokens=body_tokens)
+
+    def parse_extern_declaration(self, is_local):
         if self.match(TokenType.PROC):
             stdcall = self.match(TokenType.STDCALL)
             name = self.consume(TokenType.IDENTIFIER, "Expected procedure name")
@@ -74,189 +182,168 @@ class Parser:
 
                 self.consume(TokenType.CLOSE_PAREN, "Expected ')' after procedure parameters")
 
-            return_type = self.consume_type("Expected procedure return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.Type(id=nodes.TypeEnum.NONE)
-            
-            if self.match(TokenType.SEMICOLON):
-                return nodes.ProgramProcedure(name=name.value, location=name.location, is_local=is_local, stdcall=stdcall, args=args, return_type=return_type, body=None, varargs=varargs, forward_declared=True)
-            
-            self.consume(TokenType.OPEN_BRACE, "Expected '{' for procedure body")
-            body = self.parse_block()
-
-            return nodes.ProgramProcedure(name=name.value, location=name.location, is_local=is_local, stdcall=stdcall, args=args, return_type=return_type, body=body, varargs=varargs, forward_declared=False)
-
-        if self.match(TokenType.EXTERNAL):
-            if self.match(TokenType.PROC):
-                stdcall = self.match(TokenType.STDCALL)
-                name = self.consume(TokenType.IDENTIFIER, "Expected procedure name")
-                args = []
-                varargs = False
-
-                if self.match(TokenType.OPEN_PAREN):
-                    if not self.check(TokenType.CLOSE_PAREN):
-                        while True:
-                            if self.match(TokenType.VARARGS):
-                                varargs = True
-                                break
+            return_type = self.consume_type("Expected procedure return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.primitive_type(nodes.TypeEnum.NONE)
+            self.consume(TokenType.SEMICOLON, "Expected ';' after extern procedure")
 
-                            arg_name = self.consume(TokenType.IDENTIFIER, "Expected procedure parameter name")
-                            self.consume(TokenType.COLON, "Expected procedure parameter type")
-                            arg_type = self.consume_type("Expected procedure parameter type")
-                            args.append((arg_type, arg_name.value))
-
-                            if not self.match(TokenType.COMMA): break
+            return nodes.ProgramExternProcedure(name=name.value, location=name.location, stdcall=stdcall, args=args, return_type=return_type, varargs=varargs)
 
-                    self.consume(TokenType.CLOSE_PAREN, "Expected ')' after procedure parameters")
+        if self.match(TokenType.VAR):
+            var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
+            self.consume(TokenType.COLON, "Expected variable type")
+            var_type = self.consume_type("Expected variable type")
+            self.consume(TokenType.SEMICOLON, "Expected ';' after extern variable declaration")
+            return nodes.ProgramExternVariable(name=var_name.value, location=var_name.location, type=var_type)
 
-                return_type = self.consume_type("Expected procedure return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.Type(id=nodes.TypeEnum.NONE)
-                self.consume(TokenType.SEMICOLON, "Expected ';' after extern procedure")
+        # 'extern' in front of anything else is ignored
+        return self.parse_declaration(is_local)
 
-                return nodes.ProgramExternProcedure(name=name.value, location=name.location, stdcall=stdcall, args=args, return_type=return_type, varargs=varargs)
+    def parse_struct_declaration(self, is_local):
+        name = self.consume(TokenType.IDENTIFIER, "Expected struct name")
 
-            if self.match(TokenType.VAR):
-                var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
-                self.consume(TokenType.COLON, "Expected variable type")
-                var_type = self.consume_type("Expected variable type")
-                self.consume(TokenType.SEMICOLON, "Expected ';' after extern variable declaration")
-                return nodes.ProgramExternVariable(name=var_name.value, location=var_name.location, type=var_type)
+        if self.match(TokenType.SEMICOLON):
+            self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.STRUCT, data={"struct_name": name.value, "declared": False, "location": name.location})
+            return
 
-        if self.match(TokenType.STRUCT):
-            name = self.consume(TokenType.IDENTIFIER, "Expected struct name")
+        body = self.parse_sub_struct()
 
-            if self.match(TokenType.SEMICOLON):
-                self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.STRUCT, data={"struct_name": name.value, "declared": False, "location": name.location})
-                return
+        self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.STRUCT, data={"struct_name": name.value, "declared": True})
+        return nodes.ProgramStruct(name=name.value, members=body, location=name.location)
 
-            body = self.parse_sub_struct()
+    def parse_enum_declaration(self, is_local):
+        name = self.consume(TokenType.IDENTIFIER, "Expected enum name")
 
-            self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.STRUCT, data={"struct_name": name.value, "declared": True})
-            return nodes.ProgramStruct(name=name.value, members=body, location=name.location)
+        self.consume(TokenType.OPEN_BRACE, "Expected '{'")
 
-        if self.match(TokenType.ENUM):
-            name = self.consume(TokenType.IDENTIFIER, "Expected enum name")
+        enums = {}
+        num = 0
 
-            self.consume(TokenType.OPEN_BRACE, "Expected '{'")
+        if not self.check(TokenType.CLOSE_BRACE):
+            while True:
+                enum_name = self.consume(TokenType.IDENTIFIER, "Expected enumeration value name")
 
-            enums = {}
-            num = 0
+                if self.match(TokenType.EQUALS):
+                    tok = self.consume(TokenType.NUMBER, "Expected number after '=' in enum")
+                    num = int(tok.value)
 
-            if not self.check(TokenType.CLOSE_BRACE):
-                while True:
-                    enum_name = self.consume(TokenType.IDENTIFIER, "Expected enumeration value name")
+                enums[enum_name.value] = num
+                num += 1
 
-                    if self.match(TokenType.EQUALS):
-                        tok = self.consume(TokenType.NUMBER, "Expected number after '=' in enum")
-                        num = int(tok.value)
+                if not self.match(TokenType.COMMA): break
 
-                    enums[enum_name.value] = num
-                    num += 1
-                    
-                    if not self.match(TokenType.COMMA): break
+        self.consume(TokenType.CLOSE_BRACE, "Expected '}'")
+        self.typedefs[name.value] = nodes.primitive_type(nodes.TypeEnum.U64)
+        self.enum_data[name.value] = enums
+        return nodes.Enumeration(name=name.value, values=enums)
 
-            self.consume(TokenType.CLOSE_BRACE, "Expected '}'")
-            self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.U64)
-            self.enum_data[name.value] = enums
-            return nodes.Enumeration(name=name.value, values=enums)
+    def parse_class_declaration(self, is_local):
+        name = self.consume(TokenType.IDENTIFIER, "Expected class name")
 
-        if self.match(TokenType.CLASS):
-            name = self.consume(TokenType.IDENTIFIER, "Expected class name")
+        if self.match(TokenType.SEMICOLON):
+            self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": False, "location": name.location})
+            return
 
-            if self.match(TokenType.SEMICOLON):
-                self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": False, "location": name.location})
-                return
+        self.consume(TokenType.OPEN_BRACE, "Expected '{'")
 
-            self.consume(TokenType.OPEN_BRACE, "Expected '{'")
+        body = []
+        methods = {}
+        returned_nodes = []
+        initializer = None
+        # shared by the 'this' argument of every method
+        this_type = nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": True})
 
-            body = []
-            methods = {}
-            returned_nodes = []
-            initializer = None
+        while not self.check(TokenType.CLOSE_BRACE):
+            if self.match(TokenType.VAR):
+                field_name = self.consume(TokenType.IDENTIFIER, "Expected field name")
+                self.consume(TokenType.COLON, "Expected field type")
+                field_type = self.consume_type("Expected field type")
 
-            while not self.check(TokenType.CLOSE_BRACE):
-                if self.match(TokenType.VAR):
-                    field_name = self.consume(TokenType.IDENTIFIER, "Expected field name")
-                    self.consume(TokenType.COLON, "Expected field type")
-                    field_type = self.consume_type("Expected field type")
+                if self.match(TokenType.OPEN_SQUARE):
+                    arr_size = self.consume(TokenType.NUMBER, "Expected array size").value
+                    self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after array size")
+                    field_type = nodes.Type(id=nodes.TypeEnum.ARRAY, data={"size": int(arr_size), "element_type": field_type})
 
-                    if self.match(TokenType.OPEN_SQUARE):
-                        arr_size = self.consume(TokenType.NUMBER, "Expected array size").value
-                        self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after array size")
-                        field_type = nodes.Type(id=nodes.TypeEnum.ARRAY, data={"size": int(arr_size), "element_type": field_type})
+                self.consume(TokenType.SEMICOLON, "Expected ';' after field")
 
-                    self.consume(TokenType.SEMICOLON, "Expected ';' after field")
+                body.append((field_type, field_name.value))
 
-                    body.append((field_type, field_name.value))
+            elif self.match(TokenType.PROC):
+                method_name = self.consume(TokenType.IDENTIFIER, "Expected method name")
+                args = [(this_type, "this")]
+                varargs = False
 
-                elif self.match(TokenType.PROC):
-                    method_name = self.consume(TokenType.IDENTIFIER, "Expected method name")
-                    args = [(nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": True}), "this")]
-                    varargs = False
+                if self.match(TokenType.OPEN_PAREN):
+                    if not self.check(TokenType.CLOSE_PAREN):
+                        while True:
+                            if self.match(TokenType.VARARGS):
+                                varargs = True
+                                break
 
-                    if self.match(TokenType.OPEN_PAREN):
-                        if not self.check(TokenType.CLOSE_PAREN):
-                            while True:
-                                if self.match(TokenType.VARARGS):
-                                    varargs = True
-                                    break
+                            arg_name = self.consume(TokenType.IDENTIFIER, "Expected method parameter name")
+                            self.consume(TokenType.COLON, "Expected method parameter type")
+                            arg_type = self.consume_type("Expected method parameter type")
+                            args.append((arg_type, arg_name.value))
 
-                                arg_name = self.consume(TokenType.IDENTIFIER, "Expected method parameter name")
-                                self.consume(TokenType.COLON, "Expected method parameter type")
-                                arg_type = self.consume_type("Expected method parameter type")
-                                args.append((arg_type, arg_name.value))
+                            if not self.match(TokenType.COMMA): break
 
-                                if not self.match(TokenType.COMMA): break
+                    self.consume(TokenType.CLOSE_PAREN, "Expected ')' after method parameters")
 
-                        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after method parameters")
+                return_type = self.consume_type("Expected method return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.primitive_type(nodes.TypeEnum.NONE)
 
-                    return_type = self.consume_type("Expected method return type after '->'") if self.match(TokenType.POINTER_ARROW) else nodes.Type(id=nodes.TypeEnum.NONE)
-                    
-                    if self.match(TokenType.SEMICOLON):
-                        returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_proc_{method_name.value}", return_type=return_type, body=func_body, args=args, location=method_name.location, forward_declared=True, varargs=varargs, stdcall=False, is_local=True))
-                    else:
-                        self.consume(TokenType.OPEN_BRACE, "Expected '{' for method body")
-                        func_body = self.parse_block()
+                if self.match(TokenType.SEMICOLON):
+                    returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_proc_{method_name.value}", return_type=return_type, body=func_body, args=args, location=method_name.location, forward_declared=True, varargs=varargs, stdcall=False, is_local=True))
+                else:
+                    self.consume(TokenType.OPEN_BRACE, "Expected '{' for method body")
+                    func_body, body_tokens = self.parse_procedure_body()
 
-                        methods[method_name.value] = {"arguments": args, "varargs": varargs, "return_type": return_type}
-                        returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_proc_{method_name.value}", return_type=return_type, body=func_body, args=args, location=method_name.location, forward_declared=False, varargs=varargs, stdcall=False, is_local=True))
+                    methods[method_name.value] = {"arguments": args, "varargs": varargs, "return_type": return_type}
+                    returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_proc_{method_name.value}", return_type=return_type, body=func_body, args=args, location=method_name.location, forward_declared=False, varargs=varargs, stdcall=False, is_local=True, body_tokens=body_tokens))
 
-                # initializer
-                elif self.peek().type == TokenType.IDENTIFIER and self.peek().value == name.value:
-                    init_token = self.advance()
-                    args = [(nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": True}), "this")]
-                    varargs = False
+            # initializer
+            elif self.peek().type == TokenType.IDENTIFIER and self.peek().value == name.value:
+                init_token = self.advance()
+                args = [(this_type, "this")]
+                varargs = False
 
-                    if self.match(TokenType.OPEN_PAREN):
-                        if not self.check(TokenType.CLOSE_PAREN):
-                            while True:
-                                if self.match(TokenType.VARARGS):
-                                    varargs = True
-                                    break
+                if self.match(TokenType.OPEN_PAREN):
+                    if not self.check(TokenType.CLOSE_PAREN):
+                        while True:
+                            if self.match(TokenType.VARARGS):
+                                varargs = True
+                                break
 
-                                arg_name = self.consume(TokenType.IDENTIFIER, "Expected method parameter name")
-                                self.consume(TokenType.COLON, "Expected method parameter type")
-                                arg_type = self.consume_type("Expected method parameter type")
-                                args.append((arg_type, arg_name.value))
+                            arg_name = self.consume(TokenType.IDENTIFIER, "Expected method parameter name")
+                            self.consume(TokenType.COLON, "Expected method parameter type")
+                            arg_type = self.consume_type("Expected method parameter type")
+                            args.append((arg_type, arg_name.value))
 
-                                if not self.match(TokenType.COMMA): break
+                            if not self.match(TokenType.COMMA): break
 
-                        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after method parameters")
+                    self.consume(TokenType.CLOSE_PAREN, "Expected ')' after method parameters")
 
-                    self.consume(TokenType.OPEN_BRACE, "Expected '{' for method body")
-                    func_body = self.parse_block()
+                self.consume(TokenType.OPEN_BRACE, "Expected '{' for method body")
+                func_body = self.parse_block()
 
-                    initializer = {"arguments": args, "varargs": varargs}
-                    returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_init_", return_type=nodes.Type(id=nodes.TypeEnum.NONE), body=func_body, args=args, location=init_token.location, forward_declared=False, varargs=varargs, stdcall=False, is_local=True, always=True))
+                initializer = {"arguments": args, "varargs": varargs}
+                returned_nodes.append(nodes.ProgramProcedure(name=f"__{name.value}_init_", return_type=nodes.primitive_type(nodes.TypeEnum.NONE), body=func_body, args=args, location=init_token.location, forward_declared=False, varargs=varargs, stdcall=False, is_local=True, always=True))
 
-                else:
-                    self.error(self.peek().location, "Expected class member, function or initializer")
+            else:
+                self.error(self.peek().location, "Expected class member, function or initializer")
 
-            self.consume(TokenType.CLOSE_BRACE, "Expected '}'")
+        self.consume(TokenType.CLOSE_BRACE, "Expected '}'")
 
-            self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": True})
-            returned_nodes.insert(0, nodes.ProgramClass(name=name.value, members=body, methods=methods, location=name.location, initializer=initializer))
-            return returned_nodes
+        self.typedefs[name.value] = nodes.Type(id=nodes.TypeEnum.CLASS, data={"class_name": name.value, "declared": True})
+        returned_nodes.insert(0, nodes.ProgramClass(name=name.value, members=body, methods=methods, location=name.location, initializer=initializer))
+        return returned_nodes
 
-        if not self.match(TokenType.EOF):
-            self.error(self.peek().location, "Expected declaration")
+    # declaration keyword -> method parsing the rest of the declaration, called once the keyword is consumed
+    declaration_parsers = {
+        TokenType.VAR: parse_variable_declaration,
+        TokenType.PROC: parse_procedure_declaration,
+        TokenType.EXTERNAL: parse_extern_declaration,
+        TokenType.STRUCT: parse_struct_declaration,
+        TokenType.ENUM: parse_enum_declaration,
+        TokenType.CLASS: parse_class_declaration
+    }
 
     def parse_sub_struct(self):
         self.consume(TokenType.OPEN_BRACE, "Expected '{'")
@@ -281,263 +368,240 @@ class Parser:
 
         return body
 
+    def parse_procedure_body(self):
+        # (body, None) or, with lazy bodies, (None, tokens of the body up to and including its '}')
+        if not self.lazy_bodies:
+            return self.parse_block(), None
+
+        body_tokens = []
+        depth = 1
+
+        while depth:
+            token = self.current
+
+            if token.type == TokenType.EOF:
+                self.error(token.location, "Expected '}' after code block")
+            elif token.type == TokenType.OPEN_BRACE:
+                depth += 1
+            elif token.type == TokenType.CLOSE_BRACE:
+                depth -= 1
+
+            body_tokens.append(token)
+            self.last = token
+            self.current = next(self.tokens, token)
+
+        self.skipped_bodies += 1
+        return None, body_tokens
+
     def parse_block(self):
         statements = []
 
-        while not self.check(TokenType.CLOSE_BRACE):
+        while self.current.type != TokenType.CLOSE_BRACE:
             statements.append(self.parse_statement())
 
         self.consume(TokenType.CLOSE_BRACE, "Expected '}' after code block")
         return statements
 
     def parse_statement(self):
-        if self.match(TokenType.VAR):
-            var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
-            # auto type
-            if self.match(TokenType.EQUALS):
-                var_value = self.parse_expression()
-                self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
-                return nodes.LocalVariable(name=var_name.value, location=var_name.location, type=None, value=var_value)
-
-            self.consume(TokenType.COLON, "Expected variable type")
-            var_type = self.consume_type("Expected variable type")
+        # the keyword picks the statement, anything else is an expression statement
+        parse = self.statement_parsers.get(self.current.type)
 
-            if self.match(TokenType.OPEN_SQUARE):
-                size = self.consume(TokenType.NUMBER, "Expected array size")
-                self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after local array size")
-                self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
-                return nodes.LocalArray(name=var_name.value, type=var_type, size=int(size.value), location=var_name.location)
-
-            if var_type.id == nodes.TypeEnum.STRUCT and self.match(TokenType.SEMICOLON):
-                return nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location)
-
-            if var_type.id == nodes.TypeEnum.CLASS:
-                if self.match(TokenType.SEMICOLON):
-                    return nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location)
-                
-                if self.match(TokenType.OPEN_PAREN):
-                    args = [nodes.Variable(name=var_name.value, location=var_name.location)]
-                    if not self.check(TokenType.CLOSE_PAREN):
-                        while True:
-                            args.append(self.parse_expression())
-                            if not self.match(TokenType.COMMA): break
-
-                    self.consume(TokenType.CLOSE_PAREN, "Expected ')' after local class initializer")
-                    self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
+        if parse is None:
+            expr = self.parse_expression()
+            self.consume(TokenType.SEMICOLON, "Expected ';' after expression statement")
+            return nodes.ExpressionStatement(value=expr)
+
+        token = self.last = self.current
+        self.current = next(self.tokens, token)
+        return parse(self)
+
+    def parse_var_statement(self):
+        var_name = self.consume(TokenType.IDENTIFIER, "Expected variable name")
+        # auto type
+        if self.match(TokenType.EQUALS):
+            var_value = self.parse_expression()
+            self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
+            return nodes.LocalVariable(name=var_name.value, location=var_name.location, type=None, value=var_value)
 
-                    return nodes.Multiple(nodes=[
-                        nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location),
-                        nodes.CallFunction(name=f"__{var_type.data['class_name']}_init_", args=args, location=var_name.location)
-                    ])
+        self.consume(TokenType.COLON, "Expected variable type")
+        var_type = self.consume_type("Expected variable type")
 
-            var_value = self.parse_expression() if self.match(TokenType.EQUALS) else None
+        if self.match(TokenType.OPEN_SQUARE):
+            size = self.consume(TokenType.NUMBER, "Expected array size")
+            self.consume(TokenType.CLOSE_SQUARE, "Expected ']' after local array size")
             self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
-            return nodes.LocalVariable(name=var_name.value, location=var_name.location, type=var_type, value=var_value)
+            return nodes.LocalArray(name=var_name.value, type=var_type, size=int(size.value), location=var_name.location)
 
-        if self.match(TokenType.RETURN):
-            location = self.previous().location
-            value = self.parse_expression() if not self.check(TokenType.SEMICOLON) else None
-            self.consume(TokenType.SEMICOLON, "Expected ';' after return statement")
-            return nodes.Return(value=value, location=location)
+        if var_type.id == nodes.TypeEnum.STRUCT and self.match(TokenType.SEMICOLON):
+            return nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location)
 
-        if self.match(TokenType.OPEN_BRACE):
-            body = []
+        if var_type.id == nodes.TypeEnum.CLASS:
+            if self.match(TokenType.SEMICOLON):
+                return nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location)
+
+            if self.match(TokenType.OPEN_PAREN):
+                args = [nodes.Variable(name=var_name.value, location=var_name.location)]
+                if not self.check(TokenType.CLOSE_PAREN):
+                    while True:
+                        args.append(self.parse_expression())
+                        if not self.match(TokenType.COMMA): break
 
-            while not self.check(TokenType.CLOSE_BRACE):
-                body.append(self.parse_statement())
+                self.consume(TokenType.CLOSE_PAREN, "Expected ')' after local class initializer")
+                self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
 
-            self.consume(TokenType.CLOSE_BRACE, "Expected '}' after compound statement")
-            return nodes.CompoundStatement(body=body)
+                return nodes.Multiple(nodes=[
+                    nodes.LocalStruct(name=var_name.value, type=var_type, location=var_name.location),
+                    nodes.ExpressionStatement(value=nodes.CallFunction(name=f"__{var_type.data['class_name']}_init_", args=args, location=var_name.location))
+                ])
 
-        if self.match(TokenType.IF):
-            self.consume(TokenType.OPEN_PAREN, "Expected '(' after if keyword")
-            expr = self.parse_expression()
-            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after if expression")
-            body = self.parse_statement()
-            else_body = self.parse_statement() if self.match(TokenType.ELSE) else None
-            return nodes.IfStatement(value=expr, body=body, else_body=else_body)
+        var_value = self.parse_expression() if self.match(TokenType.EQUALS) else None
+        self.consume(TokenType.SEMICOLON, "Expected ';' after local variable declaration")
+        return nodes.LocalVariable(name=var_name.value, location=var_name.location, type=var_type, value=var_value)
 
-        if self.match(TokenType.WHILE):
-            self.consume(TokenType.OPEN_PAREN, "Expected '(' after while keyword")
-            expr = self.parse_expression()
-            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after while expression")
-            body = self.parse_statement()
-            return nodes.WhileStatement(value=expr, body=body)
-
-        if self.match(TokenType.BREAK):
-            node = nodes.BreakLoop(location=self.previous().location)
-            self.consume(TokenType.SEMICOLON, "Expected ';' after break")
-            return node
-
-        if self.match(TokenType.ASM):
-            value = self.consume(TokenType.STRING, "Expected string")
-            self.consume(TokenType.SEMICOLON, "Expected ';' after asm")
-            return nodes.InlineAssembly(value=value.value[1:-1])
-
-        if self.match(TokenType.SWITCH):
-            self.consume(TokenType.OPEN_PAREN, "Expected '(' after switch keyword")
-            expr = self.parse_expression()
-            self.consume(TokenType.CLOSE_PAREN, "Expected ')' after switch expression")
-            self.consume(TokenType.OPEN_BRACE, "Expected switch body")
+    def parse_return_statement(self):
+        location = self.previous().location
+        value = self.parse_expression() if not self.check(TokenType.SEMICOLON) else None
+        self.consume(TokenType.SEMICOLON, "Expected ';' after return statement")
+        return nodes.Return(value=value, location=location)
 
-            cases = []
-            default_case = None
-            while not self.check(TokenType.CLOSE_BRACE):
-                if self.match(TokenType.DEFAULT):
-                    self.consume(TokenType.COLON, "Expected ':'")
-                    default_case = []
+    def parse_compound_statement(self):
+        body = []
 
-                    while (not self.check(TokenType.CASE)) and (not self.check(TokenType.DEFAULT)) and (not self.check(TokenType.CLOSE_BRACE)):
-                        default_case.append(self.parse_statement())
+        while not self.check(TokenType.CLOSE_BRACE):
+            body.append(self.parse_statement())
 
-                elif self.match(TokenType.CASE):
-                    case_value = self.consume_num_constant("Expected case expression (must be a constant number)")
-                    self.consume(TokenType.COLON, "Expected ':'")
-                    case_body = []
+        self.consume(TokenType.CLOSE_BRACE, "Expected '}' after compound statement")
+        return nodes.CompoundStatement(body=body)
 
-                    while (not self.check(TokenType.CASE)) and (not self.check(TokenType.DEFAULT)) and (not self.check(TokenType.CLOSE_BRACE)):
-                        case_body.append(self.parse_statement())
+    def parse_if_statement(self):
+        self.consume(TokenType.OPEN_PAREN, "Expected '(' after if keyword")
+        expr = self.parse_expression()
+        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after if expression")
+        body = self.parse_statement()
+        else_body = self.parse_statement() if self.match(TokenType.ELSE) else None
+        return nodes.IfStatement(value=expr, body=body, else_body=else_body)
 
-                    cases.append((int(case_value.value), case_body))
+    def parse_while_statement(self):
+        self.consume(TokenType.OPEN_PAREN, "Expected '(' after while keyword")
+        expr = self.parse_expression()
+        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after while expression")
+        body = self.parse_statement()
+        return nodes.WhileStatement(value=expr, body=body)
+
+    def parse_break_statement(self):
+        node = nodes.BreakLoop(location=self.previous().location)
+        self.consume(TokenType.SEMICOLON, "Expected ';' after break")
+        return node
+
+    def parse_asm_statement(self):
+        value = self.consume(TokenType.STRING, "Expected string")
+        self.consume(TokenType.SEMICOLON, "Expected ';' after asm")
+        return nodes.InlineAssembly(value=value.value[1:-1])
+
+    def parse_switch_statement(self):
+        self.consume(TokenType.OPEN_PAREN, "Expected '(' after switch keyword")
+        expr = self.parse_expression()
+        self.consume(TokenType.CLOSE_PAREN, "Expected ')' after switch expression")
+        self.consume(TokenType.OPEN_BRACE, "Expected switch body")
 
-                else:
-                    self.error(self.peek().location, "Expected a case")
+        cases = []
+        default_case = None
+        while not self.check(TokenType.CLOSE_BRACE):
+            if self.match(TokenType.DEFAULT):
+                self.consume(TokenType.COLON, "Expected ':'")
+                default_case = []
 
-            self.consume(TokenType.CLOSE_BRACE, "Expected '}' after switch cases")
-            return nodes.SwitchStatement(value=expr, cases=cases, default_case=default_case)
+                while (not self.check(TokenType.CASE)) and (not self.check(TokenType.DEFAULT)) and (not self.check(TokenType.CLOSE_BRACE)):
+                    default_case.append(self.parse_statement())
 
-        if self.match(TokenType.PUSH):
-            value = self.parse_expression()
-            self.consume(TokenType.SEMICOLON, "Expected ';' after push statement")
-            return nodes.Push(value=value)
+            elif self.match(TokenType.CASE):
+                case_value = self.consume_num_constant("Expected case expression (must be a constant number)")
+                self.consume(TokenType.COLON, "Expected ':'")
+                case_body = []
 
-        if self.match(TokenType.POP):
-            name = self.previous().value
-            location = self.previous().location
-            variable = self.previous() if self.match(TokenType.IDENTIFIER) else None
-            self.consume(TokenType.SEMICOLON, f"Expected ';' after {name} statement")
-            return nodes.Pop(name=variable.value if variable is not None else None, location=location)
+                while (not self.check(TokenType.CASE)) and (not self.check(TokenType.DEFAULT)) and (not self.check(TokenType.CLOSE_BRACE)):
+                    case_body.append(self.parse_statement())
 
-        if self.match(TokenType.CALL):
-            func_name = self.consume(TokenType.IDENTIFIER, "Expected function name")
-            args_passed = int(self.previous().value) if self.match(TokenType.NUMBER) else 0
-            self.consume(TokenType.SEMICOLON, f"Expected ';' after call statement")
-            return nodes.Call(name=func_name.value, location=func_name.location, args_passed=args_passed)
+                cases.append((int(case_value.value), case_body))
 
-        expr = self.parse_expression()
-        self.consume(TokenType.SEMICOLON, "Expected ';' after expression statement")
-        return nodes.ExpressionStatement(value=expr)
+            else:
+                self.error(self.peek().location, "Expected a case")
+
+        self.consume(TokenType.CLOSE_BRACE, "Expected '}' after switch cases")
+        return nodes.SwitchStatement(value=expr, cases=cases, default_case=default_case)
+
+    def parse_push_statement(self):
+        value = self.parse_expression()
+        self.consume(TokenType.SEMICOLON, "Expected ';' after push statement")
+        return nodes.Push(value=value)
+
+    def parse_pop_statement(self):
+        name = self.previous().value
+        location = self.previous().location
+        variable = self.previous() if self.match(TokenType.IDENTIFIER) else None
+        self.consume(TokenType.SEMICOLON, f"Expected ';' after {name} statement")
+        return nodes.Pop(name=variable.value if variable is not None else None, location=location)
+
+    def parse_call_statement(self):
+        func_name = self.consume(TokenType.IDENTIFIER, "Expected function name")
+        args_passed = int(self.previous().value) if self.match(TokenType.NUMBER) else 0
+        self.consume(TokenType.SEMICOLON, f"Expected ';' after call statement")
+        return nodes.Call(name=func_name.value, location=func_name.location, args_passed=args_passed)
+
+    # statement keyword -> method parsing the rest of the statement, called once the keyword is consumed
+    statement_parsers = {
+        TokenType.VAR: parse_var_statement,
+        TokenType.RETURN: parse_return_statement,
+        TokenType.OPEN_BRACE: parse_compound_statement,
+        TokenType.IF: parse_if_statement,
+        TokenType.WHILE: parse_while_statement,
+        TokenType.BREAK: parse_break_statement,
+        TokenType.ASM: parse_asm_statement,
+        TokenType.SWITCH: parse_switch_statement,
+        TokenType.PUSH: parse_push_statement,
+        TokenType.POP: parse_pop_statement,
+        TokenType.CALL: parse_call_statement
+    }
 
     def parse_expression(self):
-        return self.parse_assign()
-
-    def parse_assign(self):
-        left = self.parse_bitwise()
+        left = self.parse_binary()
 
         while self.match(TokenType.EQUALS):
             equals_token = self.previous()
             if isinstance(left, nodes.Variable):
-                value = self.parse_assign()
+                value = self.parse_expression()
                 left = nodes.AssignVariable(name=left.name, location=left.location, value=value)
             elif isinstance(left, nodes.DereferencePointer):
-                value = self.parse_assign()
+                value = self.parse_expression()
                 left = nodes.SetAtPointer(pointer=left.pointer, offset=left.offset, value=value, location=left.location)
             elif isinstance(left, nodes.AccessStructMember):
-                value = self.parse_assign()
+                value = self.parse_expression()
                 left = nodes.WriteStructMember(struct_pointer=left.struct_pointer, name=left.name, value=value, location=left.location)
             elif isinstance(left, nodes.Register):
-                value = self.parse_assign()
+                value = self.parse_expression()
                 left = nodes.AssignRegister(name=left.name, value=value)
             else:
                 self.error(equals_token.location, "Invalid assignment target")
 
         return left
 
-    def parse_bitwise(self):
-        left = self.parse_or_and()
-
-        while self.match(TokenType.ARROW_UP, TokenType.PIPE, TokenType.AMPERSAND):
-            operation = self.previous().type
-            right = self.parse_or_and()
-            left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_or_and(self):
-        left = self.parse_equals()
-
-        while self.match(TokenType.AND, TokenType.OR, TokenType.PRECENT):
-            operation = self.previous().type
-            right = self.parse_equals()
-            left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_equals(self):
-        left = self.parse_greater()
-
-        while self.match(TokenType.DEQUALS, TokenType.NEQUALS):
-            operation = self.previous().type
-            right = self.parse_greater()
-
-            if isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
-                left = nodes.Number(value=int(left.value == right.value) if operation == TokenType.DEQUALS else int(left.value != right.value))
-            else:
-                left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_greater(self):
-        left = self.parse_greater_equals()
-
-        while self.match(TokenType.GREATER, TokenType.LOWER):
-            operation = self.previous().type
-            right = self.parse_greater_equals()
-
-            if isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
-                left = nodes.Number(value=int(left.value > right.value) if operation == TokenType.GREATER else int(left.value < right.value))
-            else:
-                left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_greater_equals(self):
-        left = self.parse_term()
-
-        while self.match(TokenType.GEQUALS, TokenType.LEQUALS):
-            operation = self.previous().type
-            right = self.parse_term()
-
-            if isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
-                left = nodes.Number(value=int(left.value >= right.value) if operation == TokenType.GEQUALS else int(left.value <= right.value))
-            else:
-                left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_term(self):
-        left = self.parse_factor()
-
-        while self.match(TokenType.PLUS, TokenType.MINUS):
-            operation = self.previous().type
-            right = self.parse_factor()
-
-            if isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
-                left = nodes.Number(value=left.value + right.value if operation == TokenType.PLUS else left.value - right.value)
-            else:
-                left = nodes.BinaryOperation(operation=operation, left=left, right=right)
-
-        return left
-
-    def parse_factor(self):
+    def parse_binary(self, min_precedence=1):
+        # precedence climbing, one call per operand instead of one per precedence level
         left = self.parse_call()
 
-        while self.match(TokenType.STAR, TokenType.SLASH):
-            operation = self.previous().type
-            right = self.parse_call()
+        while True:
+            operation = self.current.type
+            precedence = BINARY_PRECEDENCE.get(operation)
+            if precedence is None or precedence < min_precedence:
+                break
+
+            token = self.last = self.current
+            self.current = next(self.tokens, token)
+            right = self.parse_binary(precedence + 1)
 
-            if isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
-                left = nodes.Number(value=left.value * right.value if operation == TokenType.STAR else left.value // right.value)
+            fold = CONSTANT_FOLDS.get(operation)
+            if fold and isinstance(left, nodes.Number) and isinstance(right, nodes.Number):
+                left = nodes.Number(value=fold(left.value, right.value))
             else:
                 left = nodes.BinaryOperation(operation=operation, left=left, right=right)
 
@@ -622,16 +686,16 @@ class Parser:
 
         if self.match(TokenType.STAR):
             location = self.previous().location
-            value = self.parse_bitwise()
+            value = self.parse_binary()
             return nodes.DereferencePointer(pointer=value, offset=nodes.Number(0), location=location)
 
         if self.match(TokenType.BANG):
-            value = self.parse_bitwise()
+            value = self.parse_binary()
             return nodes.Negate(value=value)
 
         if self.match(TokenType.STAR):
             location = self.previous().location
-            value = self.parse_bitwise()
+            value = self.parse_binary()
             return nodes.DereferencePointer(pointer=value, offset=nodes.Number(value=0), location=location)
 
         if self.match(TokenType.TRUE): return nodes.Number(value=1)
@@ -771,15 +835,15 @@ class Parser:
             self.advance()
 
             while self.match(TokenType.STAR):
-                final_type = nodes.Type(id=nodes.TypeEnum.PTR, is_base_type=False, base_type=final_type)
+                final_type = nodes.pointer_type(final_type)
 
             return final_type
         
         type_id = TOKEN_VAR_TYPE[self.previous().type]
-        final_type = nodes.Type(id=type_id)
+        final_type = nodes.primitive_type(type_id)
 
         while self.match(TokenType.STAR):
-            final_type = nodes.Type(id=nodes.TypeEnum.PTR, is_base_type=False, base_type=final_type)
+            final_type = nodes.pointer_type(final_type)
 
         return final_type
 
@@ -789,35 +853,40 @@ class Parser:
 
         self.error(self.peek().location, error_msg or "Expected type")
 
+    # match, check, consume and advance run for nearly every token, they read self.current directly instead of going through peek
     def match(self, *types) -> bool:
-        for token_type in types:
-            if self.peek().type == token_type:
-                self.advance()
-                return True
+        if self.current.type in types:
+            token = self.last = self.current
+            self.current = next(self.tokens, token)
+            return True
 
         return False
 
     def check(self, type_) -> bool:
-        return self.peek().type == type_
+        return self.current.type == type_
 
     def consume(self, expected_type: str, error_msg: str) -> Token:
-        if self.peek().type == expected_type: return self.advance()
+        if self.current.type == expected_type:
+            token = self.last = self.current
+            self.current = next(self.tokens, token)
+            return token
 
         self.error(self.peek().location, error_msg)
 
     def previous(self) -> Token:
-        return self.tokens[self.pos - 1]
+        return self.last
 
     def advance(self) -> Token:
-        token = self.peek()
-        self.pos += 1
+        token = self.last = self.current
+        # the EOF token stays current once the input runs out
+        self.current = next(self.tokens, token)
         return token
 
     def peek(self) -> Token:
-        return self.tokens[self.pos]
+        return self.current
 
     def available(self) -> bool:
-        return self.peek().type != TokenType.EOF
+        return self.current.type != TokenType.EOF
 
     def error(self, location, error_msg):
         raise ParserError(error_msg, location)
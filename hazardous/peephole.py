@@ -0,0 +1,169 @@
+from typing import Callable, List, Optional, Tuple
+from .instructions import Instruction, Memory, Opcode, REGISTERS, is_register, reads_register
+
+
+# a rule gets a window of consecutive instructions and returns the replacement, or None if it doesn't apply
+PeepholeRule = Tuple[str, int, Callable[[List[Instruction]], Optional[List[Instruction]]]]
+
+
+def overwrites(instruction: Instruction, reg: str) -> bool:
+    # True if the instruction writes reg (a 64 bit register) without reading any part of it first
+    opcode, operands = instruction.opcode, instruction.operands
+
+    if opcode == Opcode.POP:
+        return operands == (reg,)
+
+    if opcode == Opcode.XOR and operands == (reg, reg):
+        return True
+
+    if opcode in (Opcode.MOV, Opcode.LEA, Opcode.MOVZX, Opcode.MOVSX) and operands[0] == reg:
+        return not reads_register(operands[1], reg)
+
+    return False
+
+
+def _push_pop_same(window):
+    # push rax / pop rax
+    first, second = window
+
+    if first.opcode == Opcode.PUSH and second.opcode == Opcode.POP and first.operands == second.operands:
+        return []
+
+
+def _push_pop_move(window):
+    # push rax / pop rcx -> mov rcx, rax
+    first, second = window
+
+    if first.opcode != Opcode.PUSH or second.opcode != Opcode.POP:
+        return None
+
+    (source,), (dest,) = first.operands, second.operands
+
+    if is_register(dest) and not isinstance(source, Memory):
+        return [Instruction(Opcode.MOV, (dest, source))]
+
+
+def _push_drop(window):
+    # push rax / add rsp, 8
+    first, second = window
+
+    if first.opcode == Opcode.PUSH and second.opcode == Opcode.ADD and second.operands == ('rsp', 8):
+        return []
+
+
+def _stack_adjust(window):
+    # add rsp, 32 / sub rsp, 32 between back to back calls
+    first, second = window
+
+    if first.opcode != Opcode.ADD or second.opcode != Opcode.SUB or first.operands[0] != 'rsp' or second.operands[0] != 'rsp':
+        return None
+
+    if not (isinstance(first.operands[1], int) and isinstance(second.operands[1], int)):
+        return None
+
+    diff = first.operands[1] - second.operands[1]
+
+    if diff == 0:
+        return []
+
+    return [Instruction(Opcode.ADD, ('rsp', diff))] if diff > 0 else [Instruction(Opcode.SUB, ('rsp', -diff))]
+
+
+def _forward_move(window):
+    # mov rax, 5 / mov rbx, rax / mov rax, 8 -> mov rbx, 5 / mov rax, 8
+    first, second, third = window
+
+    if second.opcode != Opcode.MOV or not is_register(second.operands[0]):
+        return None
+
+    dest, reg = second.operands
+
+    # reg has to be a full 64 bit register, partial writes don't kill the old value
+    if REGISTERS.get(reg) != reg or reg == dest or not overwrites(third, reg):
+        return None
+
+    if first.opcode == Opcode.XOR and first.operands == (reg, reg):
+        return [Instruction(Opcode.MOV, (dest, 0)), third]
+
+    if first.opcode == Opcode.MOV and first.operands[0] == reg:
+        return [Instruction(Opcode.MOV, (dest, first.operands[1])), third]
+
+
+def _move_back(window):
+    # mov r10, rax / mov rax, r10
+    first, second = window
+
+    if first.opcode == second.opcode == Opcode.MOV and is_register(first.operands[0]) and is_register(first.operands[1]) and second.operands == first.operands[::-1]:
+        return [first]
+
+
+def _self_move(window):
+    (instruction,) = window
+
+    if instruction.opcode == Opcode.MOV and instruction.operands[0] == instruction.operands[1] and is_register(instruction.operands[0]):
+        return []
+
+
+def _jump_to_next(window):
+    # jmp .L1 / .L1:
+    first, second = window
+
+    if first.opcode == Opcode.JMP and second.opcode == Opcode.LABEL and first.operands == second.operands:
+        return [second]
+
+
+PEEPHOLE_RULES: List[PeepholeRule] = [
+    ('push_pop_same', 2, _push_pop_same),
+    ('push_pop_move', 2, _push_pop_move),
+    ('push_drop', 2, _push_drop),
+    ('stack_adjust', 2, _stack_adjust),
+    ('forward_move', 3, _forward_move),
+    ('move_back', 2, _move_back),
+    ('self_move', 1, _self_move),
+    ('jump_to_next', 2, _jump_to_next)
+]
+
+
+class PeepholeOptimizer:
+    def __init__(self, rules: List[PeepholeRule] = None):
+        self.rules = list(PEEPHOLE_RULES if rules is None else rules)
+        self.removed = {name: 0 for name, _, _ in self.rules}
+
+    def add_rule(self, name: str, size: int, rule: Callable[[List[Instruction]], Optional[List[Instruction]]]):
+        self.rules.append((name, size, rule))
+        self.removed.setdefault(name, 0)
+
+    def optimize(self, body: List[Instruction]) -> List[Instruction]:
+        body = list(body)
+        changed = True
+
+        # keep going until no rule applies anymore
+        while changed:
+            changed = False
+            i = 0
+
+            while i < len(body):
+                for name, size, rule in self.rules:
+                    window = body[i:i + size]
+
+                    if len(window) < size:
+                        continue
+
+                    replacement = rule(window)
+
+                    if replacement is None:
+                        continue
+
+                    body[i:i + size] = replacement
+                    self.removed[name] += size - len(replacement)
+                    changed = True
+                    # a replacement can complete a pattern that started a few lines earlier
+                    i = max(i - 2, 0)
+                    break
+                else:
+                    i += 1
+
+        return body
+
+    def total_removed(self) -> int:
+        return sum(self.removed.values())
@@ -1,8 +1,22 @@
-from typing import List, final
-from .scanner import Token, TokenType, TokenLocation, Scanner
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, final
+from .scanner import Scanner, SourceFile, Token, TokenType, TokenLocation
+from .cache import IncludeResolver, TokenCache
+
+
+@dataclass
+class Macro:
+    args: List[str]
+    # body tokens, with argument slots replaced by the index of the argument
+    template: list
 
 
 class Preprocessor:
+    def __init__(self, cache: TokenCache = None):
+        # included files are scanned through the cache, without a directory it only lives in memory
+        self.cache = cache or TokenCache()
+
     def match(self, *types) -> bool:
         for token_type in types:
             if self.peek().type == token_type:
@@ -20,12 +34,13 @@ class Preprocessor:
         self.error(self.peek().location, error_msg)
 
     def advance(self) -> Token:
-        token = self.peek()
-        self.pos += 1
+        token = self.current
+        # the EOF token stays current once the input runs out
+        self.current = next(self.tokens, token)
         return token
 
     def peek(self) -> Token:
-        return self.tokens[self.pos]
+        return self.current
 
     def available(self) -> bool:
         return self.peek().type != TokenType.EOF
@@ -34,15 +49,62 @@ class Preprocessor:
         raise PreprocessorError(error_msg, location)
 
 
-    def preprocess(self, tokens: List[Token], include_dirs: list, setup = True):
-        self.tokens = tokens
-        self.pos = 0
-        if setup:
-            self.macros = {}
-            self.included = []
-        new_tokens = []
+    def push(self, tokens: Iterable[Token], path: Optional[str]):
+        # included files and macro bodies are read on top of the current input, up to their EOF
+        self.inputs.append((self.tokens, self.current, self.path))
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens)
+        self.path = path
+
+    def pop(self):
+        self.tokens, self.current, self.path = self.inputs.pop()
+
+    def preprocess(self, tokens: Iterable[Token], include_dirs: list, path: str = None, defines: Dict[str, str] = None) -> List[Token]:
+        return list(self.stream(tokens, include_dirs, path, defines))
+
+    def stream(self, tokens: Iterable[Token], include_dirs: list, path: str = None, defines: Dict[str, str] = None) -> Iterator[Token]:
+        # reads tokens as they're needed and yields the output the same way, ending with the EOF token
+        # path is the file the tokens come from, it's the root of the include graph
+        # defines are macros given from outside (-D NAME=VALUE), their values are scanned as code
+        self.tokens = iter(tokens)
+        self.current = next(self.tokens)
+        self.path = os.path.realpath(path) if path else None
+        # (tokens, current, path) of the inputs below the one being read
+        self.inputs = []
+        # real path -> real paths of the files it includes
+        self.dependencies: Dict[Optional[str], List[str]] = {self.path: []}
+        self.macros: Dict[str, Macro] = {}
+        # (%ifdef/%ifndef token, input depth, in the %else part) of every open conditional block
+        self.conditions = []
+        # real paths of the files included so far, each one is only included once
+        self.included = set()
+        self.resolver = IncludeResolver(include_dirs)
+        # real path -> the source its tokens point into
+        self.sources: Dict[Optional[str], SourceFile] = {self.path: self.current.source}
+
+        for name, value in (defines or {}).items():
+            scanner = Scanner()
+            scanner.input(value, "<command line>")
+            self.macros[name] = Macro(args=[], template=list(scanner.tokens())[:-1])
+
+        yield from self.run(0)
+        yield self.peek()
+
+    def run(self, depth: int) -> Iterator[Token]:
+        # preprocesses until the input at depth runs out, the ones pushed on top of it are popped at their EOF
+        while True:
+            if not self.available():
+                # a conditional block can't be closed by another file
+                if self.conditions and self.conditions[-1][1] == len(self.inputs):
+                    start = self.conditions[-1][0]
+                    self.error(start.location, f"Unterminated '{start.value}'")
+
+                if len(self.inputs) > depth:
+                    self.pop()
+                    continue
+
+                return
 
-        while self.available():
             token = self.advance()
 
             if token.type == TokenType.DEFINE:
@@ -75,107 +137,151 @@ class Preprocessor:
                 if len(macro_tokens) == 0:
                     raise PreprocessorError("Wtf?", token.location)
 
-                preprocessor = Preprocessor()
-                preprocessor.macros = self.macros
-                preprocessor.included = self.included
-                macro_tokens.append(Token(type=TokenType.EOF, value=None, location=macro_tokens[-1].location))
-                
-                preprocessed = preprocessor.preprocess(macro_tokens, include_dirs, setup=False)
+                # the body is expanded once, here, with the macros defined so far
+                macro_tokens.append(Token(TokenType.EOF, macro_tokens[-1].source, macro_tokens[-1].start, macro_tokens[-1].start))
+                self.push(macro_tokens, self.path)
+                body = list(self.run(len(self.inputs)))
+                self.pop()
 
-                self.macros[name.value] = {
-                    "tokens": preprocessed[:-1],
-                    "args": macro_args
-                }
+                self.macros[name.value] = Macro(args=macro_args, template=self.compile_template(body, macro_args))
 
             elif token.type == TokenType.INCLUDE:
                 file = self.consume(TokenType.STRING, "Expected file name")
-                scanner = Scanner()
-                preprocessor = Preprocessor()
-                preprocessor.macros = self.macros
-                preprocessor.included = self.included
                 file_name = file.value[1:-1]
-                code = None
+                found = self.resolver.resolve(file_name)
+
+                if found is None:
+                    self.error(token.location, f"File '{file_name}' not found")
+
+                includes = self.dependencies[self.path]
+
+                if found not in includes:
+                    includes.append(found)
+
+                if found not in self.included:
+                    self.included.add(found)
+                    self.dependencies.setdefault(found, [])
+                    tokens = self.cache.load(found, file_name)
+                    self.sources[found] = tokens.source
+                    self.push(tokens, found)
+
+            elif token.type in (TokenType.IFDEF, TokenType.IFNDEF):
+                name = self.consume(TokenType.IDENTIFIER, f"Expected macro name after '{token.value}'")
 
-                if file_name not in self.included:
-                    for path in include_dirs:
-                        try:
-                            f = open(path + file_name, "r")
-                            code = f.read()
-                            f.close()
-                        except FileNotFoundError:
-                            pass
+                if (name.value in self.macros) == (token.type == TokenType.IFDEF):
+                    self.conditions.append((token, len(self.inputs), False))
+                elif self.skip_block(token).type == TokenType.ELSE_DIRECTIVE:
+                    self.conditions.append((token, len(self.inputs), True))
 
-                    if not code:
-                        self.error(token.location, f"File '{file_name}' not found")
+            elif token.type == TokenType.ELSE_DIRECTIVE:
+                start = self.close_condition(token)
 
-                    self.included.append(file_name)
+                # the first part was used, everything up to the %endif goes
+                end = self.skip_block(start)
 
-                    scanner.input(code, file_name)
-                    preprocessed = preprocessor.preprocess(list(scanner.tokens()), include_dirs, setup=False)
-                    new_tokens.extend(preprocessed[:-1])
+                if end.type == TokenType.ELSE_DIRECTIVE:
+                    self.error(end.location, f"Duplicate '%else' for '{start.value}'")
+
+            elif token.type == TokenType.ENDIF:
+                self.close_condition(token)
 
             elif token.type == TokenType.IDENTIFIER:
-                expanded = self.expand_token(token)
-                new_tokens.extend(expanded)
+                yield from self.expand_token(token)
 
             else:
-                new_tokens.append(token)
+                yield token
+
+    def close_condition(self, token: Token) -> Token:
+        if not self.conditions or self.conditions[-1][1] != len(self.inputs):
+            self.error(token.location, f"'{token.value}' without '%ifdef' or '%ifndef'")
+
+        start, _, in_else = self.conditions.pop()
+
+        if in_else and token.type == TokenType.ELSE_DIRECTIVE:
+            self.error(token.location, f"Duplicate '%else' for '{start.value}'")
+
+        return start
+
+    def skip_block(self, start: Token) -> Token:
+        # skips to the %else or %endif of the block, blocks nested in it are skipped whole
+        nesting = 0
+
+        while self.available():
+            token = self.advance()
+
+            if token.type in (TokenType.IFDEF, TokenType.IFNDEF):
+                nesting += 1
+            elif token.type == TokenType.ENDIF:
+                if nesting == 0:
+                    return token
+
+                nesting -= 1
+            elif token.type == TokenType.ELSE_DIRECTIVE and nesting == 0:
+                return token
+
+        self.error(start.location, f"Unterminated '{start.value}'")
+
+    @staticmethod
+    def compile_template(body: List[Token], args: List[str]) -> list:
+        # argument names become their index, the first one wins when a name is repeated
+        slots = {}
 
-        new_tokens.append(tokens[-1])
-        return new_tokens
+        for i, arg in enumerate(args):
+            slots.setdefault(arg, i)
+
+        return [slots.get(token.value, token) if token.type == TokenType.IDENTIFIER else token for token in body]
 
     def expand_token(self, token: Token):
-        if token.value in self.macros:
-            if len(self.macros[token.value]['args']) > 0:
-                args = []
-                cur_arg = None
-                arg_id = 0
-                macro_tokens = self.macros[token.value]['tokens']
+        macro = self.macros.get(token.value)
 
-                if self.match(TokenType.OPEN_PAREN):
-                    opens = 1
-                    if not self.check(TokenType.CLOSE_PAREN):
-                        while True:
-                            cur_arg = []
-                            while not self.check(TokenType.COMMA) and self.available() and opens > 0:
-                                tok = self.advance()
-                                if tok.type == TokenType.OPEN_PAREN: opens += 1
-                                if tok.type == TokenType.CLOSE_PAREN: opens -= 1
-                                if opens == 0: break
-                                if tok.type == TokenType.IDENTIFIER:
-                                    expanded = self.expand_token(tok)
-                                    cur_arg.extend(expanded)
-                                else:
-                                    cur_arg.append(tok)
-                            args.append(cur_arg)
-                            arg_id += 1
-                            if arg_id >= len(macro_tokens):
-                                self.error(token.location, "Too many arguments passed to macro")
-
-                            if not self.match(TokenType.COMMA): break
-
-                    if opens > 0:
-                        self.error(token.location, "Unclosed macro arguments")
-                    #self.consume(TokenType.CLOSE_PAREN, "Expected ')' for macro")
-
-                final_tokens = []
-
-                for macro_token in macro_tokens:
-                    if macro_token.type == TokenType.IDENTIFIER and macro_token.value in self.macros[token.value]['args']:
-                        idx = self.macros[token.value]['args'].index(macro_token.value)
-                        final_tokens.extend(args[idx])
-                        #print(args[idx])
-                    else:
-                        #print(macro_token)
-                        final_tokens.append(macro_token)
-
-                #print(final_tokens)
-                return final_tokens
-            else:
-                return self.macros[token.value]['tokens']
-        else:
+        if macro is None:
             return [token]
 
+        if not macro.args:
+            return macro.template
+
+        args = []
+        cur_arg = None
+        arg_id = 0
+
+        if self.match(TokenType.OPEN_PAREN):
+            opens = 1
+            if not self.check(TokenType.CLOSE_PAREN):
+                while True:
+                    cur_arg = []
+                    while not self.check(TokenType.COMMA) and self.available() and opens > 0:
+                        tok = self.advance()
+                        if tok.type == TokenType.OPEN_PAREN: opens += 1
+                        if tok.type == TokenType.CLOSE_PAREN: opens -= 1
+                        if opens == 0: break
+                        if tok.type == TokenType.IDENTIFIER:
+                            expanded = self.expand_token(tok)
+                            cur_arg.extend(expanded)
+                        else:
+                            cur_arg.append(tok)
+                    args.append(cur_arg)
+                    arg_id += 1
+                    if arg_id >= len(macro.template):
+                        self.error(token.location, "Too many arguments passed to macro")
+
+                    if not self.match(TokenType.COMMA): break
+
+            if opens > 0:
+                self.error(token.location, "Unclosed macro arguments")
+
+        final_tokens = []
+
+        for item in macro.template:
+            if type(item) is int:
+                if item >= len(args):
+                    self.error(token.location, "Not enough arguments passed to macro")
+
+                final_tokens.extend(args[item])
+            else:
+                final_tokens.append(item)
+
+        return final_tokens
+
 
 class PreprocessorError(Exception):
     def __init__(self, msg, location: TokenLocation) -> None:
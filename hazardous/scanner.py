@@ -1,6 +1,8 @@
 import re
+import string
+from array import array
+from bisect import bisect_right
 from enum import IntEnum, auto
-from dataclasses import dataclass
 from typing import Iterator, Tuple
 
 
@@ -84,18 +86,119 @@ class TokenType(IntEnum):
 
     DEFINE = auto()
     INCLUDE = auto()
+    IFDEF = auto()
+    IFNDEF = auto()
+    ELSE_DIRECTIVE = auto()
+    ENDIF = auto()
 
     REGISTER = auto()
 
     EOF = auto()
 
-TokenLocation = Tuple[str, int, int]
+class SourceFile:
+    __slots__ = ('name', 'code', '_line_starts')
+
+    def __init__(self, name: str, code: str):
+        self.name = name
+        self.code = code
+        # offsets of the first character of every line, only built once a location is needed
+        self._line_starts = None
+
+    def position(self, offset: int) -> Tuple[str, int, int]:
+        if self._line_starts is None:
+            self._line_starts = array('L', [0])
+            self._line_starts.extend(m.end() for m in re.finditer('\n', self.code))
+
+        row = bisect_right(self._line_starts, offset)
+        return (self.name, row, offset - self._line_starts[row - 1] + 1)
+
+
+class TokenLocation:
+    # (file, row, col) of an offset into a source file, worked out when it's read (usually only for errors)
+    __slots__ = ('source', 'offset')
+
+    def __init__(self, source: SourceFile, offset: int):
+        self.source = source
+        self.offset = offset
+
+    def resolve(self) -> Tuple[str, int, int]:
+        return self.source.position(self.offset)
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __getitem__(self, index):
+        return self.resolve()[index]
+
+    def __len__(self) -> int:
+        return 3
+
+    def __add__(self, other: tuple) -> tuple:
+        return self.resolve() + other
+
+    def __eq__(self, other) -> bool:
+        return tuple(self) == tuple(other)
+
+    def __hash__(self) -> int:
+        return hash(self.resolve())
+
+    def __repr__(self) -> str:
+        return repr(self.resolve())
+
 
-@dataclass
 class Token:
-    type: TokenType
-    value: any
-    location: TokenLocation
+    # a view into the source, the value is sliced out of it when asked for
+    __slots__ = ('type', 'source', 'start', 'end')
+
+    def __init__(self, type: TokenType, source: SourceFile, start: int, end: int):
+        self.type = type
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self) -> str:
+        return self.source.code[self.start:self.end] if self.type != TokenType.EOF else None
+
+    @property
+    def location(self) -> TokenLocation:
+        return TokenLocation(self.source, self.start)
+
+    def __repr__(self) -> str:
+        return f"Token(type={self.type!r}, value={self.value!r}, location={self.location!r})"
+
+
+class TokenStore:
+    # every token of a file as parallel arrays, Token objects are only made while iterating
+    __slots__ = ('source', 'types', 'starts', 'lengths')
+
+    def __init__(self, source: SourceFile):
+        self.source = source
+        self.types = array('B')
+        self.starts = array('L')
+        self.lengths = array('L')
+
+    def append(self, token_type: TokenType, start: int, end: int):
+        self.types.append(token_type)
+        self.starts.append(start)
+        self.lengths.append(end - start)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        start = self.starts[index]
+        return Token(TokenType(self.types[index]), self.source, start, start + self.lengths[index])
+
+    def __iter__(self) -> Iterator[Token]:
+        source = self.source
+
+        for token_type, start, length in zip(self.types, self.starts, self.lengths):
+            yield Token(TOKEN_TYPES[token_type], source, start, start + length)
+
+
+# TokenType(n) is slow, the store indexes this instead
+TOKEN_TYPES = [None] + list(TokenType)
 
 
 class ScannerError(Exception):
@@ -110,160 +213,230 @@ class ScannerError(Exception):
         return "%s:%d:%d: [ERROR]: %s" % (self.location + (self.msg,))
 
 
+# words that aren't identifiers, looked up after an identifier has been matched
+KEYWORDS = {
+    'or':       TokenType.OR,
+    'and':      TokenType.AND,
+
+    'u8':       TokenType.U8,
+    'u16':      TokenType.U16,
+    'u32':      TokenType.U32,
+    'u64':      TokenType.U64,
+    'i8':       TokenType.I8,
+    'i16':      TokenType.I16,
+    'i32':      TokenType.I32,
+    'i64':      TokenType.I64,
+    'ptr':      TokenType.PTR,
+    'proc':     TokenType.PROC,
+    'struct':   TokenType.STRUCT,
+    'class':    TokenType.CLASS,
+    'enum':     TokenType.ENUM,
+
+    'local':    TokenType.LOCAL,
+    'break':    TokenType.BREAK,
+    'external': TokenType.EXTERNAL,
+    'return':   TokenType.RETURN,
+    'new':      TokenType.NEW,
+    'true':     TokenType.TRUE,
+    'false':    TokenType.FALSE,
+    'while':    TokenType.WHILE,
+    'if':       TokenType.IF,
+    'else':     TokenType.ELSE,
+    'var':      TokenType.VAR,
+    'stdcall':  TokenType.STDCALL,
+    'res':      TokenType.RES,
+    'switch':   TokenType.SWITCH,
+    'case':     TokenType.CASE,
+    'default':  TokenType.DEFAULT,
+    'push':     TokenType.PUSH,
+    'pop':      TokenType.POP,
+    'drop':     TokenType.POP,
+    'call':     TokenType.CALL,
+    'asm':      TokenType.ASM,
+    'sizeof':   TokenType.SIZEOF,
+}
+
+# everything starting with '%' that isn't just PRECENT
+DIRECTIVES = {
+    '%define':  TokenType.DEFINE,
+    '%include': TokenType.INCLUDE,
+    '%ifdef':   TokenType.IFDEF,
+    '%ifndef':  TokenType.IFNDEF,
+    '%else':    TokenType.ELSE_DIRECTIVE,
+    '%endif':   TokenType.ENDIF,
+    **{'%' + register: TokenType.REGISTER for register in (
+        'rsp', 'rbp', 'rax', 'rbx', 'rcx', 'rdx', 'rdi', 'rsi',
+        'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15', 'r16'
+    )}
+}
+
+# characters that can only ever be one token
+SINGLE_CHARACTERS = {
+    '*': TokenType.STAR,
+    '+': TokenType.PLUS,
+    '(': TokenType.OPEN_PAREN,
+    ')': TokenType.CLOSE_PAREN,
+    '[': TokenType.OPEN_SQUARE,
+    ']': TokenType.CLOSE_SQUARE,
+    '{': TokenType.OPEN_BRACE,
+    '}': TokenType.CLOSE_BRACE,
+    ',': TokenType.COMMA,
+    ';': TokenType.SEMICOLON,
+    ':': TokenType.COLON,
+    '^': TokenType.ARROW_UP,
+    '?': TokenType.QUESTION_MARK,
+}
+
+# characters that start more than one token, longest first
+OPERATORS = {
+    '-': (('->', TokenType.POINTER_ARROW), ('-', TokenType.MINUS)),
+    '.': (('...', TokenType.VARARGS), ('.', TokenType.DOT)),
+    '|': (('||', TokenType.OR), ('|', TokenType.PIPE)),
+    '&': (('&&', TokenType.AND), ('&', TokenType.AMPERSAND)),
+    '!': (('!=', TokenType.NEQUALS), ('!', TokenType.BANG)),
+    '=': (('==', TokenType.DEQUALS), ('=', TokenType.EQUALS)),
+    '>': (('>=', TokenType.GEQUALS), ('>', TokenType.GREATER)),
+    '<': (('<=', TokenType.LEQUALS), ('<', TokenType.LOWER)),
+}
+
+# identifiers that can start a string literal (u"...", br"...")
+STRING_PREFIXES = {'u', 'b', 'f', 'r', 'ur', 'br', 'fr'}
+
+
 class Scanner:
     ws_skip = re.compile(r'[^\t\r ]')
 
-    token_definitions = {
-        'NEWLINE':                     r'\n',
-        'IGNORE':                      r'\/\/.*',
-        TokenType.NUMBER:              r'\d+',
-
-        TokenType.STAR:                r'\*',
-        TokenType.PLUS:                r'\+',
-        TokenType.POINTER_ARROW:       r'->',
-        TokenType.MINUS:               r'-',
-        TokenType.SLASH:               r'\/',
-        TokenType.OPEN_PAREN:          r'\(',
-        TokenType.CLOSE_PAREN:         r'\)',
-        TokenType.OPEN_SQUARE:         r'\[',
-        TokenType.CLOSE_SQUARE:        r'\]',
-        TokenType.OPEN_BRACE:          r'{',
-        TokenType.CLOSE_BRACE:         r'}',
-        TokenType.COMMA:               r',',
-        TokenType.VARARGS:             r'\.\.\.',
-        TokenType.DOT:                 r'\.',
-        TokenType.SEMICOLON:           r';',
-        TokenType.COLON:               r':',
-        TokenType.OR:                  r'\|\||\bor\b',
-        TokenType.AND:                 r'&&|\band\b',
-        TokenType.ARROW_UP:            r'\^',
-        TokenType.PIPE:                r'\|',
-        TokenType.AMPERSAND:           r'&',
-        TokenType.NEQUALS:             r'!=',
-        TokenType.BANG:                r'!',
-        TokenType.QUESTION_MARK:       r'\?',
-        TokenType.DEQUALS:             r'==',
-        TokenType.EQUALS:              r'=',
-        TokenType.GEQUALS:             r'>=',
-        TokenType.GREATER:             r'>',
-        TokenType.LEQUALS:             r'<=',
-        TokenType.LOWER:               r'<',
-
-        TokenType.U8:                  r'\bu8\b',
-        TokenType.U16:                 r'\bu16\b',
-        TokenType.U32:                 r'\bu32\b',
-        TokenType.U64:                 r'\bu64\b',
-        TokenType.I8:                  r'\bi8\b',
-        TokenType.I16:                 r'\bi16\b',
-        TokenType.I32:                 r'\bi32\b',
-        TokenType.I64:                 r'\bi64\b',
-        TokenType.PTR:                 r'\bptr\b',
-        TokenType.PROC:                r'\bproc\b',
-        TokenType.STRUCT:              r'\bstruct\b',
-        TokenType.CLASS:               r'\bclass\b',
-        TokenType.ENUM:                r'\benum\b',
-
-        TokenType.LOCAL:               r'\blocal\b',
-        TokenType.BREAK:               r'\bbreak\b',
-        TokenType.EXTERNAL:            r'\bexternal\b',
-        TokenType.RETURN:              r'\breturn\b',
-        TokenType.NEW:                 r'\bnew\b',
-        TokenType.TRUE:                r'\btrue\b',
-        TokenType.FALSE:               r'\bfalse\b',
-        TokenType.WHILE:               r'\bwhile\b',
-        TokenType.IF:                  r'\bif\b',
-        TokenType.ELSE:                r'\belse\b',
-        TokenType.VAR:                 r'\bvar\b',
-        TokenType.STDCALL:             r'\bstdcall\b',
-        TokenType.RES:                 r'\bres\b',
-        TokenType.SWITCH:              r'\bswitch\b',
-        TokenType.CASE:                r'\bcase\b',
-        TokenType.DEFAULT:             r'\bdefault\b',
-        # TokenType.HERE:                r'\bhere\b',
-        TokenType.PUSH:                r'\bpush\b',
-        TokenType.POP:                 r'\bpop\b|\bdrop\b',
-        TokenType.CALL:                r'\bcall\b',
-        TokenType.ASM:                r'\basm\b',
-        # TokenType.DUP:                 r'\bdup\b',
-        # TokenType.SWAP:                r'\bswap\b',
-        # TokenType.OVER:                r'\bover\b',
-        # TokenType.RET:                 r'\bret\b',
-        # TokenType.SUB:                 r'\bsub\b',
-        # TokenType.MUL:                 r'\bmul\b',
-        # TokenType.ADD:                 r'\badd\b',
-        # TokenType.DIVMOD:              r'\bdivmod\b',
-        
-        # TokenType.STACK_PTR:           r'%sp\b',
-        TokenType.REGISTER:            r'%rsp\b|%rbp\b|%rax\b|%rbx\b|%rcx\b|%rdx\b|%rdi\b|%rsi\b|%r8\b|%r9\b|%r10\b|%r11\b|%r12\b|%r13\b|%r14\b|%r15\b|%r16\b',
-        TokenType.DEFINE:              r'%define\b',
-        TokenType.INCLUDE:             r'%include\b',
-        TokenType.PRECENT:             r'%',
-        TokenType.SIZEOF:              r'\bsizeof\b',
-
-        TokenType.STRING:              r'[ubf]?r?("(?!"").*?(?<!\\)(\\\\)*?")',
-        TokenType.CHAR:                 r"'\\0'|'\\n'|'\\r'|'\\''|'\\t'|'\\\\'|'[ -&(-~]'",
-        TokenType.IDENTIFIER:          r'[a-zA-Z_][a-zA-Z0-9_]*'
-    }
-
-    master_regex = re.compile('|'.join(
-        f"(?P<G{name}>{pattern})" for name, pattern in token_definitions.items()
-    ))
+    identifier_regex = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')
+    number_regex = re.compile(r'\d+')
+    directive_regex = re.compile(r'%\w*')
+    string_regex = re.compile(r'[ubf]?r?("(?!"").*?(?<!\\)(\\\\)*?")')
+    char_regex = re.compile(r"'\\0'|'\\n'|'\\r'|'\\''|'\\t'|'\\\\'|'[ -&(-~]'")
 
     def input(self, code: str, file: str) -> None:
+        self.source = SourceFile(file, code)
         self.buffer = code
         self.pos = 0
-        self.col = 1
-        self.row = 1
-        self.file = file
 
-    def next_token(self) -> Token:
-        # if position is at end, no more tokens
-        if self.pos >= len(self.buffer):
-            return None
+    def spans(self) -> Iterator[Tuple[TokenType, int, int]]:
+        # (type, start, end) of every token, ending with EOF
+        buffer = self.buffer
+
+        while True:
+            # Find first non whitespace character
+            m = self.ws_skip.search(buffer, self.pos)
 
-        # Find first non whitespace character
-        m = self.ws_skip.search(self.buffer, self.pos)
+            if m is None:
+                # this means we didn't find a character meaning we're at the end
+                yield TokenType.EOF, self.pos, self.pos
+                return
 
-        if m:
-            old_pos = self.pos
             self.pos = m.start()
-            self.col += self.pos - old_pos
-        else:
-            # this means we didn't find a character meaning we're at the end
-            return None
-
-        # match against main regex
-        m = self.master_regex.match(self.buffer, self.pos)
+            char = buffer[self.pos]
 
-        if m:
-            token_type = m.lastgroup
+            if char == '\n':
+                self.pos += 1
+                continue
 
-            if token_type == 'GIGNORE':
-                self.pos = m.end()
-                return self.next_token()
+            token_type = SINGLE_CHARACTERS.get(char)
 
-            elif token_type == 'GNEWLINE':
-                self.row += 1
-                self.col = 1
-                self.pos = m.end()
-                return self.next_token()
+            if token_type is not None:
+                end = self.pos + 1
+            else:
+                scan = self.first_characters.get(char)
 
-            string_repr = m.string[m.start():m.end()]
-            token = Token(type= TokenType(int(token_type[1:])), value=string_repr, location=(self.file, self.row, self.col))
+                if scan is None:
+                    raise ScannerError(f"Unexpected character '{char}'", TokenLocation(self.source, self.pos))
 
-            old_pos = self.pos
-            self.pos = m.end()
+                token_type, end = scan(self, self.pos)
 
-            self.col += self.pos - old_pos
-            return token
+                if token_type is None:
+                    # comment, the newline is left for the next iteration
+                    self.pos = end
+                    continue
 
-        raise ScannerError(f"Unexpected character '{self.buffer[self.pos]}'", (self.file, self.row, self.col))
+            yield token_type, self.pos, end
+            self.pos = end
 
     def tokens(self) -> Iterator[Token]:
-        # custom iterator
-        while True:
-            tok = self.next_token()
-            if tok is None:
-                yield Token(type=TokenType.EOF, value=None, location=(self.file, self.row, self.col))
-                break
-            yield tok
\ No newline at end of file
+        # tokens are produced as they're consumed, the whole file is never held as a list
+        source = self.source
+
+        for token_type, start, end in self.spans():
+            yield Token(token_type, source, start, end)
+
+    def scan(self) -> TokenStore:
+        store = TokenStore(self.source)
+
+        for token_type, start, end in self.spans():
+            store.append(token_type, start, end)
+
+        return store
+
+    def _scan_identifier(self, pos: int):
+        end = self.identifier_regex.match(self.buffer, pos).end()
+        word = self.buffer[pos:end]
+
+        if word in STRING_PREFIXES and self.buffer.startswith('"', end):
+            m = self.string_regex.match(self.buffer, pos)
+
+            if m:
+                return TokenType.STRING, m.end()
+
+        token_type = KEYWORDS.get(word)
+
+        # a keyword glued to a number (1if) has no word boundary in front, it stays an identifier
+        if token_type is None or (pos and self.buffer[pos - 1].isdigit()):
+            return TokenType.IDENTIFIER, end
+
+        return token_type, end
+
+    def _scan_number(self, pos: int):
+        return TokenType.NUMBER, self.number_regex.match(self.buffer, pos).end()
+
+    def _scan_operator(self, pos: int):
+        for text, token_type in OPERATORS[self.buffer[pos]]:
+            if self.buffer.startswith(text, pos):
+                return token_type, pos + len(text)
+
+    def _scan_slash(self, pos: int):
+        if self.buffer.startswith('//', pos):
+            end = self.buffer.find('\n', pos)
+            return None, end if end != -1 else len(self.buffer)
+
+        return TokenType.SLASH, pos + 1
+
+    def _scan_directive(self, pos: int):
+        end = self.directive_regex.match(self.buffer, pos).end()
+        token_type = DIRECTIVES.get(self.buffer[pos:end])
+
+        if token_type is None:
+            return TokenType.PRECENT, pos + 1
+
+        return token_type, end
+
+    def _scan_string(self, pos: int):
+        m = self.string_regex.match(self.buffer, pos)
+
+        if m is None:
+            raise ScannerError(f"Unexpected character '{self.buffer[pos]}'", TokenLocation(self.source, pos))
+
+        return TokenType.STRING, m.end()
+
+    def _scan_char(self, pos: int):
+        m = self.char_regex.match(self.buffer, pos)
+
+        if m is None:
+            raise ScannerError(f"Unexpected character '{self.buffer[pos]}'", TokenLocation(self.source, pos))
+
+        return TokenType.CHAR, m.end()
+
+    # every character that can start a token other than SINGLE_CHARACTERS, mapped to the method that scans it
+    first_characters = {
+        **dict.fromkeys(string.ascii_letters + '_', _scan_identifier),
+        **dict.fromkeys(string.digits, _scan_number),
+        **dict.fromkeys(OPERATORS, _scan_operator),
+        '/': _scan_slash,
+        '%': _scan_directive,
+        '"': _scan_string,
+        "'": _scan_char,
+    }
@@ -0,0 +1,86 @@
+import sys
+from dataclasses import dataclass
+from typing import List, Tuple
+
+
+@dataclass
+class Target:
+    name: str
+    # fasm output format and section headers
+    format: str
+    text_section: str
+    data_section: str
+    footer: str
+    object_extension: str
+    executable_extension: str
+    # objects can be written by ElfWriter, without going through fasm
+    elf_objects: bool
+    # calling convention
+    argument_registers: Tuple[str, ...]
+    callee_saved_registers: Tuple[str, ...]
+    shadow_space: int
+    # varargs callees expect the number of vector registers used in al
+    varargs_vector_count: bool
+    # {object} and {output} get replaced with the file names
+    link_command: List[str]
+
+    def link_arguments(self, object_path: str, output_path: str) -> List[str]:
+        return [arg.format(object=object_path, output=output_path) for arg in self.link_command]
+
+
+WINDOWS_X64 = Target(
+    name="windows",
+    format="MS64 COFF",
+    text_section="section '.text' readable executable",
+    data_section="section '.data' readable writeable",
+    footer="",
+    object_extension=".obj",
+    executable_extension=".exe",
+    elf_objects=False,
+    argument_registers=('rcx', 'rdx', 'r8', 'r9'),
+    callee_saved_registers=('rbx', 'rsi', 'rdi', 'r12', 'r13', 'r14', 'r15'),
+    shadow_space=32,
+    varargs_vector_count=False,
+    link_command=["gcc", "-m64", "-g", "{object}", "-o", "{output}"]
+)
+
+LINUX_X64 = Target(
+    name="linux",
+    format="ELF64",
+    text_section="section '.text' executable",
+    data_section="section '.data' writeable",
+    footer="section '.note.GNU-stack'\n",
+    object_extension=".o",
+    executable_extension="",
+    elf_objects=True,
+    argument_registers=('rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9'),
+    callee_saved_registers=('rbx', 'r12', 'r13', 'r14', 'r15'),
+    shadow_space=0,
+    varargs_vector_count=True,
+    # the output uses absolute addresses, so it can't be position independent
+    link_command=["gcc", "-no-pie", "-g", "{object}", "-o", "{output}"]
+)
+
+TARGETS = {target.name: target for target in (WINDOWS_X64, LINUX_X64)}
+
+
+def host_target() -> Target:
+    # only platforms whose calling convention and object format match a target, anything else has to pick one
+    if sys.platform in ('win32', 'cygwin'):
+        return WINDOWS_X64
+
+    if sys.platform.startswith('linux'):
+        return LINUX_X64
+
+    raise TargetError(f"No target matches this platform ({sys.platform}), pick one with --target ({', '.join(TARGETS)})")
+
+
+class TargetError(Exception):
+    def __init__(self, msg) -> None:
+        self.msg = msg
+
+    def __repr__(self) -> str:
+        return "[ERROR]: %s" % self.msg
+
+    def __str__(self) -> str:
+        return "[ERROR]: %s" % self.msg
@@ -0,0 +1,100 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+
+class PassRecord:
+    __slots__ = ('name', 'seconds', 'peak_memory', 'counters')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        # bytes allocated by python at the peak of the phase, None for phases that run outside of it (fasm, gcc)
+        self.peak_memory: Optional[int] = None
+        self.counters: Dict[str, int] = {}
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "peak_memory": self.peak_memory,
+            "counters": dict(self.counters)
+        }
+
+
+# called with every finished phase
+PassHook = Callable[[PassRecord], None]
+
+
+class PassTimer:
+    def __init__(self, track_memory: bool = True):
+        # tracemalloc slows everything down quite a bit, it only runs while a python phase does
+        self.track_memory = track_memory
+        self.records: List[PassRecord] = []
+        self.hooks: List[PassHook] = []
+
+    def add_hook(self, hook: PassHook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def phase(self, name: str, external: bool = False):
+        # external phases run another program, there's no memory to trace
+        record = PassRecord(name)
+        tracing = self.track_memory and not external
+        # whoever started tracemalloc before (python -X tracemalloc, a profiler) keeps it running
+        started = tracing and not tracemalloc.is_tracing()
+
+        if started:
+            tracemalloc.start()
+        elif tracing:
+            tracemalloc.reset_peak()
+
+        # memory traced before the phase isn't counted towards its peak
+        baseline = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+
+            if tracing:
+                record.peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+
+            if started:
+                tracemalloc.stop()
+
+            self.records.append(record)
+
+            for hook in self.hooks:
+                hook(record)
+
+    def total_seconds(self) -> float:
+        return sum(record.seconds for record in self.records)
+
+    def as_dict(self) -> dict:
+        return {
+            "passes": [record.as_dict() for record in self.records],
+            "total_seconds": self.total_seconds()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=4)
+
+    def table(self) -> str:
+        rows = [("phase", "time (ms)", "peak memory (KiB)", "counters")]
+
+        for record in self.records:
+            memory = f"{record.peak_memory / 1024:.1f}" if record.peak_memory is not None else "-"
+            counters = ', '.join(f"{name}={value}" for name, value in record.counters.items())
+            rows.append((record.name, f"{record.seconds * 1000:.2f}", memory, counters))
+
+        rows.append(("total", f"{self.total_seconds() * 1000:.2f}", "", ""))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(3)]
+        lines = [f"{row[0]:<{widths[0]}}  {row[1]:>{widths[1]}}  {row[2]:>{widths[2]}}  {row[3]}".rstrip() for row in rows]
+        lines.insert(1, '-' * max(len(line) for line in lines))
+
+        return '\n'.join(lines)
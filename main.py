@@ -3,16 +3,28 @@ import subprocess
 import os
 import argparse
 import shlex
+import json
 
 
-def main(args):
+def main(args, timer: hazardous.PassTimer = None) -> int:
+    # build dashboards pass their own timer (with hooks), --time-passes creates one
+    if timer is None and (args.time_passes or args.time_passes_json):
+        timer = hazardous.PassTimer()
+
+    passes = timer or hazardous.PassTimer(track_memory=False)
+
     file_path = args.source_file
     only_asm = args.asm
+    target = hazardous.TARGETS[args.target]
 
     scanner = hazardous.Scanner()
-    preprocessor = hazardous.Preprocessor()
-    parser = hazardous.Parser()
-    generator = hazardous.Generator()
+    token_cache = hazardous.TokenCache(None if args.no_cache else args.cache_dir)
+    preprocessor = hazardous.Preprocessor(token_cache)
+    parser = hazardous.Parser(lazy_bodies=args.lazy_bodies)
+    folder = hazardous.ConstantFolder() if args.fold else None
+    eliminator = hazardous.DeadProcedureEliminator() if args.prune_procedures else None
+    peephole = hazardous.PeepholeOptimizer() if args.peephole else None
+    generator = hazardous.Generator(allocate_registers=args.regalloc, peephole=peephole, inline=args.inline, target=target)
 
     f = open(file_path, "r")
     code = f.read()
@@ -21,49 +33,217 @@ def main(args):
     fn_no_ext = os.path.splitext(file_path)[0]
     program_dir = os.path.dirname(fn_no_ext)
 
+    include_dirs = ['./', f'./include/{target.name}/', './include/', program_dir + "/"]
+    # -D NAME=VALUE, a NAME on its own is defined as 1
+    defines = dict((define.split('=', 1) + ['1'])[:2] for define in args.defines)
     scanner.input(code, file_path)
-    preprocessed = preprocessor.preprocess(list(scanner.tokens()), ['./', './include/', program_dir + "/"])
-    tree = parser.parse(preprocessed)
-    asm = generator.generate(tree)
 
+    # whole preprocessed units are cached with the included files
+    preprocess_cache = None if args.no_cache else hazardous.PreprocessCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    cached = None
+
+    if preprocess_cache:
+        cache_key = preprocess_cache.key(file_path, include_dirs, *(f"{name}={value}" for name, value in defines.items()))
+
+        with passes.phase("preprocess cache") as record:
+            cached = preprocess_cache.load(cache_key, include_dirs)
+            record.counters["hit"] = int(cached is not None)
+
+    if cached:
+        preprocessed, dependencies = cached
+    elif timer:
+        # every phase is measured on its own, so each one has to finish before the next starts
+        with passes.phase("scan") as record:
+            tokens = list(scanner.tokens())
+            record.counters["tokens"] = len(tokens)
+
+        with passes.phase("preprocess") as record:
+            recorded = hazardous.TokenRecorder(preprocessor.stream(tokens, include_dirs, path=file_path, defines=defines))
+            preprocessed = list(recorded)
+            record.counters["tokens"] = len(preprocessed)
+            record.counters["scanned includes"] = token_cache.misses
+            record.counters["cached includes"] = token_cache.memory_hits + token_cache.disk_hits
+    else:
+        # tokens flow from the scanner through the preprocessor into the parser without being kept around
+        preprocessed = recorded = hazardous.TokenRecorder(preprocessor.stream(scanner.tokens(), include_dirs, path=file_path, defines=defines))
+
+    with passes.phase("parse") as record:
+        tree = parser.parse(preprocessed)
+
+        # walking the whole tree isn't free, only done when someone looks at the numbers
+        if timer:
+            record.counters["nodes"] = sum(1 for node in tree if node is not None for _ in hazardous.walk(node))
+
+            if args.lazy_bodies:
+                record.counters["parsed bodies"] = parser.parsed_bodies
+                record.counters["unreachable bodies"] = parser.skipped_bodies - parser.parsed_bodies
+
+    if not cached:
+        dependencies = preprocessor.dependencies
+
+        if preprocess_cache:
+            preprocess_cache.save(cache_key, recorded, preprocessor.sources, dependencies, preprocessor.resolver.resolved)
+
+    if args.deps:
+        output_path = fn_no_ext + (".asm" if only_asm else target.executable_extension)
+        write_dependencies(args.deps, args.deps_format, output_path, file_path, dependencies)
+
+    if folder:
+        with passes.phase("fold") as record:
+            tree = folder.fold(tree)
+            record.counters["folded"] = folder.total()
+
+    # after folding, branches it pruned can't keep procedures alive anymore
+    if eliminator:
+        with passes.phase("reachability") as record:
+            tree = eliminator.eliminate(tree)
+            record.counters["removed"] = eliminator.removed
+
+    with passes.phase("generate") as record:
+        generator.build(tree)
+        record.counters["procedures"] = len(generator.emitted)
+        record.counters["instructions"] = sum(1 for body in generator.emitted.values() for instruction in body if instruction.opcode != hazardous.Opcode.LABEL)
+
+    # the text assembly is only needed when it's asked for, or when fasm has to assemble it
+    # inline assembly is only text, the encoder can't write it, so it always goes through fasm
+    use_fasm = args.fasm or not target.elf_objects or any(instruction.opcode == hazardous.Opcode.RAW for body in generator.emitted.values() for instruction in body)
     asm_path = fn_no_ext + ".asm"
+    object_path = fn_no_ext + target.object_extension
+
+    if only_asm or use_fasm:
+        with passes.phase("assembly") as record:
+            asm = generator.assembly()
+            record.counters["bytes"] = len(asm)
 
-    with open(asm_path, "w") as f:
-        f.write(asm)
+            with open(asm_path, "w") as f:
+                f.write(asm)
+
+        print(f"[INFO] Generated assembly file: {asm_path}")
+
+    if folder:
+        print(f"[INFO] Folded {folder.folded} expressions, propagated {folder.propagated} constants, pruned {folder.pruned} branches")
+    if eliminator:
+        print(f"[INFO] Removed {eliminator.removed} unreachable procedures")
+    if args.inline:
+        print(f"[INFO] Inlined {generator.inlined} calls")
+    if peephole:
+        print(f"[INFO] Peephole removed {peephole.total_removed()} instructions")
+        for rule_name, removed in peephole.removed.items():
+            if removed:
+                print(f"[INFO]     {rule_name}: {removed}")
 
-    print(f"[INFO] Generated assembly file: {asm_path}")
     if only_asm:
-        exit(0)
-    
-    nasm_exit = subprocess_call_info(["fasm", "-m", "524288", asm_path])
-    if nasm_exit != 0:
-        print(f"FASM exited with code {nasm_exit}\n")
-        exit(1)
+        report(args, timer)
+        return 0
+
+    if use_fasm:
+        with passes.phase("fasm", external=True):
+            nasm_exit = subprocess_call_info(["fasm", "-m", "524288", asm_path, object_path])
+
+        if nasm_exit != 0:
+            print(f"FASM exited with code {nasm_exit}\n")
+            return 1
+    else:
+        with passes.phase("encode") as record:
+            elf = hazardous.ElfWriter().write(generator)
+            record.counters["bytes"] = len(elf)
+
+            with open(object_path, "wb") as f:
+                f.write(elf)
+
+        print(f"[INFO] Generated object file: {object_path}")
+
+    with passes.phase("link", external=True):
+        gcc_exit = link(args, target, object_path, fn_no_ext + target.executable_extension)
+
+    if gcc_exit != 0:
+        return 1
+
+    report(args, timer)
 
-    compile_windows(args, fn_no_ext)
+    if args.run:
+        subprocess_call_info([os.path.join(os.curdir, fn_no_ext + target.executable_extension)])
 
     if args.clean:
-        os.remove(asm_path)
-        os.remove(fn_no_ext + ".obj")
+        if use_fasm:
+            os.remove(asm_path)
+        os.remove(object_path)
+
+    return 0
+
+
+def dependency_path(path: str) -> str:
+    # build systems run from the same directory as the compiler, relative paths keep the depfile portable
+    try:
+        return os.path.relpath(path)
+    except ValueError:
+        # windows, the file is on another drive
+        return path
+
+
+def make_escape(path: str) -> str:
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+def write_dependencies(deps_path: str, deps_format: str, output_path: str, source_path: str, dependencies: dict):
+    # the first file in the graph is the source itself
+    files = [dependency_path(path) for path in list(dependencies)[1:]]
+
+    if deps_format == "json":
+        graph = {
+            dependency_path(path) if path else source_path: [dependency_path(include) for include in includes]
+            for path, includes in dependencies.items()
+        }
+        content = json.dumps({"target": output_path, "source": source_path, "dependencies": files, "graph": graph}, indent=4) + "\n"
+    else:
+        lines = [f"{make_escape(output_path)}: " + " ".join(make_escape(path) for path in [source_path] + files)]
+
+        # an empty rule for every header, so deleting one doesn't break the build (like gcc -MP)
+        for path in files:
+            lines.append(f"\n{make_escape(path)}:")
 
+        content = "\n".join(lines) + "\n"
 
-def compile_windows(args, file_name):
-    gcc_exit = subprocess_call_info(["gcc", "-m64", "-g", file_name + ".obj", "-o", file_name + ".exe"])
+    with open(deps_path, "w") as f:
+        f.write(content)
+
+    print(f"[INFO] Wrote dependencies: {deps_path}")
+
+
+def link(args, target, object_path, output_path) -> int:
+    gcc_exit = subprocess_call_info(target.link_arguments(object_path, output_path))
 
     if gcc_exit != 0:
         print(f"GCC exited with code {gcc_exit}\n")
-        exit(1)
 
-    
-    if args.run:
-        subprocess_call_info([f".\{file_name}.exe"])
+    return gcc_exit
+
+
+def report(args, timer):
+    if not timer:
+        return
+
+    if args.time_passes:
+        print(timer.table())
+
+    if args.time_passes_json:
+        with open(args.time_passes_json, "w") as f:
+            f.write(timer.to_json())
+
+        print(f"[INFO] Wrote pass timings: {args.time_passes_json}")
 
 
 
 def subprocess_call_info(cmd, silent: bool=False) -> int:
     if not silent:
         print("[CMD] %s" % " ".join(map(shlex.quote, cmd)))
-    return subprocess.call(cmd)
+
+    try:
+        return subprocess.call(cmd)
+    except FileNotFoundError:
+        # what a shell returns for a missing command
+        print(f"[ERROR] '{cmd[0]}' not found")
+        return 127
 
 
 def handle_args():
@@ -72,11 +252,34 @@ def handle_args():
     parser.add_argument('--asm', action='store_true', help='Only generates the assembly file')
     parser.add_argument('--run', action='store_true', help='Run the program after compiling (if successful)')
     parser.add_argument('--clean', action='store_true', help='Cleans the ASM and OBJ file')
+    parser.add_argument('--regalloc', action='store_true', help='Keep expression temporaries in registers instead of the stack')
+    parser.add_argument('--fold', action='store_true', help='Fold constant expressions and prune constant branches before generating')
+    parser.add_argument('--inline', action='store_true', help='Inline small procedures and procedures with a single call site')
+    parser.add_argument('--target', choices=hazardous.TARGETS.keys(), help='Platform to generate code for, defaults to the current one on Windows and Linux')
+    parser.add_argument('--fasm', action='store_true', help='Assemble the text output with fasm instead of writing the object file directly (ELF targets), programs with inline assembly always are')
+    parser.add_argument('--peephole', action='store_true', help='Run the peephole optimizer over the generated procedures')
+    parser.add_argument('--prune-procedures', action='store_true', help='Leave out procedures that main and class initializers can never call before generating')
+    parser.add_argument('--lazy-bodies', action='store_true', help='Only parse the bodies of procedures reachable from main or always kept, the others are never checked')
+    parser.add_argument('-D', dest='defines', action='append', default=[], metavar='NAME[=VALUE]', help='Define a macro before preprocessing, for %%ifdef/%%ifndef and expansion (VALUE defaults to 1)')
+    parser.add_argument('--cache-dir', type=str, default='.hzcache', metavar='DIR', help='Directory where scanned include files and preprocessed output are cached between compiles')
+    parser.add_argument('--cache-size', type=int, default=64, metavar='MB', help='Size the preprocessed output cache is kept under, least recently used units are removed first')
+    parser.add_argument('--no-cache', action='store_true', help="Don't read or write the on-disk include and preprocessed output caches")
+    parser.add_argument('-M', '--deps', type=str, metavar='FILE', help='Write the files the program depends on to FILE, as a Makefile/ninja depfile or JSON')
+    parser.add_argument('--deps-format', choices=['make', 'json'], default='make', help='Format of the --deps file')
+    parser.add_argument('--time-passes', action='store_true', help='Print the time, peak memory and item counts of every compile phase (tracing memory slows compiling down)')
+    parser.add_argument('--time-passes-json', type=str, metavar='FILE', help='Write the compile phase measurements to FILE as JSON')
     args = parser.parse_args()
 
+    if args.target is None:
+        try:
+            args.target = hazardous.host_target().name
+        except hazardous.TargetError as e:
+            print(e)
+            exit(1)
+
     try:
-        main(args)
-    except (hazardous.ParserError, hazardous.ScannerError, hazardous.GeneratorError, hazardous.PreprocessorError) as e:
+        exit(main(args))
+    except (hazardous.ParserError, hazardous.ScannerError, hazardous.GeneratorError, hazardous.PreprocessorError, hazardous.EncoderError) as e:
         print(e)
         exit(1)
 